@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Compare gunicorn worker models on the I/O-bound OTP endpoints
+
+Starts one gunicorn worker per run (sync, gthread and gevent by default)
+against a seeded scratch database and fires concurrent /send-otp and
+/verify-otp requests at it. The local OTP provider sleeps for
+--provider-latency-ms on every call to stand in for Twilio, so the numbers
+show how many requests a single worker keeps in flight while it waits.
+
+    python benchmark_workers.py
+    python benchmark_workers.py --concurrency 500 --requests 4000 --provider-latency-ms 300
+    python benchmark_workers.py --worker-classes gthread,gevent --threads 8
+"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmark_funnel import OTP_CODE, percentile, phone_number, seed_database
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare gunicorn worker models on the OTP endpoints')
+    parser.add_argument('--worker-classes', default='sync,gthread,gevent', help='comma-separated gunicorn worker classes')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--concurrency', type=int, default=200, help='requests in flight from the client')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per worker class')
+    parser.add_argument('--provider-latency-ms', type=int, default=200, help='simulated OTP provider round trip')
+    parser.add_argument('--users', type=int, default=2000, help='users to seed (each phone gets a few OTPs)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for data')
+    parser.add_argument('--database-url', help='SQLAlchemy URL of a scratch database; it is dropped and reseeded '
+                                               '(default: hotel_workers_bench.db in the temp directory)')
+    return parser.parse_args()
+
+def server_environment(args, database_url, worker_class):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': database_url,
+        'OTP_PROVIDER': 'local',
+        'OTP_LOCAL_CODE': OTP_CODE,
+        'OTP_LOCAL_LATENCY_MS': str(args.provider_latency_ms),
+        'OTP_ASYNC_SEND': 'false',  # make /send-otp wait on the provider like a real send
+        'MAX_OTP_PER_IP_PER_HOUR': str(10 ** 9),
+        'PAYMENT_GATEWAY': 'stub',
+        'MAIL_SUPPRESS_SEND': 'true',
+        'SWEEPER_IN_PROCESS': 'false',
+        'LOG_LEVEL': 'WARNING',
+        'SLOW_QUERY_MS': '60000',
+        'EXPLAIN_QUERY_TAGS': '',
+        'GUNICORN_WORKER_CLASS': worker_class,
+        'GUNICORN_THREADS': str(args.threads if worker_class == 'gthread' else 1),
+        'WEB_CONCURRENCY': '1',
+    })
+    return env
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(args, database_url, worker_class):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}'],
+        env=server_environment(args, database_url, worker_class),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn ({worker_class}) exited with status {server.returncode}')
+        try:
+            requests.get(f'{base_url}/metrics', timeout=1)
+            return server, base_url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not start')
+
+def run_load(args, base_url):
+    """Fire the requests with `concurrency` in flight; returns (latencies, failures, wall seconds)"""
+    sessions = threading.local()
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+
+    def one_request(index):
+        nonlocal failures
+        if not hasattr(sessions, 'http'):
+            sessions.http = requests.Session()
+        # Alternate send and verify so both provider calls are exercised
+        phone = phone_number(index // 2 % args.users)
+        if index % 2 == 0:
+            url, payload = '/send-otp', {'phone': phone, 'purpose': 'login'}
+        else:
+            url, payload = '/verify-otp', {'phone': phone, 'otp': OTP_CODE, 'purpose': 'login'}
+        started = time.perf_counter()
+        try:
+            response = sessions.http.post(base_url + url, json=payload, timeout=120)
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                failures += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one_request, range(args.requests)))
+    return sorted(latencies), failures, time.perf_counter() - started
+
+def main():
+    args = parse_args()
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.gettempdir(), 'hotel_workers_bench.db')}"
+    os.environ.update({'DATABASE_URL': database_url, 'LOG_LEVEL': 'WARNING', 'SWEEPER_IN_PROCESS': 'false'})
+
+    import test_razorpay as hotel
+    seed_args = argparse.Namespace(rooms=3, users=args.users, bookings=0)
+    print(f'Seeding {args.users} users...')
+    seed_database(hotel, seed_args, random.Random(args.seed))
+
+    print(f'{args.requests} OTP requests, {args.concurrency} in flight, provider round trip {args.provider_latency_ms} ms, 1 worker\n')
+    print(f"{'worker':<10}{'requests':>9}{'failed':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    for worker_class in args.worker_classes.split(','):
+        server, base_url = start_server(args, database_url, worker_class)
+        try:
+            latencies, failures, wall_seconds = run_load(args, base_url)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{worker_class:<10}{len(latencies):>9}{failures:>8}{percentile(latencies, 0.50) * 1000:>10.1f}"
+              f"{percentile(latencies, 0.95) * 1000:>10.1f}{percentile(latencies, 0.99) * 1000:>10.1f}"
+              f"{len(latencies) / wall_seconds:>9.1f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
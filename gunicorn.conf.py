@@ -0,0 +1,43 @@
+"""
+Gunicorn settings: build the app once in the master and fork workers from it
+
+    gunicorn                                   # picks up this file from the working directory
+    GUNICORN_WORKER_CLASS=gevent gunicorn      # cooperative workers for I/O-bound traffic
+"""
+import gc
+import os
+
+# 'gevent' runs each request on a greenlet. Twilio, Razorpay (requests),
+# SMTP and PyMySQL calls then yield while they wait on the network, so one
+# worker keeps hundreds of OTP/payment requests in flight instead of
+# GUNICORN_THREADS of them.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    # Patch before the app is preloaded so its locks and threads are cooperative too
+    from gevent import monkey
+    monkey.patch_all()
+
+wsgi_app = 'test_razorpay:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+preload_app = True
+# Set to false when deploys run `flask --app test_razorpay migrate-db` as a separate step
+migrate_on_start = os.environ.get('MIGRATE_ON_START', 'true').lower() == 'true'
+
+def on_starting(server):
+    from test_razorpay import check_rate_limit_backend
+    check_rate_limit_backend(server.cfg.workers)
+
+def when_ready(server):
+    from test_razorpay import db, migrate_database, warm_up
+    app = server.app.wsgi()
+    if migrate_on_start:
+        # Once, in the master, before any worker forks
+        with app.app_context():
+            migrate_database()
+            db.create_all()
+    warm_up(app)
+    # Keep the collector from writing to (and un-sharing) the preloaded objects
+    gc.freeze()
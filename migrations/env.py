@@ -0,0 +1,39 @@
+"""Alembic environment: runs migrations against the application's database"""
+from logging.config import fileConfig
+
+from alembic import context
+
+config = context.config
+if config.config_file_name is not None and 'connection' not in config.attributes:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+def run_migrations(connection, target_metadata):
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    from test_razorpay import create_app, db
+
+    # migrate_database() passes the connection it already holds
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        run_migrations(connection, db.metadata)
+        return
+
+    app = create_app()
+    with app.app_context(), db.engine.connect() as connection:
+        run_migrations(connection, db.metadata)
+        connection.commit()
+
+def run_migrations_offline():
+    from test_razorpay import SQLALCHEMY_DATABASE_URI, db
+
+    context.configure(url=SQLALCHEMY_DATABASE_URI, target_metadata=db.metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
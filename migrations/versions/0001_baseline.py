@@ -0,0 +1,123 @@
+"""Baseline: the schema as built by db.create_all() before migrations existed
+
+Creates the original admin, users, otp_records, rooms, bookings and payments
+tables with their single-column indexes, so `alembic upgrade head` builds an
+empty database from scratch. Databases that predate migrations already have
+these tables and are stamped at this revision instead (see
+migrate_database()).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('admin'):
+        op.create_table(
+            'admin',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('username', sa.String(50), nullable=False, unique=True),
+            sa.Column('password_hash', sa.String(255), nullable=False),
+        )
+    if not inspector.has_table('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('phone', sa.String(20), nullable=False),
+            sa.Column('email', sa.String(120), nullable=True),
+            sa.Column('full_name', sa.String(100), nullable=False),
+            sa.Column('is_verified', sa.Boolean),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('last_login', sa.DateTime),
+        )
+        op.create_index('ix_users_phone', 'users', ['phone'], unique=True)
+        op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    if not inspector.has_table('otp_records'):
+        op.create_table(
+            'otp_records',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id'), nullable=True),
+            sa.Column('phone', sa.String(20), nullable=False),
+            sa.Column('purpose', sa.String(20), nullable=False),
+            sa.Column('verification_sid', sa.String(100)),
+            sa.Column('status', sa.String(20)),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('verified_at', sa.DateTime),
+            sa.Column('ip_address', sa.String(50)),
+        )
+        op.create_index('ix_otp_records_user_id', 'otp_records', ['user_id'])
+        op.create_index('ix_otp_records_phone', 'otp_records', ['phone'])
+        op.create_index('ix_otp_records_created_at', 'otp_records', ['created_at'])
+    if not inspector.has_table('rooms'):
+        op.create_table(
+            'rooms',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('room_number', sa.String(10), nullable=False),
+            sa.Column('room_type', sa.String(50), nullable=False),
+            sa.Column('price_per_night', sa.Float, nullable=False),
+            sa.Column('capacity', sa.Integer, nullable=False),
+            sa.Column('description', sa.Text),
+            sa.Column('amenities', sa.Text),
+            sa.Column('image_url', sa.String(200)),
+            sa.Column('is_available', sa.Boolean),
+        )
+        op.create_index('ix_rooms_room_number', 'rooms', ['room_number'], unique=True)
+        op.create_index('ix_rooms_room_type', 'rooms', ['room_type'])
+        op.create_index('ix_rooms_is_available', 'rooms', ['is_available'])
+    if not inspector.has_table('bookings'):
+        op.create_table(
+            'bookings',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('room_id', sa.Integer, sa.ForeignKey('rooms.id'), nullable=False),
+            sa.Column('check_in', sa.Date, nullable=False),
+            sa.Column('check_out', sa.Date, nullable=False),
+            sa.Column('guests', sa.Integer, nullable=False),
+            sa.Column('total_price', sa.Float, nullable=False),
+            sa.Column('status', sa.String(20)),
+            sa.Column('booking_reference', sa.String(20)),
+            sa.Column('special_requests', sa.Text),
+            sa.Column('created_at', sa.DateTime),
+        )
+        op.create_index('ix_bookings_user_id', 'bookings', ['user_id'])
+        op.create_index('ix_bookings_room_id', 'bookings', ['room_id'])
+        op.create_index('ix_bookings_check_in', 'bookings', ['check_in'])
+        op.create_index('ix_bookings_check_out', 'bookings', ['check_out'])
+        op.create_index('ix_bookings_status', 'bookings', ['status'])
+        op.create_index('ix_bookings_booking_reference', 'bookings', ['booking_reference'], unique=True)
+        op.create_index('ix_bookings_created_at', 'bookings', ['created_at'])
+    if not inspector.has_table('payments'):
+        op.create_table(
+            'payments',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('booking_id', sa.Integer, sa.ForeignKey('bookings.id'), nullable=False),
+            sa.Column('amount', sa.Float, nullable=False),
+            sa.Column('payment_method', sa.String(20), nullable=False),
+            sa.Column('payment_status', sa.String(20)),
+            sa.Column('transaction_id', sa.String(100)),
+            sa.Column('razorpay_order_id', sa.String(100)),
+            sa.Column('razorpay_payment_id', sa.String(100)),
+            sa.Column('razorpay_signature', sa.String(256)),
+            sa.Column('qr_code_data', sa.Text),
+            sa.Column('payment_date', sa.DateTime),
+            sa.Column('created_at', sa.DateTime),
+        )
+        op.create_index('ix_payments_booking_id', 'payments', ['booking_id'])
+        op.create_index('ix_payments_payment_status', 'payments', ['payment_status'])
+        op.create_index('ix_payments_transaction_id', 'payments', ['transaction_id'], unique=True)
+        op.create_index('ix_payments_razorpay_order_id', 'payments', ['razorpay_order_id'])
+        op.create_index('ix_payments_razorpay_payment_id', 'payments', ['razorpay_payment_id'])
+
+
+def downgrade():
+    for table in ['payments', 'bookings', 'rooms', 'otp_records', 'users', 'admin']:
+        op.drop_table(table)
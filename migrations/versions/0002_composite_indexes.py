@@ -0,0 +1,62 @@
+"""Composite indexes for the hot booking and OTP queries
+
+Replaces the single-column indexes on bookings (room_id, user_id, check_in,
+check_out, status, created_at) and otp_records.phone with composite indexes
+matching how those columns are filtered together. Each new index is created
+before the old ones are dropped, so MySQL foreign keys always keep an index.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+COMPOSITE_INDEXES = [
+    ('bookings', 'ix_bookings_room_status_dates', ['room_id', 'status', 'check_in', 'check_out']),
+    ('bookings', 'ix_bookings_status_created', ['status', 'created_at']),
+    ('bookings', 'ix_bookings_user_created', ['user_id', 'created_at']),
+    ('otp_records', 'ix_otp_records_phone_created', ['phone', 'created_at']),
+    ('otp_records', 'ix_otp_records_phone_purpose_created', ['phone', 'purpose', 'created_at']),
+]
+
+REDUNDANT_INDEXES = [
+    ('bookings', 'ix_bookings_room_id', ['room_id']),
+    ('bookings', 'ix_bookings_user_id', ['user_id']),
+    ('bookings', 'ix_bookings_check_in', ['check_in']),
+    ('bookings', 'ix_bookings_check_out', ['check_out']),
+    ('bookings', 'ix_bookings_status', ['status']),
+    ('bookings', 'ix_bookings_created_at', ['created_at']),
+    ('otp_records', 'ix_otp_records_phone', ['phone']),
+]
+
+
+def existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def create_indexes(indexes):
+    for table, name, columns in indexes:
+        if name not in existing_indexes(table):
+            op.create_index(name, table, columns)
+
+
+def drop_indexes(indexes):
+    for table, name, _ in indexes:
+        if name in existing_indexes(table):
+            op.drop_index(name, table_name=table)
+
+
+def upgrade():
+    create_indexes(COMPOSITE_INDEXES)
+    drop_indexes(REDUNDANT_INDEXES)
+
+
+def downgrade():
+    create_indexes(REDUNDANT_INDEXES)
+    drop_indexes(COMPOSITE_INDEXES)
@@ -0,0 +1,25 @@
+"""Group reference on bookings for multi-room group bookings
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('bookings')}
+    if 'group_reference' not in columns:
+        op.add_column('bookings', sa.Column('group_reference', sa.String(20), nullable=True))
+        op.create_index('ix_bookings_group_reference', 'bookings', ['group_reference'])
+
+
+def downgrade():
+    op.drop_index('ix_bookings_group_reference', table_name='bookings')
+    op.drop_column('bookings', 'group_reference')
@@ -0,0 +1,35 @@
+"""Rate rules for the pricing engine
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table('room_rates'):
+        return
+    op.create_table(
+        'room_rates',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.String(100), nullable=False),
+        sa.Column('room_type', sa.String(50)),
+        sa.Column('start_date', sa.Date),
+        sa.Column('end_date', sa.Date),
+        sa.Column('weekdays', sa.String(20)),
+        sa.Column('multiplier', sa.Float, nullable=False),
+        sa.Column('created_at', sa.DateTime),
+    )
+    op.create_index('ix_room_rates_room_type', 'room_rates', ['room_type'])
+
+
+def downgrade():
+    op.drop_index('ix_room_rates_room_type', table_name='room_rates')
+    op.drop_table('room_rates')
@@ -0,0 +1,35 @@
+"""Indexed QR code digest on payments
+
+The QR image route looked payments up by qr_code_data, an unindexed TEXT
+column. The digest now has its own indexed column; digests already
+stored in qr_code_data are copied over.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('payments')}
+    if 'qr_code_digest' not in columns:
+        op.add_column('payments', sa.Column('qr_code_digest', sa.String(64), nullable=True))
+        op.create_index('ix_payments_qr_code_digest', 'payments', ['qr_code_digest'])
+    # Older rows hold a data URI instead of a 64-character hex digest
+    op.execute(
+        "UPDATE payments SET qr_code_digest = qr_code_data "
+        "WHERE payment_method = 'qr_code' AND qr_code_digest IS NULL "
+        "AND qr_code_data IS NOT NULL AND length(qr_code_data) = 64"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_payments_qr_code_digest', table_name='payments')
+    op.drop_column('payments', 'qr_code_digest')
@@ -0,0 +1,44 @@
+"""Shared OTP rate limit tables
+
+Rate limits default to the database backend, so every gunicorn worker
+counts against the same sliding windows.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('rate_limit_keys'):
+        op.create_table(
+            'rate_limit_keys',
+            sa.Column('limit_key', sa.String(100), primary_key=True),
+            sa.Column('last_hit_at', sa.Float, nullable=False),
+        )
+        op.create_index('ix_rate_limit_keys_last_hit_at', 'rate_limit_keys', ['last_hit_at'])
+    if not inspector.has_table('rate_limit_hits'):
+        op.create_table(
+            'rate_limit_hits',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('limit_key', sa.String(100), nullable=False),
+            sa.Column('hit_at', sa.Float, nullable=False),
+        )
+        op.create_index('ix_rate_limit_hits_key_hit_at', 'rate_limit_hits', ['limit_key', 'hit_at'])
+        op.create_index('ix_rate_limit_hits_hit_at', 'rate_limit_hits', ['hit_at'])
+
+
+def downgrade():
+    op.drop_index('ix_rate_limit_hits_hit_at', table_name='rate_limit_hits')
+    op.drop_index('ix_rate_limit_hits_key_hit_at', table_name='rate_limit_hits')
+    op.drop_table('rate_limit_hits')
+    op.drop_index('ix_rate_limit_keys_last_hit_at', table_name='rate_limit_keys')
+    op.drop_table('rate_limit_keys')
@@ -0,0 +1,88 @@
+"""Tables that were only ever built by db.create_all()
+
+room_nights (double-booking key), email_outbox, webhook_events,
+daily_stats and cache_versions, so `alembic upgrade head` alone yields the
+full schema. Databases where create_all() already built them are left as
+they are.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('room_nights'):
+        op.create_table(
+            'room_nights',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('room_id', sa.Integer, sa.ForeignKey('rooms.id'), nullable=False),
+            sa.Column('night', sa.Date, nullable=False),
+            sa.Column('booking_id', sa.Integer, sa.ForeignKey('bookings.id'), nullable=False),
+            sa.UniqueConstraint('room_id', 'night', name='uq_room_nights_room_night'),
+        )
+        op.create_index('ix_room_nights_booking_id', 'room_nights', ['booking_id'])
+    if not inspector.has_table('email_outbox'):
+        op.create_table(
+            'email_outbox',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('recipient', sa.String(120), nullable=False),
+            sa.Column('subject', sa.String(200), nullable=False),
+            sa.Column('body', sa.Text, nullable=False),
+            sa.Column('status', sa.String(20)),
+            sa.Column('attempts', sa.Integer),
+            sa.Column('next_attempt_at', sa.DateTime),
+            sa.Column('claim_token', sa.String(32)),
+            sa.Column('claimed_at', sa.DateTime),
+            sa.Column('last_error', sa.Text),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('sent_at', sa.DateTime),
+        )
+        op.create_index('ix_email_outbox_status_next_attempt', 'email_outbox', ['status', 'next_attempt_at'])
+        op.create_index('ix_email_outbox_claim_token', 'email_outbox', ['claim_token'])
+    if not inspector.has_table('webhook_events'):
+        op.create_table(
+            'webhook_events',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('provider', sa.String(20), nullable=False),
+            sa.Column('event_id', sa.String(100), nullable=False, unique=True),
+            sa.Column('event_type', sa.String(50), nullable=False),
+            sa.Column('payload', sa.Text, nullable=False),
+            sa.Column('status', sa.String(20)),
+            sa.Column('claim_token', sa.String(32)),
+            sa.Column('claimed_at', sa.DateTime),
+            sa.Column('error', sa.Text),
+            sa.Column('received_at', sa.DateTime),
+            sa.Column('processed_at', sa.DateTime),
+        )
+        op.create_index('ix_webhook_events_status_id', 'webhook_events', ['status', 'id'])
+        op.create_index('ix_webhook_events_claim_token', 'webhook_events', ['claim_token'])
+    if not inspector.has_table('daily_stats'):
+        op.create_table(
+            'daily_stats',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('day', sa.Date, nullable=False),
+            sa.Column('room_type', sa.String(50), nullable=False),
+            sa.Column('revenue', sa.Float, nullable=False),
+            sa.Column('room_nights_sold', sa.Integer, nullable=False),
+            sa.UniqueConstraint('day', 'room_type', name='uq_daily_stats_day_room_type'),
+        )
+    if not inspector.has_table('cache_versions'):
+        op.create_table(
+            'cache_versions',
+            sa.Column('name', sa.String(50), primary_key=True),
+            sa.Column('version', sa.Integer, nullable=False),
+        )
+
+
+def downgrade():
+    for table in ['cache_versions', 'daily_stats', 'webhook_events', 'email_outbox', 'room_nights']:
+        op.drop_table(table)
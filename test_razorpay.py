@@ -1,19 +1,125 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Flask, Blueprint, current_app, render_template, request, jsonify, session, redirect, url_for, flash, abort, Response, stream_with_context, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail, Message
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 import secrets
+import bisect
+import threading
+import time
+import hashlib
+import hmac
+import logging
+import contextvars
+import weakref
+from collections import OrderedDict, deque
 import qrcode
-from io import BytesIO
-import base64
+import qrcode.image.svg
+from io import BytesIO, StringIO
 import json
+import click
+import csv
+import gzip
+import mimetypes
 import os
+import numpy as np
 import razorpay
-from twilio.rest import Client
-from sqlalchemy import func
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from alembic import command as alembic_command
+    from alembic.config import Config as AlembicConfig
+except ImportError:
+    alembic_command = None
+from sqlalchemy import func, inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session, joinedload, selectinload, configure_mappers
+from sqlalchemy.orm.attributes import set_committed_value
+from contextlib import contextmanager
+
+def load_secret_key(app):
+    """SECRET_KEY from the environment, else one persisted in the instance folder.
+    
+    A per-process random key would log users out on every restart and make
+    each gunicorn worker reject the others' session cookies. The key file is
+    published with os.link so concurrently starting workers agree on one key.
+    """
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    
+    os.makedirs(app.instance_path, exist_ok=True)
+    key_path = os.path.join(app.instance_path, 'secret_key')
+    if not os.path.exists(key_path):
+        temp_path = f'{key_path}.{os.getpid()}'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as key_file:
+            key_file.write(secrets.token_hex(32))
+        try:
+            os.link(temp_path, key_path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    with open(key_path) as key_file:
+        return key_file.read().strip()
+
+# ==================== LOGGING ====================
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()  # 'json' or 'text'
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra` fields"""
+    
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+    
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self.RESERVED)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RequestContextFilter(logging.Filter):
+    """Tag records logged during a request with its id and route"""
+    
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.route = request.url_rule.rule if request.url_rule else None
+        return True
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    handler.addFilter(RequestContextFilter())
+    hotel_logger = logging.getLogger('hotel_booking')
+    hotel_logger.handlers[:] = [handler]
+    hotel_logger.setLevel(LOG_LEVEL)
+    hotel_logger.propagate = False
+    return hotel_logger
+
+logger = configure_logging()
 
 # ==================== DATABASE CONFIGURATION ====================
 MYSQL_USER = os.environ.get('MYSQL_USER', 'root')
@@ -23,29 +129,42 @@ MYSQL_PORT = os.environ.get('MYSQL_PORT', '3306')
 MYSQL_DATABASE = os.environ.get('MYSQL_DATABASE', 'hotel_booking')
 
 USE_MYSQL = os.environ.get('USE_MYSQL', 'false').lower() == 'true'
+DATABASE_URL = os.environ.get('DATABASE_URL')  # full SQLAlchemy URL, e.g. a scratch database for benchmarks
 
-if USE_MYSQL:
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}'
-    print("Using MySQL Database")
+if DATABASE_URL:
+    SQLALCHEMY_DATABASE_URI = DATABASE_URL
+elif USE_MYSQL:
+    SQLALCHEMY_DATABASE_URI = f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}'
 else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hotel_booking.db'
-    print("Using SQLite Database")
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_POOL_SIZE'] = 10
-app.config['SQLALCHEMY_POOL_RECYCLE'] = 3600
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///hotel_booking.db'
 
 # Email configuration
-app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
-app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'false').lower() == 'true'
-app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'your-email@gmail.com')
-app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', 'your-app-password')
+MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'false').lower() == 'true'
+MAIL_USERNAME = os.environ.get('MAIL_USERNAME', 'your-email@gmail.com')
+MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', 'your-app-password')
+MAIL_SUPPRESS_SEND = os.environ.get('MAIL_SUPPRESS_SEND', 'false').lower() == 'true'
 
 # Razorpay Configuration
 RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID', 'rzp_test_S68SvYAAXu0cPt')
 RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET', '41iyf1rzanqDo2tEdY81shL1')
 
+# Payment gateway: 'razorpay' or 'stub' (in-memory fake for offline development and benchmarks)
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'razorpay').lower()
+PAYMENT_STUB_LATENCY_MS = int(os.environ.get('PAYMENT_STUB_LATENCY_MS', 0))
+RAZORPAY_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('RAZORPAY_CONNECT_TIMEOUT_SECONDS', 3))
+RAZORPAY_READ_TIMEOUT_SECONDS = float(os.environ.get('RAZORPAY_READ_TIMEOUT_SECONDS', 10))
+RAZORPAY_POOL_SIZE = int(os.environ.get('RAZORPAY_POOL_SIZE', 10))
+RAZORPAY_PRECREATE_ORDERS = os.environ.get('RAZORPAY_PRECREATE_ORDERS', 'true').lower() == 'true'
+
+# Razorpay webhooks and reconciliation
+RAZORPAY_WEBHOOK_SECRET = os.environ.get('RAZORPAY_WEBHOOK_SECRET')
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 100))
+RECONCILE_INTERVAL_SECONDS = int(os.environ.get('RECONCILE_INTERVAL_SECONDS', 300))
+RECONCILE_AFTER_MINUTES = int(os.environ.get('RECONCILE_AFTER_MINUTES', 10))
+RECONCILE_LOOKBACK_HOURS = int(os.environ.get('RECONCILE_LOOKBACK_HOURS', 48))
+
 # Twilio Verify Configuration
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', 'AC08881a90f6eb1b605e62ca9b17aeb573')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', 'ad27eb1342919176ca37c17f7b393f5d')
@@ -53,30 +172,323 @@ TWILIO_VERIFY_SERVICE_SID = os.environ.get('TWILIO_VERIFY_SERVICE_SID', 'VA1429e
 
 # OTP Configuration
 MAX_OTP_RESEND_PER_DAY = 10
+OTP_PROVIDER = os.environ.get('OTP_PROVIDER', 'twilio').lower()  # 'twilio' or 'local'
+OTP_LOCAL_CODE = os.environ.get('OTP_LOCAL_CODE')  # fixed code for the local provider (load tests)
+OTP_LOCAL_LATENCY_MS = int(os.environ.get('OTP_LOCAL_LATENCY_MS', 0))  # simulated provider round trip
+OTP_ASYNC_SEND = os.environ.get('OTP_ASYNC_SEND', 'true').lower() == 'true'
+OTP_SEND_WORKERS = int(os.environ.get('OTP_SEND_WORKERS', 8))
+TWILIO_TIMEOUT_SECONDS = float(os.environ.get('TWILIO_TIMEOUT_SECONDS', 5))
+OTP_BREAKER_FAILURES = int(os.environ.get('OTP_BREAKER_FAILURES', 5))
+OTP_BREAKER_RESET_SECONDS = int(os.environ.get('OTP_BREAKER_RESET_SECONDS', 30))
 
-# Initialize services
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+# OTP rate limits (sliding windows). 'database' and 'redis' share the counters
+# between workers; 'memory' is per process, so it refuses to run under more than one
+OTP_PHONE_WINDOW_SECONDS = 24 * 3600
+OTP_IP_WINDOW_SECONDS = 3600
+MAX_OTP_PER_IP_PER_HOUR = int(os.environ.get('MAX_OTP_PER_IP_PER_HOUR', 30))
+REDIS_URL = os.environ.get('REDIS_URL')
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'redis' if REDIS_URL else 'database').lower()
 
-# Initialize Twilio Verify Client
-try:
-    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-    print("✅ Twilio Verify initialized successfully")
-except Exception as e:
-    twilio_client = None
-    print(f"⚠️  Twilio not configured: {e}")
+# Admin bookings API page sizes
+ADMIN_BOOKINGS_PAGE_SIZE = 50
+ADMIN_BOOKINGS_MAX_PAGE_SIZE = 200
+ADMIN_BOOKINGS_EXPORT_CHUNK = 500
+
+# Booking statuses that hold a room
+ACTIVE_BOOKING_STATUSES = ['pending', 'confirmed']
+# Every status a booking can be in; payments have their own
+BOOKING_STATUSES = ['pending', 'confirmed', 'cancelled', 'expired']
+# Payment statuses after money was captured; a later capture callback for them changes nothing
+SETTLED_PAYMENT_STATUSES = ['completed', 'refund_pending', 'refunding', 'refunded', 'refund_failed']
+
+# Upper bound on date ranges accepted by the bulk availability endpoint
+MAX_BULK_AVAILABILITY_RANGES = 62
+
+# Most rooms a single group booking may hold
+MAX_GROUP_BOOKING_ROOMS = int(os.environ.get('MAX_GROUP_BOOKING_ROOMS', 20))
+
+# Fresh booking references tried when a generated one is already taken
+BOOKING_REFERENCE_ATTEMPTS = 3
+
+# Expiry sweeper: pending holds are released after BOOKING_HOLD_MINUTES
+BOOKING_HOLD_MINUTES = int(os.environ.get('BOOKING_HOLD_MINUTES', 30))
+OTP_RECORD_RETENTION_DAYS = int(os.environ.get('OTP_RECORD_RETENTION_DAYS', 30))
+SWEEP_BATCH_SIZE = int(os.environ.get('SWEEP_BATCH_SIZE', 200))
+SWEEP_MAX_BATCHES = int(os.environ.get('SWEEP_MAX_BATCHES', 50))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('SWEEP_INTERVAL_SECONDS', 60))
+SWEEPER_IN_PROCESS = os.environ.get('SWEEPER_IN_PROCESS', 'true').lower() == 'true'
+
+# Room catalog cache: poll the shared version counter at most this often
+ROOM_CATALOG_SHARED_VERSION = os.environ.get('ROOM_CATALOG_SHARED_VERSION', 'true').lower() == 'true'
+ROOM_CATALOG_VERSION_CHECK_SECONDS = int(os.environ.get('ROOM_CATALOG_VERSION_CHECK_SECONDS', 5))
+
+# Seconds between background rebuilds of each worker's in-memory occupancy index
+OCCUPANCY_INDEX_MAX_AGE = int(os.environ.get('OCCUPANCY_INDEX_MAX_AGE', 30))
+
+# Availability calendar: cached month grids, rebuilt when older than the max age
+AVAILABILITY_CALENDAR_MAX_AGE = int(os.environ.get('AVAILABILITY_CALENDAR_MAX_AGE', 30))
+AVAILABILITY_CALENDAR_SIZE = int(os.environ.get('AVAILABILITY_CALENDAR_SIZE', 256))
+AVAILABILITY_CALENDAR_MONTHS_BACK = int(os.environ.get('AVAILABILITY_CALENDAR_MONTHS_BACK', 12))
+AVAILABILITY_CALENDAR_MONTHS_AHEAD = int(os.environ.get('AVAILABILITY_CALENDAR_MONTHS_AHEAD', 24))
+
+# Pricing: nightly rate tables per room type, precomputed PRICING_HORIZON_DAYS ahead
+PRICING_HORIZON_DAYS = int(os.environ.get('PRICING_HORIZON_DAYS', 365))
+PRICING_TABLE_MAX_AGE = int(os.environ.get('PRICING_TABLE_MAX_AGE', 60))
+PRICING_WEEKEND_MULTIPLIER = float(os.environ.get('PRICING_WEEKEND_MULTIPLIER', 1.0))
+PRICING_WEEKEND_DAYS = [int(day) for day in os.environ.get('PRICING_WEEKEND_DAYS', '4,5').split(',')]  # Friday and Saturday nights
+# "occupancy:multiplier" pairs, e.g. "0.7:1.1,0.9:1.25" raises a room type's rate once 70% / 90% of it is held
+PRICING_OCCUPANCY_TIERS = sorted(
+    tuple(float(part) for part in tier.split(':'))
+    for tier in os.environ.get('PRICING_OCCUPANCY_TIERS', '').split(',') if tier
+)
+
+# Outbound email delivery
+EMAIL_WORKER_THREADS = int(os.environ.get('EMAIL_WORKER_THREADS', 2))
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 20))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 6))
+EMAIL_RETRY_BASE_SECONDS = int(os.environ.get('EMAIL_RETRY_BASE_SECONDS', 30))
+EMAIL_POLL_SECONDS = int(os.environ.get('EMAIL_POLL_SECONDS', 15))
+EMAIL_CLAIM_TIMEOUT_SECONDS = int(os.environ.get('EMAIL_CLAIM_TIMEOUT_SECONDS', 300))  # 'sending' claims older than this are retaken
 
 # UPI Payment Configuration
 UPI_ID = os.environ.get('UPI_ID', '9209329727@ptaxis')
 MERCHANT_NAME = os.environ.get('MERCHANT_NAME', 'Aman Rajbhar')
 
-db = SQLAlchemy(app)
-mail = Mail(app)
+# UPI QR rendering: 'png' or 'svg' (smaller and cheaper to render)
+QR_IMAGE_FORMAT = os.environ.get('QR_IMAGE_FORMAT', 'png').lower()
+QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', 256))
+
+# HTTP caching: anonymous page renders, static asset fingerprints and precompression
+PAGE_CACHE_MAX_AGE = int(os.environ.get('PAGE_CACHE_MAX_AGE', 300))
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))  # static URLs without a content hash
+STATIC_PRECOMPRESS_MAX_BYTES = int(os.environ.get('STATIC_PRECOMPRESS_MAX_BYTES', 1024 * 1024))
+
+db = SQLAlchemy()
+mail = Mail()
+
+# ==================== LAZY SERVICES ====================
+
+class LazyService:
+    """Proxy that builds its service on first use, once in each process.
+    
+    Nothing is constructed at import, so a `gunicorn --preload` master
+    stays small and workers never inherit HTTP pools, sockets or threads
+    across fork; each worker builds its own on first use.
+    """
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._service = None
+    
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._service = self._factory()
+                    self._pid = os.getpid()
+        return self._service
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+# ==================== METRICS ====================
+# Statements slower than this are logged, with their query plan
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+# Query tags whose plan is logged once per distinct statement, however fast
+EXPLAIN_QUERY_TAGS = set(filter(None, os.environ.get('EXPLAIN_QUERY_TAGS', 'check_room_availability,find_available_room_ids').split(',')))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # optional bearer token for /metrics
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+class MetricsRegistry:
+    """Counters and histograms rendered in the Prometheus text format.
+    
+    Values live in this process only; with several gunicorn workers each
+    one answers /metrics for itself, so scrape every worker (or aggregate
+    by instance) rather than treating one response as the total.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = OrderedDict()
+        self._values = {}
+    
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+    
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help_text, tuple(buckets))
+    
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(buckets) + 2)  # buckets, +Inf, sum
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-1] += value
+    
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"' for k, v in pairs)
+        return '{' + ','.join(escaped) + '}'
+    
+    def render(self):
+        with self._lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{self._labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{self._labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(labels)} {value[-1]}')
+                lines.append(f'{name}_count{self._labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.histogram('http_request_duration_seconds', 'Request latency by route')
+metrics.histogram('http_request_sql_statements', 'SQL statements issued per request', SQL_COUNT_BUCKETS)
+metrics.histogram('http_request_sql_seconds', 'Time spent in SQL per request')
+metrics.counter('sql_statements_total', 'SQL statements executed')
+metrics.counter('sql_slow_statements_total', 'SQL statements slower than SLOW_QUERY_MS')
+metrics.histogram('outbound_request_duration_seconds', 'Calls to Twilio, Razorpay and SMTP')
+
+current_query_tag = contextvars.ContextVar('current_query_tag', default=None)
+explained_statements = set()
+
+@contextmanager
+def query_tag(name):
+    """Label the SQL issued inside the block in slow-query logs"""
+    token = current_query_tag.set(name)
+    try:
+        yield
+    finally:
+        current_query_tag.reset(token)
+
+@contextmanager
+def timed_call(service, operation):
+    """Record the duration and outcome of an outbound call"""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('outbound_request_duration_seconds', elapsed, service=service, operation=operation, outcome=outcome)
+        if has_request_context():
+            g.outbound_seconds = g.get('outbound_seconds', 0.0) + elapsed
+
+def explain_statement(connection, statement, parameters):
+    """Query plan rows for a statement, run on a separate cursor of the same connection"""
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    except Exception as e:
+        return f'unavailable: {e}'
+    finally:
+        cursor.close()
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(connection, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(connection, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    metrics.inc('sql_statements_total')
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+    
+    tag = current_query_tag.get()
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    explain = tag in EXPLAIN_QUERY_TAGS and statement not in explained_statements
+    if not (slow or explain):
+        return
+    if slow:
+        metrics.inc('sql_slow_statements_total')
+    if explain:
+        explained_statements.add(statement)
+    plan = None
+    if not executemany and statement.lstrip().upper().startswith('SELECT'):
+        plan = explain_statement(connection, statement, parameters)
+    logger.log(
+        logging.WARNING if slow else logging.INFO,
+        "Slow query" if slow else "Query plan",
+        extra={'duration_ms': round(elapsed * 1000, 2), 'query_tag': tag, 'statement': statement, 'plan': plan}
+    )
+
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or secrets.token_hex(8)
+
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    sql_statements = g.get('sql_statements', 0)
+    sql_seconds = g.get('sql_seconds', 0.0)
+    metrics.observe('http_request_duration_seconds', elapsed, method=request.method, route=route, status=response.status_code)
+    metrics.observe('http_request_sql_statements', sql_statements, route=route)
+    metrics.observe('http_request_sql_seconds', sql_seconds, route=route)
+    logger.info("Request", extra={
+        'method': request.method,
+        'status': response.status_code,
+        'duration_ms': round(elapsed * 1000, 2),
+        'sql_statements': sql_statements,
+        'sql_ms': round(sql_seconds * 1000, 2),
+        'outbound_ms': round(g.get('outbound_seconds', 0.0) * 1000, 2)
+    })
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+def metrics_endpoint():
+    """Prometheus scrape endpoint for this worker"""
+    if METRICS_TOKEN:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return Response('Unauthorized\n', status=401, mimetype='text/plain', headers={'WWW-Authenticate': 'Bearer'})
+        if not secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 # ==================== JINJA2 CUSTOM FILTERS ====================
 
-@app.template_filter('fromjson')
 def fromjson_filter(value):
     """Custom Jinja2 filter to parse JSON strings"""
+    if isinstance(value, list):
+        # Catalog entries carry amenities already decoded
+        return value
     if value:
         try:
             return json.loads(value)
@@ -85,8 +497,6 @@ def fromjson_filter(value):
     return []
 
 # ==================== DATABASE MODELS ====================
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 
 
 class Admin(db.Model):
@@ -121,14 +531,19 @@ class User(db.Model):
 class OTPRecord(db.Model):
     """OTP records for tracking attempts with daily limits"""
     __tablename__ = 'otp_records'
+    __table_args__ = (
+        # Per-phone history and latest_otp_record()
+        db.Index('ix_otp_records_phone_created', 'phone', 'created_at'),
+        db.Index('ix_otp_records_phone_purpose_created', 'phone', 'purpose', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
-    phone = db.Column(db.String(20), nullable=False, index=True)
+    phone = db.Column(db.String(20), nullable=False)
     purpose = db.Column(db.String(20), nullable=False)  # 'login', 'register'
     verification_sid = db.Column(db.String(100))  # Twilio verification SID
     status = db.Column(db.String(20), default='pending')  # pending, approved, failed
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # retention pruning
     verified_at = db.Column(db.DateTime)
     ip_address = db.Column(db.String(50))
 
@@ -156,23 +571,74 @@ class Room(db.Model):
 class Booking(db.Model):
     """Booking model for reservations"""
     __tablename__ = 'bookings'
+    __table_args__ = (
+        # Room occupancy by status and dates (occupancy index rebuild, room lookups)
+        db.Index('ix_bookings_room_status_dates', 'room_id', 'status', 'check_in', 'check_out'),
+        # Expiry sweeps and status counts
+        db.Index('ix_bookings_status_created', 'status', 'created_at'),
+        # A guest's bookings, newest first
+        db.Index('ix_bookings_user_created', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
-    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=False, index=True)
-    check_in = db.Column(db.Date, nullable=False, index=True)
-    check_out = db.Column(db.Date, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=False)
+    check_in = db.Column(db.Date, nullable=False)
+    check_out = db.Column(db.Date, nullable=False)
     guests = db.Column(db.Integer, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='pending', index=True)
+    status = db.Column(db.String(20), default='pending')
     booking_reference = db.Column(db.String(20), unique=True, index=True)
+    group_reference = db.Column(db.String(20), index=True)  # shared by the bookings of one group booking
     special_requests = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    payment = db.relationship('Payment', backref='booking', uselist=False, lazy=True, cascade='all, delete-orphan')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Every attempt is kept: a Razorpay order pre-created at booking time stays
+    # pending next to the QR payment the guest actually chose
+    payments = db.relationship('Payment', backref='booking', lazy=True, order_by='Payment.id', cascade='all, delete-orphan')
+    nights = db.relationship('RoomNight', backref='booking', lazy=True, cascade='all, delete-orphan')
+
+    @property
+    def payment(self):
+        """The payment that settled the booking, else the latest attempt"""
+        settled = [payment for payment in self.payments if payment.payment_status in SETTLED_PAYMENT_STATUSES]
+        attempts = settled or self.payments
+        return attempts[-1] if attempts else None
 
     def __repr__(self):
         return f'<Booking {self.booking_reference}>'
 
+class RoomNight(db.Model):
+    """One row per room per night held by an active booking"""
+    __tablename__ = 'room_nights'
+    __table_args__ = (
+        # Serves availability lookups and makes double booking a constraint violation
+        db.UniqueConstraint('room_id', 'night', name='uq_room_nights_room_night'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=False)
+    night = db.Column(db.Date, nullable=False)
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'), nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<RoomNight {self.room_id} {self.night}>'
+
+class RoomRate(db.Model):
+    """Rate rule: multiplies the nightly price of matching nights (seasons, events, weekdays)"""
+    __tablename__ = 'room_rates'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    room_type = db.Column(db.String(50), index=True)  # None applies to every room type
+    start_date = db.Column(db.Date)  # first night, None for open-ended
+    end_date = db.Column(db.Date)  # last night (inclusive), None for open-ended
+    weekdays = db.Column(db.String(20))  # comma-separated, Monday=0; None for every night
+    multiplier = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<RoomRate {self.name} x{self.multiplier}>'
+
 class Payment(db.Model):
     """Payment model with Razorpay integration"""
     __tablename__ = 'payments'
@@ -181,7 +647,7 @@ class Payment(db.Model):
     booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'), nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     payment_method = db.Column(db.String(20), nullable=False)
-    payment_status = db.Column(db.String(20), default='pending', index=True)
+    payment_status = db.Column(db.String(20), default='pending', index=True)  # pending, failed, expired or a SETTLED_PAYMENT_STATUSES value
     transaction_id = db.Column(db.String(100), unique=True, index=True)
     
     # Razorpay columns
@@ -189,13 +655,109 @@ class Payment(db.Model):
     razorpay_payment_id = db.Column(db.String(100), index=True)
     razorpay_signature = db.Column(db.String(256))
     
-    qr_code_data = db.Column(db.Text)
+    qr_code_data = db.Column(db.Text)  # data URI on rows created before qr_code_digest
+    qr_code_digest = db.Column(db.String(64), index=True)  # SHA-256 of the UPI payload, the QR image URL key
     payment_date = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<Payment {self.transaction_id}>'
 
+class EmailOutbox(db.Model):
+    """Queued outbound emails, committed together with the change they report"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32), index=True)
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.recipient} - {self.status}>'
+
+class WebhookEvent(db.Model):
+    """Inbox of verified gateway webhooks; the event id makes delivery idempotent"""
+    __tablename__ = 'webhook_events'
+    __table_args__ = (
+        db.Index('ix_webhook_events_status_id', 'status', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(20), nullable=False, default='razorpay')
+    event_id = db.Column(db.String(100), unique=True, nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending, processing, processed, ignored
+    claim_token = db.Column(db.String(32), index=True)
+    claimed_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<WebhookEvent {self.event_id} {self.event_type}>'
+
+class DailyStat(db.Model):
+    """Per-night, per-room-type totals for confirmed stays, maintained incrementally"""
+    __tablename__ = 'daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'room_type', name='uq_daily_stats_day_room_type'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    room_type = db.Column(db.String(50), nullable=False)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    room_nights_sold = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DailyStat {self.day} {self.room_type}>'
+
+class CacheVersion(db.Model):
+    """Version counters bumped on writes so every worker can spot stale caches"""
+    __tablename__ = 'cache_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+class RateLimitKey(db.Model):
+    """One row per rate limit key; locking it serializes hits on that key"""
+    __tablename__ = 'rate_limit_keys'
+    
+    limit_key = db.Column(db.String(100), primary_key=True)
+    last_hit_at = db.Column(db.Float, nullable=False, index=True)  # epoch seconds, for pruning
+
+    def __repr__(self):
+        return f'<RateLimitKey {self.limit_key}>'
+
+class RateLimitHit(db.Model):
+    """Sliding-window log of rate limited actions, shared by every worker"""
+    __tablename__ = 'rate_limit_hits'
+    __table_args__ = (
+        db.Index('ix_rate_limit_hits_key_hit_at', 'limit_key', 'hit_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    limit_key = db.Column(db.String(100), nullable=False)
+    hit_at = db.Column(db.Float, nullable=False, index=True)  # epoch seconds
+
+    def __repr__(self):
+        return f'<RateLimitHit {self.limit_key} @{self.hit_at}>'
+
 # ==================== HELPER FUNCTIONS ====================
 
 def normalize_phone(phone):
@@ -211,109 +773,2113 @@ def normalize_phone(phone):
     
     return phone
 
-def check_otp_limit(phone):
-    """Check if user has exceeded daily OTP limit"""
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+class MemoryRateLimitBackend:
+    """Sliding-window logs held in this process, guarded by one lock.
+    
+    Counts are per process and lost on restart, so this backend is only
+    for development and single-worker servers (see check_rate_limit_backend).
+    """
     
-    count = OTPRecord.query.filter(
-        OTPRecord.phone == phone,
-        OTPRecord.created_at >= today_start
-    ).count()
+    def __init__(self):
+        self._hits = {}  # key -> (window_seconds, deque of timestamps)
+        self._lock = threading.Lock()
+        self._calls = 0
+    
+    def hit(self, limits, now):
+        """Record one hit against every (key, limit, window_seconds) if all have room.
+        
+        Returns the hits remaining under each limit, -1 for a limit that is
+        full; nothing is recorded unless every limit allows the hit.
+        """
+        with self._lock:
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                self._sweep(now)
+            remaining = []
+            for key, limit, window_seconds in limits:
+                hits = self._hits.setdefault(key, (window_seconds, deque()))[1]
+                while hits and hits[0] <= now - window_seconds:
+                    hits.popleft()
+                remaining.append(limit - len(hits) - 1 if len(hits) < limit else -1)
+            if min(remaining) >= 0:
+                for key, _, _ in limits:
+                    self._hits[key][1].append(now)
+            return remaining
     
-    return count < MAX_OTP_RESEND_PER_DAY
+    def _sweep(self, now):
+        expired = [key for key, (window, hits) in self._hits.items() if not hits or hits[-1] <= now - window]
+        for key in expired:
+            del self._hits[key]
 
-def send_otp_via_twilio(phone):
-    """Send OTP using Twilio Verify API"""
-    try:
-        if not twilio_client:
-            print("⚠️  Twilio not configured - using development mode")
-            # Generate a random 6-digit code for dev mode
-            import random
-            dev_code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-            print("="*60)
-            print(f"📱 DEVELOPMENT MODE - OTP for {phone}")
-            print(f"🔑 OTP Code: {dev_code}")
-            print(f"⏰ Valid for 10 minutes")
-            print("="*60)
-            return {'success': True, 'sid': f'dev_{secrets.token_hex(8)}'}
-        
-        # Send verification using Twilio Verify
-        verification = twilio_client.verify \
-            .v2 \
-            .services(TWILIO_VERIFY_SERVICE_SID) \
-            .verifications \
-            .create(to=phone, channel='sms')
-        
-        print(f"✅ OTP sent via Twilio Verify to {phone}")
-        print(f"   Verification SID: {verification.sid}")
+class DatabaseRateLimitBackend:
+    """Sliding-window logs in the rate_limit_hits table, shared by every worker.
+    
+    Each call runs in its own short transaction on a separate connection,
+    so a hit counts even if the request fails later. The keys' rows in
+    rate_limit_keys are locked first, by one UPDATE that walks the primary
+    key in order, which serializes concurrent hits on the same key without
+    deadlocking. After that, one DELETE trims every window, one GROUP BY
+    counts them and one INSERT records the hits: four statements per call
+    however many limits are checked (Redis does it in one round trip).
+    """
+    
+    def _lock_keys(self, connection, keys, now):
+        table = RateLimitKey.__table__
+        touched = connection.execute(
+            db.update(table).where(table.c.limit_key.in_(keys)).values(last_hit_at=now)
+        ).rowcount
+        if touched == len(keys):
+            return
+        # First hit on some key: create its row (once per key and cleanup cycle)
+        existing = set(connection.execute(db.select(table.c.limit_key).where(table.c.limit_key.in_(keys))).scalars())
+        for key in sorted(set(keys) - existing):
+            try:
+                with connection.begin_nested():
+                    connection.execute(db.insert(table).values(limit_key=key, last_hit_at=now))
+            except IntegrityError:
+                # Created concurrently; wait for its lock
+                connection.execute(db.update(table).where(table.c.limit_key == key).values(last_hit_at=now))
+    
+    def hit(self, limits, now):
+        """Same contract as MemoryRateLimitBackend.hit(); keys must be distinct"""
+        hits = RateLimitHit.__table__
+        expired = db.or_(*[
+            db.and_(hits.c.limit_key == key, hits.c.hit_at <= now - window_seconds)
+            for key, _, window_seconds in limits
+        ])
+        with db.engine.begin() as connection:
+            self._lock_keys(connection, sorted(key for key, _, _ in limits), now)
+            connection.execute(db.delete(hits).where(expired))
+            counts = dict(connection.execute(
+                db.select(hits.c.limit_key, func.count())
+                .where(hits.c.limit_key.in_([key for key, _, _ in limits]))
+                .group_by(hits.c.limit_key)
+            ).all())
+            remaining = [
+                limit - counts.get(key, 0) - 1 if counts.get(key, 0) < limit else -1
+                for key, limit, _ in limits
+            ]
+            if min(remaining) >= 0:
+                connection.execute(db.insert(hits), [{'limit_key': key, 'hit_at': now} for key, _, _ in limits])
+        return remaining
+
+    
+    def prune(self, cutoff, batch_size):
+        """Delete a batch of hits and idle keys older than the cutoff; returns rows deleted"""
+        hits, keys = RateLimitHit.__table__, RateLimitKey.__table__
+        with db.engine.begin() as connection:
+            ids = [row.id for row in connection.execute(
+                db.select(hits.c.id).where(hits.c.hit_at < cutoff).limit(batch_size)
+            )]
+            deleted = connection.execute(db.delete(hits).where(hits.c.id.in_(ids))).rowcount if ids else 0
+            idle = [row.limit_key for row in connection.execute(
+                db.select(keys.c.limit_key).where(keys.c.last_hit_at < cutoff).limit(batch_size)
+            )]
+            if idle:
+                deleted += connection.execute(
+                    db.delete(keys).where(keys.c.limit_key.in_(idle), keys.c.last_hit_at < cutoff)
+                ).rowcount
+        return deleted
+
+class RedisRateLimitBackend:
+    """Sliding-window logs in Redis sorted sets, shared by every worker"""
+    
+    # KEYS are the limit keys; ARGV is now, a unique member, then window and limit per key
+    HIT_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local remaining = {}
+    local allowed = true
+    for i, key in ipairs(KEYS) do
+        local window = tonumber(ARGV[1 + 2 * i])
+        local limit = tonumber(ARGV[2 + 2 * i])
+        redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+        local count = redis.call('ZCARD', key)
+        if count >= limit then
+            remaining[i] = -1
+            allowed = false
+        else
+            remaining[i] = limit - count - 1
+        end
+    end
+    if allowed then
+        for i, key in ipairs(KEYS) do
+            redis.call('ZADD', key, now, ARGV[2])
+            redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[1 + 2 * i])))
+        end
+    end
+    return remaining
+    """
+    
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self._hit = self.client.register_script(self.HIT_SCRIPT)
+    
+    def hit(self, limits, now):
+        """Same contract as MemoryRateLimitBackend.hit(), in one atomic script call"""
+        args = [now, f'{now}:{secrets.token_hex(4)}']
+        for _, limit, window_seconds in limits:
+            args += [window_seconds, limit]
+        return [int(value) for value in self._hit(keys=[key for key, _, _ in limits], args=args)]
+
+def create_rate_limit_backend():
+    if RATE_LIMIT_BACKEND == 'redis':
+        if redis is not None and REDIS_URL:
+            logger.info("OTP rate limits stored in Redis")
+            return RedisRateLimitBackend(REDIS_URL)
+        logger.warning("Redis rate limits need REDIS_URL and the redis package, using the database")
+        return DatabaseRateLimitBackend()
+    if RATE_LIMIT_BACKEND == 'memory':
+        return MemoryRateLimitBackend()
+    if RATE_LIMIT_BACKEND != 'database':
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND {RATE_LIMIT_BACKEND!r}")
+    return DatabaseRateLimitBackend()
+
+rate_limit_backend = LazyService(create_rate_limit_backend)
+
+def check_rate_limit_backend(workers):
+    """Refuse to serve with per-process rate limits when they would be multiplied by the workers"""
+    if RATE_LIMIT_BACKEND == 'memory' and workers > 1:
+        raise RuntimeError(
+            f"RATE_LIMIT_BACKEND=memory keeps OTP limits per process, so {workers} workers would allow "
+            f"{workers}x the configured limits. Use RATE_LIMIT_BACKEND=database or redis, or run one worker."
+        )
+
+def latest_otp_record(phone, purpose):
+    """The phone's most recent OTP record for a purpose"""
+    return OTPRecord.query.filter_by(
+        phone=phone,
+        purpose=purpose
+    ).order_by(OTPRecord.created_at.desc()).first()
+
+def check_otp_limit(phone, ip_address):
+    """Count an OTP send against the per-IP and per-phone windows.
+    
+    Returns (allowed, attempts_remaining, message). Both limits are checked
+    before either is charged, so a send refused by one limit does not use
+    up the other.
+    """
+    limits = [(f'otp:phone:{phone}', MAX_OTP_RESEND_PER_DAY, OTP_PHONE_WINDOW_SECONDS)]
+    if ip_address:
+        limits.append((f'otp:ip:{ip_address}', MAX_OTP_PER_IP_PER_HOUR, OTP_IP_WINDOW_SECONDS))
+    remaining = rate_limit_backend.hit(limits, time.time())
+    
+    if ip_address and remaining[1] < 0:
+        return False, 0, 'Too many OTP requests from this network. Please try again later.'
+    if remaining[0] < 0:
+        return False, 0, f'Maximum {MAX_OTP_RESEND_PER_DAY} OTP attempts per day exceeded. Try again tomorrow.'
+    return True, remaining[0], None
+
+class CircuitBreaker:
+    """Fail fast after repeated provider outages instead of queueing on timeouts.
+    
+    Opens after `failure_threshold` consecutive failures; once `reset_timeout`
+    seconds have passed a single trial call is let through, and its outcome
+    closes or re-opens the circuit. Only outages count as failures (see
+    is_provider_outage); a request the provider answered and refused is a
+    success as far as the breaker is concerned.
+    """
+    
+    def __init__(self, failure_threshold=OTP_BREAKER_FAILURES, reset_timeout=OTP_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+    
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+    
+    def is_open(self):
+        """True while calls are being rejected outright"""
+        return self.state == 'open'
+    
+    def allow(self):
+        """Whether a call may proceed now; claims the trial slot when half-open"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+    
+    def release(self):
+        """Give back the trial slot after a call that says nothing about the provider's health"""
+        with self._lock:
+            self._trial_in_flight = False
+
+def is_provider_outage(error):
+    """True for timeouts, connection errors and 5xx responses; False for a 4xx the caller caused"""
+    status = getattr(error, 'status', None)  # TwilioRestException carries the HTTP status
+    if isinstance(status, int):
+        return status >= 500
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError, TimeoutError, ConnectionError))
+
+class TwilioVerifyProvider:
+    """Twilio Verify over a pooled keep-alive HTTP session with strict timeouts"""
+    
+    name = 'twilio'
+    
+    def __init__(self, account_sid, auth_token, service_sid, timeout=TWILIO_TIMEOUT_SECONDS):
+        # Imported here: the Twilio SDK is large and only needed when this provider is used
+        from twilio.rest import Client
+        from twilio.http.http_client import TwilioHttpClient
+        http_client = TwilioHttpClient(pool_connections=True, timeout=timeout)
+        self.client = Client(account_sid, auth_token, http_client=http_client)
+        self.service_sid = service_sid
+    
+    def send(self, phone):
+        verification = self.client.verify.v2.services(self.service_sid).verifications.create(to=phone, channel='sms')
+        logger.info("OTP sent via Twilio Verify", extra={'phone': phone, 'verification_sid': verification.sid})
         return {'success': True, 'sid': verification.sid}
-        
+    
+    def verify(self, phone, code):
+        verification_check = self.client.verify.v2.services(self.service_sid).verification_checks.create(to=phone, code=code)
+        logger.info("OTP verification checked", extra={'phone': phone, 'verification_status': verification_check.status})
+        if verification_check.status == 'approved':
+            return {'success': True, 'status': 'approved'}
+        return {'success': False, 'status': verification_check.status}
+
+class LocalOTPProvider:
+    """In-process fake for development and load tests; never leaves the machine.
+    
+    Codes are kept in memory for 10 minutes. Set OTP_LOCAL_CODE to use one
+    fixed code, which also works when requests are spread over several
+    workers. OTP_LOCAL_LATENCY_MS adds a fake round trip to each call.
+    """
+    
+    name = 'local'
+    
+    def __init__(self, fixed_code=OTP_LOCAL_CODE, latency_ms=OTP_LOCAL_LATENCY_MS):
+        self.fixed_code = fixed_code
+        self.latency = latency_ms / 1000.0
+        self._codes = {}
+        self._lock = threading.Lock()
+    
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+    
+    def send(self, phone):
+        self._round_trip()
+        code = self.fixed_code or ''.join(secrets.choice('0123456789') for _ in range(6))
+        with self._lock:
+            self._codes[phone] = (code, time.monotonic() + 600)
+        logger.warning("Development OTP issued", extra={'phone': phone, 'otp_code': code, 'valid_minutes': 10})
+        return {'success': True, 'sid': f'dev_{secrets.token_hex(8)}'}
+    
+    def verify(self, phone, code):
+        self._round_trip()
+        if self.fixed_code:
+            expected = self.fixed_code
+        else:
+            with self._lock:
+                expected, expires_at = self._codes.get(phone, (None, 0))
+            if time.monotonic() > expires_at:
+                expected = None
+        if expected and secrets.compare_digest(code, expected):
+            with self._lock:
+                self._codes.pop(phone, None)
+            return {'success': True, 'status': 'approved'}
+        return {'success': False, 'status': 'pending'}
+
+def create_otp_provider():
+    """Build the provider selected by OTP_PROVIDER, falling back to the local fake"""
+    if OTP_PROVIDER == 'local':
+        logger.warning("Using local OTP provider, codes are written to the log")
+        return LocalOTPProvider()
+    try:
+        provider = TwilioVerifyProvider(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_VERIFY_SERVICE_SID)
+        logger.info("Twilio Verify initialized")
+        return provider
     except Exception as e:
-        print(f"❌ Twilio Error: {e}")
-        return {'success': False, 'error': str(e)}
+        logger.warning("Twilio not configured, using local OTP provider", extra={'error': str(e)})
+        return LocalOTPProvider()
+
+otp_provider = LazyService(create_otp_provider)
+otp_breaker = CircuitBreaker()
+otp_executor = LazyService(lambda: ThreadPoolExecutor(max_workers=OTP_SEND_WORKERS, thread_name_prefix='otp-send'))
 
-def verify_otp_via_twilio(phone, code):
-    """Verify OTP using Twilio Verify API"""
+def call_otp_provider(operation, *args):
+    """Run a provider call behind the circuit breaker, returning a result dict.
+    
+    A request the provider rejected (4xx, e.g. an invalid number or an
+    expired verification) comes back with its status_code and leaves the
+    breaker's failure count alone.
+    """
+    if not otp_breaker.allow():
+        return {'success': False, 'error': 'OTP provider unavailable'}
     try:
-        if not twilio_client:
-            print(f"⚠️  Development mode - accepting any 6-digit code")
-            # In dev mode, accept any 6-digit code
-            if len(code) == 6 and code.isdigit():
-                return {'success': True, 'status': 'approved'}
-            return {'success': False, 'error': 'Invalid code format'}
-        
-        # Verify using Twilio Verify
-        verification_check = twilio_client.verify \
-            .v2 \
-            .services(TWILIO_VERIFY_SERVICE_SID) \
-            .verification_checks \
-            .create(to=phone, code=code)
-        
-        print(f"✅ Verification status: {verification_check.status}")
+        with timed_call(otp_provider.name, f'otp.{operation}'):
+            result = getattr(otp_provider, operation)(*args)
+    except Exception as e:
+        status = getattr(e, 'status', None)
+        if is_provider_outage(e):
+            otp_breaker.record_failure()
+            logger.error("OTP provider error", extra={'operation': operation, 'error': str(e)})
+        elif isinstance(status, int):
+            otp_breaker.record_success()  # the provider is up, it just said no
+            logger.warning("OTP provider rejected request", extra={'operation': operation, 'status': status, 'error': str(e)})
+        else:
+            otp_breaker.release()
+            logger.exception("OTP provider call failed", extra={'operation': operation})
+        return {'success': False, 'error': str(e), 'status_code': status}
+    otp_breaker.record_success()
+    return result
+
+def send_otp_code(phone):
+    """Send an OTP to the phone through the configured provider"""
+    return call_otp_provider('send', phone)
+
+def verify_otp_code(phone, code):
+    """Check an OTP through the configured provider"""
+    return call_otp_provider('verify', phone, code)
+
+def deliver_otp(app, otp_record):
+    """Background half of an async send: call the provider, then write the audit record"""
+    with app.app_context():
+        result = send_otp_code(otp_record.phone)
+        if result['success']:
+            otp_record.verification_sid = result.get('sid')
+        else:
+            otp_record.status = 'failed'
+        db.session.add(otp_record)
+        db.session.commit()
+
+def login_user(user):
+    """Put the user's identity claims into the signed session cookie"""
+    session['user_id'] = user.id
+    session['user_name'] = user.full_name
+    session['user_phone'] = user.phone
+    g.current_user = user
+
+def current_identity():
+    """Identity claims (id, name, phone) from the session cookie, without a query"""
+    if 'user_id' not in session:
+        return None
+    return {'id': session['user_id'], 'name': session.get('user_name'), 'phone': session.get('user_phone')}
+
+def current_user():
+    """The logged-in User row, fetched at most once per request"""
+    if 'current_user' not in g:
+        g.current_user = db.session.get(User, session['user_id']) if 'user_id' in session else None
+    return g.current_user
+
+def generate_booking_reference():
+    return f"HB{secrets.token_hex(4).upper()}"
+
+def build_upi_payload(payment, booking):
+    """UPI deep link encoded in the payment QR code"""
+    return f"upi://pay?pa={UPI_ID}&pn={MERCHANT_NAME}&am={booking.total_price}&tr={payment.transaction_id}&tn=Booking{booking.booking_reference}"
+
+def render_qr_code(payload, image_format='png'):
+    """Render a QR code for the payload as PNG or SVG bytes"""
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=5)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    buffered = BytesIO()
+    if image_format == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffered)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffered, format="PNG")
+    return buffered.getvalue()
+
+class QRCodeCache:
+    """LRU cache of rendered QR images keyed by (payload hash, format).
+    
+    Payments store only the hash; the image is rendered on first request
+    for /qr/<hash>.<format> and served from memory afterwards.
+    """
+    
+    def __init__(self, max_entries=QR_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def digest(payload):
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def lookup(self, digest, image_format='png'):
+        """Return cached image bytes for a payload hash, or None"""
+        key = (digest, image_format)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+    
+    def get(self, payload, image_format='png'):
+        """Return the rendered image bytes for a payload, rendering on a miss"""
+        key = (self.digest(payload), image_format)
+        image = self.lookup(*key)
+        if image is not None:
+            return image
+        
+        image = render_qr_code(payload, image_format)
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+        return image
+
+qr_code_cache = QRCodeCache()
+
+ADMIN_BOOKING_CSV_FIELDS = [
+    'id', 'booking_reference', 'full_name', 'email', 'phone', 'room_type', 'room_number',
+    'check_in', 'check_out', 'guests', 'total_price', 'status', 'created_at'
+]
+
+def parse_admin_booking_filters(args):
+    """Read status/room_type/date filters from query args; raises ValueError on bad values"""
+    filters = {
+        'status': args.get('status') or None,
+        'room_type': args.get('room_type') or None,
+        'date_from': None,
+        'date_to': None
+    }
+    if filters['status'] and filters['status'] not in BOOKING_STATUSES:
+        raise ValueError(f"unknown booking status {filters['status']!r}")
+    if args.get('from'):
+        filters['date_from'] = datetime.strptime(args['from'], '%Y-%m-%d').date()
+    if args.get('to'):
+        filters['date_to'] = datetime.strptime(args['to'], '%Y-%m-%d').date()
+    return filters
+
+def admin_booking_rows(filters, before_id=None, limit=ADMIN_BOOKINGS_PAGE_SIZE):
+    """One keyset page of bookings (newest first) joined with guest and room as flat rows.
+    
+    Pages are addressed by the last booking id seen, so each page is an index
+    range scan on the primary key no matter how deep the admin scrolls.
+    """
+    query = db.session.query(
+        Booking.id,
+        Booking.booking_reference,
+        Booking.check_in,
+        Booking.check_out,
+        Booking.guests,
+        Booking.total_price,
+        Booking.status,
+        Booking.created_at,
+        User.full_name,
+        User.email,
+        User.phone,
+        Room.room_type,
+        Room.room_number
+    ).join(User, Booking.user_id == User.id).join(Room, Booking.room_id == Room.id)
+    
+    if filters['status']:
+        query = query.filter(Booking.status == filters['status'])
+    if filters['room_type']:
+        query = query.filter(Room.room_type == filters['room_type'])
+    # Stays overlapping the requested window
+    if filters['date_from']:
+        query = query.filter(Booking.check_out > filters['date_from'])
+    if filters['date_to']:
+        query = query.filter(Booking.check_in < filters['date_to'])
+    if before_id is not None:
+        query = query.filter(Booking.id < before_id)
+    
+    return query.order_by(Booking.id.desc()).limit(limit).all()
+
+def admin_booking_dict(row):
+    """JSON-friendly form of an admin booking row"""
+    return {
+        'id': row.id,
+        'booking_reference': row.booking_reference,
+        'full_name': row.full_name,
+        'email': row.email,
+        'phone': row.phone,
+        'room_type': row.room_type,
+        'room_number': row.room_number,
+        'check_in': row.check_in.strftime('%Y-%m-%d'),
+        'check_out': row.check_out.strftime('%Y-%m-%d'),
+        'guests': row.guests,
+        'total_price': row.total_price,
+        'status': row.status,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }
+
+def user_booking_rows(user_id):
+    """A guest's bookings with room details as flat rows, newest first"""
+    return db.session.query(
+        Booking.id,
+        Booking.booking_reference,
+        Booking.check_in,
+        Booking.check_out,
+        Booking.guests,
+        Booking.total_price,
+        Booking.status,
+        Room.room_type,
+        Room.room_number
+    ).join(Room, Booking.room_id == Room.id).filter(
+        Booking.user_id == user_id
+    ).order_by(Booking.created_at.desc()).all()
+
+def stay_nights(check_in, check_out):
+    """Every night of a stay, i.e. each date in [check_in, check_out)"""
+    return [check_in + timedelta(days=offset) for offset in range((check_out - check_in).days)]
+
+def claim_room_nights(booking):
+    """Add the room_nights rows for a booking to the session"""
+    for night in stay_nights(booking.check_in, booking.check_out):
+        db.session.add(RoomNight(room_id=booking.room_id, night=night, booking=booking))
+
+def release_room_nights(booking_id):
+    """Delete the room_nights rows held by a booking"""
+    RoomNight.query.filter_by(booking_id=booking_id).delete(synchronize_session=False)
+
+def ensure_room_nights(booking):
+    """Claim nights for a booking that predates the room_nights table.
+    
+    Runs in a savepoint so a conflicting legacy booking is reported
+    instead of failing the surrounding transaction.
+    """
+    if RoomNight.query.filter_by(booking_id=booking.id).first():
+        return True
+    try:
+        with db.session.begin_nested():
+            claim_room_nights(booking)
+        return True
+    except IntegrityError:
+        logger.warning("Room night conflict", extra={'booking_reference': booking.booking_reference})
+        return False
+
+def check_room_availability(room_id, check_in, check_out):
+    with query_tag('check_room_availability'):
+        held_night = RoomNight.query.filter(
+            RoomNight.room_id == room_id,
+            RoomNight.night >= check_in,
+            RoomNight.night < check_out
+        ).first()
+    return held_night is None
+
+def integrity_error_key(error):
+    """Name the unique key an IntegrityError tripped: 'room_night', 'booking_reference' or None.
+    
+    Matches both SQLite ("UNIQUE constraint failed: room_nights.room_id, ...")
+    and MySQL ("Duplicate entry ... for key 'uq_room_nights_room_night'").
+    """
+    message = str(error.orig)
+    if 'uq_room_nights_room_night' in message or 'room_nights.room_id' in message:
+        return 'room_night'
+    if 'booking_reference' in message:
+        return 'booking_reference'
+    return None
+
+def reserve_room(room_id, user_id, check_in, check_out, guests, special_requests=''):
+    """Insert a pending booking and its room nights in one transaction.
+    
+    The unique (room_id, night) key rejects a concurrent booking for any of
+    the same nights, so no availability pre-check or lock is needed. A
+    collision on the random booking reference is retried with a new one;
+    any other integrity error is raised.
+    """
+    room = db.session.get(Room, room_id)
+    if not room:
+        return {'success': False, 'error': 'not_found'}
+    
+    total_price = pricing_engine.stay_price(room_id, check_in, check_out)
+    for attempt in range(1, BOOKING_REFERENCE_ATTEMPTS + 1):
+        booking = Booking(
+            user_id=user_id,
+            room_id=room_id,
+            check_in=check_in,
+            check_out=check_out,
+            guests=guests,
+            total_price=total_price,
+            booking_reference=generate_booking_reference(),
+            special_requests=special_requests
+        )
+        db.session.add(booking)
+        claim_room_nights(booking)
+        
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            key = integrity_error_key(e)
+            if key == 'room_night':
+                return {'success': False, 'error': 'unavailable'}
+            if key != 'booking_reference' or attempt == BOOKING_REFERENCE_ATTEMPTS:
+                raise
+            logger.warning("Booking reference collision, retrying", extra={'booking_reference': booking.booking_reference})
+            continue
+        return {'success': True, 'booking': booking}
+
+def reserve_rooms(room_ids, user_id, check_in, check_out, guests, special_requests=''):
+    """Insert pending bookings for several rooms under one group reference in one transaction.
+    
+    As in reserve_room(), a concurrent hold on any of the nights trips the
+    room_nights unique key; the whole group is then rolled back. Booking
+    reference collisions are retried with new references.
+    """
+    found = db.session.query(func.count(Room.id)).filter(Room.id.in_(room_ids)).scalar()
+    if found != len(set(room_ids)):
+        return {'success': False, 'error': 'not_found'}
+    
+    prices = pricing_engine.quote(room_ids, [(check_in, check_out)])[0].tolist()
+    for attempt in range(1, BOOKING_REFERENCE_ATTEMPTS + 1):
+        group_reference = generate_booking_reference()
+        bookings = []
+        for room_id, total_price in zip(room_ids, prices):
+            booking = Booking(
+                user_id=user_id,
+                room_id=room_id,
+                check_in=check_in,
+                check_out=check_out,
+                guests=guests,
+                total_price=total_price,
+                booking_reference=generate_booking_reference(),
+                group_reference=group_reference,
+                special_requests=special_requests
+            )
+            db.session.add(booking)
+            claim_room_nights(booking)
+            bookings.append(booking)
+        
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            key = integrity_error_key(e)
+            if key == 'room_night':
+                return {'success': False, 'error': 'unavailable'}
+            if key != 'booking_reference' or attempt == BOOKING_REFERENCE_ATTEMPTS:
+                raise
+            logger.warning("Booking reference collision, retrying", extra={'group_reference': group_reference})
+            continue
+        return {'success': True, 'group_reference': group_reference, 'bookings': bookings}
+
+def backfill_room_nights():
+    """Claim room nights for active bookings that have none; returns (claimed, conflicts)"""
+    has_nights = db.session.query(RoomNight.id).filter(RoomNight.booking_id == Booking.id).exists()
+    bookings = Booking.query.filter(
+        Booking.status.in_(ACTIVE_BOOKING_STATUSES),
+        ~has_nights
+    ).order_by(Booking.id).all()
+    
+    claimed = conflicts = 0
+    for booking in bookings:
+        if ensure_room_nights(booking):
+            claimed += 1
+        else:
+            conflicts += 1
+    db.session.commit()
+    return claimed, conflicts
+
+def mark_booking_confirmed(booking, reclaim=False):
+    """Confirm a pending booking holding its nights; returns False, changing nothing, if it can't be.
+    
+    The status change is a conditional UPDATE, so a booking the sweeper
+    expired, the guest cancelled or another payment already confirmed is
+    left alone. With reclaim, an expired booking is confirmed too if its
+    nights are still free. Runs in a savepoint, so a booking is never left
+    confirmed without its room_nights rows.
+    """
+    confirmable = ['pending', 'expired'] if reclaim else ['pending']
+    savepoint = db.session.begin_nested()
+    updated = Booking.query.filter(
+        Booking.id == booking.id,
+        Booking.status.in_(confirmable)
+    ).update({'status': 'confirmed'}, synchronize_session=False)
+    if updated and ensure_room_nights(booking):
+        savepoint.commit()
+        set_committed_value(booking, 'status', 'confirmed')
+        apply_booking_to_daily_stats(booking, 1)
+        return True
+    savepoint.rollback()
+    db.session.refresh(booking)
+    return False
+
+def mark_booking_cancelled(booking):
+    """Cancel a pending or confirmed booking; returns False, changing nothing, if it is neither.
+    
+    The status is read under the booking row lock (taken in complete_payment's
+    order) and the UPDATE is conditional on it, so a cancel racing a
+    confirmation or another cancel acts on the status the row really had:
+    the stay leaves daily_stats only if this cancel moved it off 'confirmed'.
+    """
+    status = db.session.query(Booking.status).filter(Booking.id == booking.id).with_for_update().scalar()
+    updated = status in ('pending', 'confirmed') and Booking.query.filter(
+        Booking.id == booking.id,
+        Booking.status == status
+    ).update({'status': 'cancelled'}, synchronize_session=False)
+    if not updated:
+        db.session.refresh(booking)
+        return False
+    set_committed_value(booking, 'status', 'cancelled')
+    release_room_nights(booking.id)
+    if status == 'confirmed':
+        apply_booking_to_daily_stats(booking, -1)
+    return True
+
+
+def complete_payment(payment, user, razorpay_payment_id=None, razorpay_signature=None, reclaim=False):
+    """Record a captured payment and confirm its booking; returns 'confirmed', 'duplicate' or 'refund'.
+    
+    Shared by the browser callbacks and webhook reconciliation. Claiming
+    the payment is a conditional UPDATE, so only the first of several
+    deliveries of the same capture does anything ('duplicate' for the
+    rest). When the booking can't be confirmed (see mark_booking_confirmed)
+    the money is kept apart as 'refund_pending' for the reconciler to
+    return. On 'confirmed' the guest's confirmation email is queued.
+    """
+    booking = payment.booking
+    # Row locks in the expiry sweeper's order, booking then payment, so the two never deadlock
+    db.session.query(Booking.id).filter(Booking.id == booking.id).with_for_update().scalar()
+    values = {'payment_status': 'completed', 'payment_date': datetime.utcnow()}
+    if razorpay_payment_id:
+        values['razorpay_payment_id'] = razorpay_payment_id
+    if razorpay_signature:
+        values['razorpay_signature'] = razorpay_signature
+    claimed = Payment.query.filter(
+        Payment.id == payment.id,
+        Payment.payment_status.notin_(SETTLED_PAYMENT_STATUSES)
+    ).update(values, synchronize_session=False)
+    db.session.refresh(payment)
+    if not claimed:
+        return 'duplicate' if payment.payment_status == 'completed' else 'refund'
+    
+    if not mark_booking_confirmed(booking, reclaim=reclaim):
+        payment.payment_status = 'refund_pending'
+        logger.warning("Payment captured for a booking that can't be confirmed, refunding", extra={
+            'booking_reference': booking.booking_reference,
+            'booking_status': booking.status,
+            'transaction_id': payment.transaction_id
+        })
+        return 'refund'
+    if user and user.email:
+        queue_booking_confirmation_email(user.email, booking_email_details(booking, user))
+    return 'confirmed'
+
+def find_available_room_ids(check_in, check_out, room_type=None):
+    """Return ids of rooms free for [check_in, check_out) using a single anti-join query"""
+    occupied = db.session.query(RoomNight.id).filter(
+        RoomNight.room_id == Room.id,
+        RoomNight.night >= check_in,
+        RoomNight.night < check_out
+    ).exists()
+    
+    query = db.session.query(Room.id).filter(Room.is_available == True, ~occupied)
+    if room_type:
+        query = query.filter(Room.room_type == room_type)
+    with query_tag('find_available_room_ids'):
+        return [row.id for row in query.order_by(Room.id)]
+
+def find_available_rooms_bulk(date_ranges, room_type=None):
+    """Return available room ids for each (check_in, check_out) range.
+    
+    Takes the candidate rooms from the catalog cache and loads every held
+    room night inside the union of the ranges in one query, then resolves
+    each range in memory.
+    """
+    if not date_ranges:
+        return []
+    
+    room_ids = [room['id'] for room in room_catalog.rooms(room_type)]
+    
+    span_start = min(check_in for check_in, _ in date_ranges)
+    span_end = max(check_out for _, check_out in date_ranges)
+    held_nights = db.session.query(RoomNight.room_id, RoomNight.night).filter(
+        RoomNight.room_id.in_(room_ids),
+        RoomNight.night >= span_start,
+        RoomNight.night < span_end
+    ).all() if room_ids else []
+    
+    results = []
+    for check_in, check_out in date_ranges:
+        occupied = {
+            held.room_id for held in held_nights
+            if check_in <= held.night < check_out
+        }
+        results.append([room_id for room_id in room_ids if room_id not in occupied])
+    return results
+
+def allocate_group_rooms(lines, available_ids):
+    """Pick rooms for a group booking from one availability pass.
+    
+    Lines are {'room_id': id} or {'room_type': type, 'quantity': n}. Rooms
+    asked for by id are taken first so a typed line never claims them.
+    Returns (room_ids, shortfalls), one shortfall per line that could not be
+    filled in full.
+    """
+    free = set(available_ids)
+    chosen = []
+    shortfalls = []
+    for line in lines:
+        if 'room_id' in line:
+            if line['room_id'] in free:
+                free.discard(line['room_id'])
+                chosen.append(line['room_id'])
+            else:
+                shortfalls.append({'room_id': line['room_id'], 'requested': 1, 'available': 0})
+    
+    for line in lines:
+        if 'room_id' in line:
+            continue
+        matches = [room['id'] for room in room_catalog.rooms(line['room_type']) if room['id'] in free][:line['quantity']]
+        free.difference_update(matches)
+        chosen.extend(matches)
+        if len(matches) < line['quantity']:
+            shortfalls.append({'room_type': line['room_type'], 'requested': line['quantity'], 'available': len(matches)})
+    return chosen, shortfalls
+
+def group_booking_options(chosen, available_ids, check_in, check_out):
+    """Partial-allocation choices offered when a group request can't be met in full"""
+    catalog = room_catalog.snapshot()
+    taken = set(chosen)
+    alternatives = {}
+    for room_id in available_ids:
+        if room_id not in taken and room_id in catalog:
+            room_type = catalog[room_id]['room_type']
+            alternatives[room_type] = alternatives.get(room_type, 0) + 1
+    return {
+        'partial': {
+            'room_ids': chosen,
+            'total_price': round(float(pricing_engine.quote(chosen, [(check_in, check_out)]).sum()), 2)
+        },
+        'other_available_by_type': alternatives
+    }
+
+# ==================== OCCUPANCY INDEX ====================
+
+class OccupancyIndex:
+    """Per-room sorted arrays of current and upcoming stays for O(log n) overlap checks.
+    
+    Each room keeps its stays sorted by check-in together with a running
+    maximum of check-out dates, so "is anything overlapping [a, b)" is one
+    bisect plus one comparison. The index is local to the worker process:
+    it is updated by the routes that change occupancy, and a background
+    thread rebuilds it every OCCUPANCY_INDEX_MAX_AGE seconds to pick up
+    writes made by other workers. Stays that ended before the day of the
+    rebuild are left out, so its cost follows upcoming bookings rather than
+    the whole history. Until the first build every room looks free, which
+    is safe: the index only rejects early, reserve_room() has the final say.
+    """
+    
+    def __init__(self, max_age=OCCUPANCY_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._rooms = {}      # room_id -> {'starts': [], 'stays': [], 'max_end': []}
+        self._bookings = {}   # booking_id -> (room_id, check_in, check_out)
+        self._built_at = None
+        self._horizon = None  # stays ending before this day are not indexed
+        self._pid = None
+    
+    def start(self, app=None):
+        """Start the refresh thread once per process (safe after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.app = app or current_app._get_current_object()
+            threading.Thread(target=self._run, name='occupancy-index', daemon=True).start()
+    
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.rebuild()
+            except Exception as e:
+                logger.exception("Occupancy index refresh error")
+            time.sleep(self.max_age)
+    
+    def rebuild(self):
+        """Reload every active stay that has not ended yet from the bookings table"""
+        horizon = date.today()
+        rows = db.session.query(
+            Booking.id, Booking.room_id, Booking.check_in, Booking.check_out
+        ).filter(
+            Booking.status.in_(ACTIVE_BOOKING_STATUSES),
+            Booking.check_out >= horizon
+        ).order_by(Booking.room_id, Booking.check_in).all()
+        
+        rooms = {}
+        bookings = {}
+        for row in rows:
+            entry = rooms.setdefault(row.room_id, {'starts': [], 'stays': [], 'max_end': []})
+            entry['starts'].append(row.check_in)
+            entry['stays'].append((row.check_in, row.check_out, row.id))
+            previous = entry['max_end'][-1] if entry['max_end'] else row.check_out
+            entry['max_end'].append(max(previous, row.check_out))
+            bookings[row.id] = (row.room_id, row.check_in, row.check_out)
+        
+        with self._lock:
+            self._rooms = rooms
+            self._bookings = bookings
+            self._built_at = time.monotonic()
+            self._horizon = horizon
+        return len(bookings)
+    
+    def add(self, booking):
+        """Record an active booking; re-adding an indexed booking is a no-op"""
+        if booking.status not in ACTIVE_BOOKING_STATUSES:
+            self.discard(booking.id)
+            return
+        with self._lock:
+            if booking.id in self._bookings:
+                return
+            entry = self._rooms.setdefault(booking.room_id, {'starts': [], 'stays': [], 'max_end': []})
+            position = bisect.bisect_right(entry['starts'], booking.check_in)
+            entry['starts'].insert(position, booking.check_in)
+            entry['stays'].insert(position, (booking.check_in, booking.check_out, booking.id))
+            self._reset_max_end(entry, position)
+            self._bookings[booking.id] = (booking.room_id, booking.check_in, booking.check_out)
+    
+    def discard(self, booking_id):
+        """Forget a booking that no longer holds its room"""
+        with self._lock:
+            indexed = self._bookings.pop(booking_id, None)
+            if indexed is None:
+                return
+            entry = self._rooms[indexed[0]]
+            position = entry['stays'].index((indexed[1], indexed[2], booking_id))
+            del entry['starts'][position]
+            del entry['stays'][position]
+            self._reset_max_end(entry, position)
+    
+    @staticmethod
+    def _reset_max_end(entry, position):
+        max_end = entry['max_end'][:position]
+        for _, check_out, _ in entry['stays'][position:]:
+            max_end.append(max(max_end[-1], check_out) if max_end else check_out)
+        entry['max_end'] = max_end
+    
+    def is_free(self, room_id, check_in, check_out):
+        """True if no indexed stay in the room overlaps [check_in, check_out)"""
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if not entry:
+                return True
+            position = bisect.bisect_left(entry['starts'], check_out)
+            return position == 0 or entry['max_end'][position - 1] <= check_in
+    
+    def check_consistency(self):
+        """Compare the index with the bookings table without modifying either"""
+        with self._lock:
+            indexed = dict(self._bookings)
+            built_at = self._built_at
+            horizon = self._horizon or date.today()
+        
+        rows = db.session.query(
+            Booking.id, Booking.room_id, Booking.check_in, Booking.check_out
+        ).filter(
+            Booking.status.in_(ACTIVE_BOOKING_STATUSES),
+            Booking.check_out >= horizon
+        ).all()
+        expected = {row.id: (row.room_id, row.check_in, row.check_out) for row in rows}
+        # Routes may add stays that end before the horizon; they are harmless
+        indexed = {booking_id: stay for booking_id, stay in indexed.items() if stay[2] >= horizon}
+        
+        missing = sorted(set(expected) - set(indexed))
+        stale = sorted(set(indexed) - set(expected))
+        mismatched = sorted(
+            booking_id for booking_id in set(expected) & set(indexed)
+            if expected[booking_id] != indexed[booking_id]
+        )
+        return {
+            'consistent': not (missing or stale or mismatched),
+            'indexed_bookings': len(indexed),
+            'database_bookings': len(expected),
+            'missing': missing,
+            'stale': stale,
+            'mismatched': mismatched,
+            'age_seconds': round(time.monotonic() - built_at, 1) if built_at is not None else None
+        }
+
+occupancy_index = OccupancyIndex()
+
+# ==================== AVAILABILITY CALENDAR ====================
+
+def month_bounds(month_start):
+    """(first day, first day of the next month)"""
+    return month_start, (month_start + timedelta(days=32)).replace(day=1)
+
+class AvailabilityCalendar:
+    """Per-night free room counts for a (room_type, month), cached as JSON.
+    
+    A grid is built from one GROUP BY over the month's room nights and kept
+    serialized. Routes that change occupancy drop the months a stay touches,
+    for its room type and for the all-types grid; changes made by other
+    workers show up once a grid is older than AVAILABILITY_CALENDAR_MAX_AGE.
+    """
+    
+    def __init__(self, max_age=AVAILABILITY_CALENDAR_MAX_AGE, max_entries=AVAILABILITY_CALENDAR_SIZE):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._grids = OrderedDict()  # (room_type, month_start) -> (built_at, body)
+        self._generation = 0  # bumped by every invalidation, so a racing build isn't cached
+    
+    def month_json(self, room_type, month_start):
+        key = (room_type or None, month_start)
+        with self._lock:
+            cached = self._grids.get(key)
+            if cached and time.monotonic() - cached[0] <= self.max_age:
+                self._grids.move_to_end(key)
+                return cached[1]
+            generation = self._generation
+        
+        body = self.build(room_type, month_start)
+        with self._lock:
+            if generation == self._generation:
+                self._grids[key] = (time.monotonic(), body)
+                self._grids.move_to_end(key)
+                while len(self._grids) > self.max_entries:
+                    self._grids.popitem(last=False)
+        return body
+    
+    def build(self, room_type, month_start):
+        start, end = month_bounds(month_start)
+        room_ids = [room['id'] for room in room_catalog.rooms(room_type)]
+        with query_tag('availability_calendar'):
+            held = dict(db.session.query(RoomNight.night, func.count(RoomNight.id)).filter(
+                RoomNight.room_id.in_(room_ids),
+                RoomNight.night >= start,
+                RoomNight.night < end
+            ).group_by(RoomNight.night).all()) if room_ids else {}
+        
+        return json.dumps({
+            'success': True,
+            'room_type': room_type or None,
+            'month': start.isoformat()[:7],
+            'total_rooms': len(room_ids),
+            'days': [
+                {'date': night.isoformat(), 'free': len(room_ids) - held.get(night, 0)}
+                for night in stay_nights(start, end)
+            ]
+        })
+    
+    def invalidate_stay(self, booking):
+        """Drop the grids covering a booking's nights"""
+        entry = room_catalog.snapshot().get(booking.room_id)
+        if entry is None:
+            self.invalidate()
+            return
+        room_types = (None, entry['room_type'])
+        month = booking.check_in.replace(day=1)
+        months = []
+        while month < booking.check_out:
+            months.append(month)
+            month = month_bounds(month)[1]
+        with self._lock:
+            self._generation += 1
+            for key in [(room_type, month) for room_type in room_types for month in months]:
+                self._grids.pop(key, None)
+    
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._grids.clear()
+
+availability_calendar = AvailabilityCalendar()
+
+# ==================== ROOM CATALOG CACHE ====================
+
+ROOM_CATALOG_FIELDS = ('id', 'room_number', 'room_type', 'price_per_night', 'capacity', 'description', 'amenities', 'image_url')
+
+def bump_cache_version(connection, name):
+    """Increment a shared cache version inside the current transaction"""
+    table = CacheVersion.__table__
+    result = connection.execute(table.update().where(table.c.name == name).values(version=table.c.version + 1))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(name=name, version=1))
+
+class RoomCatalog:
+    """Versioned in-process copy of the rooms table.
+    
+    Entries are plain dicts with amenities already decoded, plus the JSON
+    fragment each room contributes to API responses. Commits that touch a
+    Room invalidate this worker's copy through SQLAlchemy events; with
+    ROOM_CATALOG_SHARED_VERSION the same writes bump a counter in
+    cache_versions, which other workers poll at most every
+    ROOM_CATALOG_VERSION_CHECK_SECONDS. Reads in between cost no SQL.
+    """
+    
+    VERSION_NAME = 'rooms'
+    
+    def __init__(self, shared=ROOM_CATALOG_SHARED_VERSION, check_interval=ROOM_CATALOG_VERSION_CHECK_SECONDS):
+        self.shared = shared
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = None      # room_id -> entry, ordered by id
+        self._fragments = None    # room_id -> JSON string
+        self._local_version = 0
+        self._built_local_version = None
+        self._built_shared_version = None
+        self._checked_at = 0.0
+    
+    def invalidate(self):
+        with self._lock:
+            self._local_version += 1
+    
+    def _read_shared_version(self):
+        return db.session.query(CacheVersion.version).filter_by(name=self.VERSION_NAME).scalar() or 0
+    
+    def _ensure_fresh(self):
+        stale = self._entries is None or self._built_local_version != self._local_version
+        if not stale and self.shared and time.monotonic() - self._checked_at > self.check_interval:
+            self._checked_at = time.monotonic()
+            stale = self._read_shared_version() != self._built_shared_version
+        if stale:
+            self.rebuild()
+    
+    def rebuild(self):
+        # Versions are read before the rows, so a write racing the rebuild
+        # leaves the catalog marked stale rather than silently outdated
+        local_version = self._local_version
+        shared_version = self._read_shared_version() if self.shared else None
+        
+        entries = OrderedDict()
+        fragments = {}
+        for room in Room.query.order_by(Room.id).all():
+            entry = {
+                'id': room.id,
+                'room_number': room.room_number,
+                'room_type': room.room_type,
+                'price_per_night': room.price_per_night,
+                'capacity': room.capacity,
+                'description': room.description,
+                'amenities': json.loads(room.amenities) if room.amenities else [],
+                'image_url': room.image_url,
+                'is_available': room.is_available
+            }
+            entries[room.id] = entry
+            fragments[room.id] = json.dumps({field: entry[field] for field in ROOM_CATALOG_FIELDS})
+        
+        with self._lock:
+            self._entries = entries
+            self._fragments = fragments
+            self._built_local_version = local_version
+            self._built_shared_version = shared_version
+            self._checked_at = time.monotonic()
+    
+    def snapshot(self):
+        """All rooms as room_id -> entry; replaced on rebuild, never modified"""
+        self._ensure_fresh()
+        return self._entries
+    
+    def rooms(self, room_type=None):
+        """Bookable rooms, optionally of one type, ordered by id"""
+        self._ensure_fresh()
+        return [
+            entry for entry in self._entries.values()
+            if entry['is_available'] and (not room_type or entry['room_type'] == room_type)
+        ]
+    
+    def json_array(self, room_ids):
+        """Serialized JSON array of the given rooms, built from cached fragments"""
+        self._ensure_fresh()
+        return '[' + ','.join(self._fragments[room_id] for room_id in room_ids if room_id in self._fragments) + ']'
+
+room_catalog = RoomCatalog()
+
+@db.event.listens_for(Room, 'after_insert')
+@db.event.listens_for(Room, 'after_update')
+@db.event.listens_for(Room, 'after_delete')
+def room_catalog_write(mapper, connection, target):
+    if room_catalog.shared:
+        bump_cache_version(connection, RoomCatalog.VERSION_NAME)
+    object_session(target).info['room_catalog_dirty'] = True
+
+@db.event.listens_for(db.session, 'after_commit')
+def room_catalog_commit(session):
+    if session.info.pop('room_catalog_dirty', False):
+        room_catalog.invalidate()
+        availability_calendar.invalidate()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def room_catalog_rollback(session):
+    session.info.pop('room_catalog_dirty', None)
+
+# ==================== PRICING ====================
+
+class PricingEngine:
+    """Per-room-type nightly rate tables with vectorized quoting.
+    
+    Each room type has a NumPy row of nightly multipliers for the next
+    PRICING_HORIZON_DAYS (weekend rate x room_rates rules x occupancy tier)
+    and its running sum, so the price of a stay is the room's base price
+    times cumsum[check_out] - cumsum[check_in]. Quoting any number of rooms
+    for any number of date ranges is then a few array operations. Tables are
+    rebuilt when rate rules change in this worker, when the room catalog
+    changes, and otherwise every PRICING_TABLE_MAX_AGE seconds. Nights past
+    the horizon are charged the base price.
+    """
+    
+    def __init__(self, horizon_days=PRICING_HORIZON_DAYS, max_age=PRICING_TABLE_MAX_AGE):
+        self.horizon_days = horizon_days
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._tables = None
+        self._built_at = None
+    
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+    
+    def _ensure_fresh(self):
+        tables = self._tables
+        if (self._built_at is None or time.monotonic() - self._built_at > self.max_age
+                or tables['entries'] is not room_catalog.snapshot() or tables['start'] != date.today()):
+            self.rebuild()
+    
+    def rebuild(self):
+        start = date.today()
+        days = self.horizon_days
+        entries = room_catalog.snapshot()
+        room_types = sorted({entry['room_type'] for entry in entries.values()})
+        type_rows = {room_type: row for row, room_type in enumerate(room_types)}
+        
+        nights = np.datetime64(start, 'D') + np.arange(days)
+        weekdays = (nights.astype('int64') + 3) % 7  # 1970-01-01 was a Thursday
+        factors = np.ones((len(room_types), days))
+        factors[:, np.isin(weekdays, PRICING_WEEKEND_DAYS)] *= PRICING_WEEKEND_MULTIPLIER
+        
+        rules = RoomRate.query.filter(
+            db.or_(RoomRate.end_date.is_(None), RoomRate.end_date >= start),
+            db.or_(RoomRate.start_date.is_(None), RoomRate.start_date < start + timedelta(days=days))
+        ).all()
+        for rule in rules:
+            if rule.room_type and rule.room_type not in type_rows:
+                continue
+            mask = np.ones(days, dtype=bool)
+            if rule.start_date:
+                mask &= nights >= np.datetime64(rule.start_date, 'D')
+            if rule.end_date:
+                mask &= nights <= np.datetime64(rule.end_date, 'D')
+            if rule.weekdays:
+                mask &= np.isin(weekdays, [int(day) for day in rule.weekdays.split(',')])
+            rows = type_rows[rule.room_type] if rule.room_type else slice(None)
+            factors[rows, mask] *= rule.multiplier
+        
+        base_prices = np.array([entry['price_per_night'] for entry in entries.values()], dtype=float)
+        room_rows = np.array([type_rows[entry['room_type']] for entry in entries.values()], dtype=np.int64)
+        if PRICING_OCCUPANCY_TIERS and room_types:
+            factors *= self._occupancy_factors(start, days, type_rows, room_rows)
+        
+        cumulative = np.zeros((len(room_types), days + 1))
+        np.cumsum(factors, axis=1, out=cumulative[:, 1:])
+        tables = {
+            'start': start,
+            'entries': entries,
+            'room_ids': np.fromiter(entries.keys(), dtype=np.int64, count=len(entries)),
+            'base_prices': base_prices,
+            'room_rows': room_rows,
+            'cumulative': cumulative
+        }
+        with self._lock:
+            self._tables = tables
+            self._built_at = time.monotonic()
+    
+    def _occupancy_factors(self, start, days, type_rows, room_rows):
+        """Occupancy tier multiplier per room type and night"""
+        held = db.session.query(Room.room_type, RoomNight.night, func.count(RoomNight.id)).join(
+            Room, Room.id == RoomNight.room_id
+        ).filter(
+            RoomNight.night >= start,
+            RoomNight.night < start + timedelta(days=days)
+        ).group_by(Room.room_type, RoomNight.night).all()
+        
+        counts = np.zeros((len(type_rows), days))
+        for room_type, night, count in held:
+            if room_type in type_rows:
+                counts[type_rows[room_type], (night - start).days] = count
+        occupancy = counts / np.maximum(np.bincount(room_rows, minlength=len(type_rows)), 1)[:, None]
+        
+        tier_factors = np.ones_like(occupancy)
+        for threshold, multiplier in PRICING_OCCUPANCY_TIERS:
+            tier_factors[occupancy >= threshold] = multiplier
+        return tier_factors
+    
+    def quote(self, room_ids, date_ranges):
+        """Total price of each room for each (check_in, check_out), as a (ranges, rooms) array"""
+        self._ensure_fresh()
+        tables = self._tables
+        room_ids = np.asarray(room_ids, dtype=np.int64)
+        positions = np.searchsorted(tables['room_ids'], room_ids)
+        if len(room_ids) and (positions.max() >= len(tables['room_ids']) or (tables['room_ids'][positions] != room_ids).any()):
+            raise KeyError('Unknown room')
+        
+        offsets = np.array([
+            ((check_in - tables['start']).days, (check_out - tables['start']).days)
+            for check_in, check_out in date_ranges
+        ], dtype=np.int64).reshape(-1, 2)
+        check_in, check_out = offsets[:, :1], offsets[:, 1:]
+        first = np.clip(check_in, 0, self.horizon_days)
+        last = np.clip(check_out, 0, self.horizon_days)
+        
+        cumulative = tables['cumulative']
+        rows = tables['room_rows'][positions][None, :]
+        # Nights outside the horizon count once each at the base price
+        factor_sums = cumulative[rows, last] - cumulative[rows, first] + ((check_out - check_in) - (last - first))
+        return np.round(tables['base_prices'][positions][None, :] * factor_sums, 2)
+    
+    def stay_price(self, room_id, check_in, check_out):
+        return float(self.quote([room_id], [(check_in, check_out)])[0, 0])
+
+pricing_engine = PricingEngine()
+
+@db.event.listens_for(RoomRate, 'after_insert')
+@db.event.listens_for(RoomRate, 'after_update')
+@db.event.listens_for(RoomRate, 'after_delete')
+def room_rate_write(mapper, connection, target):
+    object_session(target).info['pricing_dirty'] = True
+
+@db.event.listens_for(db.session, 'after_commit')
+def room_rate_commit(session):
+    if session.info.pop('pricing_dirty', False):
+        pricing_engine.invalidate()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def room_rate_rollback(session):
+    session.info.pop('pricing_dirty', None)
+
+# ==================== DAILY AGGREGATES ====================
+
+def apply_booking_to_daily_stats(booking, sign):
+    """Add (sign=1) or remove (sign=-1) a confirmed stay from daily_stats.
+    
+    Revenue is spread evenly over the nights of the stay so ADR and RevPAR
+    can be read per night. Runs in the caller's transaction.
+    """
+    nights = stay_nights(booking.check_in, booking.check_out)
+    if not nights:
+        return
+    room_type = booking.room.room_type
+    nightly_revenue = booking.total_price / len(nights) * sign
+    table = DailyStat.__table__
+    
+    for night in nights:
+        match = db.and_(table.c.day == night, table.c.room_type == room_type)
+        increment = table.update().where(match).values(
+            revenue=table.c.revenue + nightly_revenue,
+            room_nights_sold=table.c.room_nights_sold + sign
+        )
+        if db.session.execute(increment).rowcount:
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(
+                    day=night, room_type=room_type, revenue=nightly_revenue, room_nights_sold=sign
+                ))
+        except IntegrityError:
+            # Another request created the row first
+            db.session.execute(increment)
+
+def backfill_daily_stats():
+    """Rebuild daily_stats from confirmed bookings; returns the number of rows written"""
+    totals = {}
+    rows = db.session.query(
+        Booking.check_in, Booking.check_out, Booking.total_price, Room.room_type
+    ).join(Room, Booking.room_id == Room.id).filter(Booking.status == 'confirmed')
+    for row in rows:
+        nights = stay_nights(row.check_in, row.check_out)
+        for night in nights:
+            entry = totals.setdefault((night, row.room_type), [0.0, 0])
+            entry[0] += row.total_price / len(nights)
+            entry[1] += 1
+    
+    DailyStat.query.delete()
+    db.session.add_all(
+        DailyStat(day=day, room_type=room_type, revenue=revenue, room_nights_sold=sold)
+        for (day, room_type), (revenue, sold) in totals.items()
+    )
+    db.session.commit()
+    return len(totals)
+
+def daily_stats_summary(start, end):
+    """Revenue, occupancy, ADR and RevPAR for nights in [start, end) from daily_stats"""
+    revenue, sold = db.session.query(
+        func.coalesce(func.sum(DailyStat.revenue), 0),
+        func.coalesce(func.sum(DailyStat.room_nights_sold), 0)
+    ).filter(DailyStat.day >= start, DailyStat.day < end).one()
+    
+    available = len(room_catalog.rooms()) * (end - start).days
+    return {
+        'revenue': revenue,
+        'room_nights_sold': sold,
+        'occupancy': sold / available if available else 0,
+        'adr': revenue / sold if sold else 0,
+        'revpar': revenue / available if available else 0
+    }
+
+# ==================== EXPIRY SWEEPER ====================
+
+class ExpirySweeper:
+    """Expires abandoned pending bookings and prunes old OTP records and rate limit hits.
+    
+    Work is done in batches of SWEEP_BATCH_SIZE rows, each in its own short
+    transaction, and every update re-checks the row's status so a sweep
+    never overrides a payment confirmed in the meantime. Runs on a
+    background thread (SWEEPER_IN_PROCESS) or via `flask sweep-expired`.
+    """
+    
+    def __init__(self, interval=SWEEP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self.last_run = None
+        self.totals = {'runs': 0, 'bookings_expired': 0, 'payments_expired': 0, 'otp_records_pruned': 0, 'rate_limit_rows_pruned': 0}
+    
+    def start(self, app=None):
+        """Start the sweep thread once per process (safe after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.app = app or current_app._get_current_object()
+            threading.Thread(target=self._run, name='expiry-sweeper', daemon=True).start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.run()
+            except Exception as e:
+                logger.exception("Expiry sweeper error")
+    
+    def expire_bookings_batch(self, cutoff):
+        """Expire one batch of stale pending bookings; returns (candidates, expired, payments)"""
+        ids = [row.id for row in db.session.query(Booking.id).filter(
+            Booking.status == 'pending',
+            Booking.created_at < cutoff
+        ).order_by(Booking.id).limit(SWEEP_BATCH_SIZE)]
+        if not ids:
+            db.session.rollback()
+            return 0, 0, 0
+        
+        expired = Booking.query.filter(Booking.id.in_(ids), Booking.status == 'pending').update(
+            {'status': 'expired'}, synchronize_session=False
+        )
+        expired_ids = db.session.query(Booking.id).filter(Booking.id.in_(ids), Booking.status == 'expired')
+        RoomNight.query.filter(RoomNight.booking_id.in_(expired_ids)).delete(synchronize_session=False)
+        payments = Payment.query.filter(
+            Payment.booking_id.in_(expired_ids),
+            Payment.payment_status == 'pending'
+        ).update({'payment_status': 'expired'}, synchronize_session=False)
+        released = [row.id for row in expired_ids]
+        db.session.commit()
+        
+        for booking_id in released:
+            occupancy_index.discard(booking_id)
+        if released:
+            availability_calendar.invalidate()
+        return len(ids), expired, payments
+    
+    def prune_otp_batch(self, cutoff):
+        """Delete one batch of OTP records older than the cutoff; returns rows deleted"""
+        ids = [row.id for row in db.session.query(OTPRecord.id).filter(
+            OTPRecord.created_at < cutoff
+        ).order_by(OTPRecord.id).limit(SWEEP_BATCH_SIZE)]
+        if not ids:
+            db.session.rollback()
+            return 0
+        deleted = OTPRecord.query.filter(OTPRecord.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+    
+    def run(self):
+        """One sweep over every table, bounded by SWEEP_MAX_BATCHES batches each"""
+        started = time.monotonic()
+        stats = {'bookings_expired': 0, 'payments_expired': 0, 'otp_records_pruned': 0, 'rate_limit_rows_pruned': 0, 'batches': 0}
+        
+        hold_cutoff = datetime.utcnow() - timedelta(minutes=BOOKING_HOLD_MINUTES)
+        for _ in range(SWEEP_MAX_BATCHES):
+            candidates, expired, payments = self.expire_bookings_batch(hold_cutoff)
+            stats['bookings_expired'] += expired
+            stats['payments_expired'] += payments
+            stats['batches'] += 1 if candidates else 0
+            if candidates < SWEEP_BATCH_SIZE:
+                break
+        
+        otp_cutoff = datetime.utcnow() - timedelta(days=OTP_RECORD_RETENTION_DAYS)
+        for _ in range(SWEEP_MAX_BATCHES):
+            deleted = self.prune_otp_batch(otp_cutoff)
+            stats['otp_records_pruned'] += deleted
+            stats['batches'] += 1 if deleted else 0
+            if deleted < SWEEP_BATCH_SIZE:
+                break
+        
+        if isinstance(rate_limit_backend.get(), DatabaseRateLimitBackend):
+            # Keys that are hit again trim their own window; this clears the rest
+            rate_limit_cutoff = time.time() - max(OTP_PHONE_WINDOW_SECONDS, OTP_IP_WINDOW_SECONDS)
+            for _ in range(SWEEP_MAX_BATCHES):
+                deleted = rate_limit_backend.prune(rate_limit_cutoff, SWEEP_BATCH_SIZE)
+                stats['rate_limit_rows_pruned'] += deleted
+                stats['batches'] += 1 if deleted else 0
+                if deleted < SWEEP_BATCH_SIZE:
+                    break
+        
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        stats['finished_at'] = datetime.utcnow().isoformat()
+        with self._lock:
+            self.last_run = stats
+            self.totals['runs'] += 1
+            for key in ('bookings_expired', 'payments_expired', 'otp_records_pruned', 'rate_limit_rows_pruned'):
+                self.totals[key] += stats[key]
+        if stats['bookings_expired'] or stats['otp_records_pruned'] or stats['rate_limit_rows_pruned']:
+            logger.info("Sweep finished", extra=stats)
+        return stats
+
+expiry_sweeper = ExpirySweeper()
+
+# ==================== PAYMENT GATEWAY ====================
+
+class RazorpayGateway:
+    """Razorpay orders over a pooled keep-alive session with connect/read timeouts.
+    
+    Each order's receipt is an idempotency key derived from the booking
+    reference and amount. A create that times out may still have reached
+    Razorpay, so the key is looked up before the create is retried.
+    """
+    
+    name = 'razorpay'
+    
+    def __init__(self, key_id, key_secret, timeout=(RAZORPAY_CONNECT_TIMEOUT_SECONDS, RAZORPAY_READ_TIMEOUT_SECONDS), pool_size=RAZORPAY_POOL_SIZE):
+        http_session = requests.Session()
+        http_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.client = razorpay.Client(session=http_session, auth=(key_id, key_secret))
+        self.key_id = key_id
+        self.timeout = timeout
+    
+    @staticmethod
+    def idempotency_key(booking):
+        """Order receipt for a booking; a changed amount gets a new order"""
+        return f"{booking.booking_reference}-{int(round(booking.total_price * 100))}"
+    
+    def create_order(self, booking):
+        return self._create_idempotent({
+            'amount': int(round(booking.total_price * 100)),
+            'currency': 'INR',
+            'receipt': self.idempotency_key(booking),
+            'notes': {'booking_id': booking.id, 'user_id': booking.user_id}
+        })
+    
+    def create_group_order(self, group_reference, bookings):
+        """One order covering every booking of a group booking"""
+        amount = int(round(sum(booking.total_price for booking in bookings) * 100))
+        return self._create_idempotent({
+            'amount': amount,
+            'currency': 'INR',
+            'receipt': f"{group_reference}-{amount}",
+            'notes': {'group_reference': group_reference, 'user_id': bookings[0].user_id}
+        })
+    
+    def _create_idempotent(self, data):
+        with timed_call(self.name, 'order.create'):
+            try:
+                return self._create(data)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                logger.warning("Razorpay order create failed, checking for an existing order", extra={'receipt': data['receipt'], 'error': str(e)})
+                return self.find_order(data['receipt'], data['amount']) or self._create(data)
+    
+    def _create(self, data):
+        return self.client.order.create(data, timeout=self.timeout)
+    
+    def find_order(self, receipt, amount):
+        orders = self.list_orders({'receipt': receipt}).get('items', [])
+        return next((order for order in orders if order.get('amount') == amount), None)
+    
+    def list_orders(self, params):
+        with timed_call(self.name, 'order.list'):
+            return self._list(params)
+    
+    def _list(self, params):
+        return self.client.order.all(params, timeout=self.timeout)
+    
+    def captured_payment_id(self, order_id):
+        """Id of the captured payment on an order, or None"""
+        with timed_call(self.name, 'order.payments'):
+            payments = self._order_payments(order_id).get('items', [])
+        return next((payment['id'] for payment in payments if payment.get('status') == 'captured'), None)
+    
+    def _order_payments(self, order_id):
+        return self.client.order.payments(order_id, timeout=self.timeout)
+    
+    def refund(self, payment_id, amount, receipt):
+        """Refund `amount` paise of a captured payment"""
+        with timed_call(self.name, 'payment.refund'):
+            return self._refund(payment_id, {'amount': amount, 'receipt': receipt})
+    
+    def _refund(self, payment_id, data):
+        return self.client.payment.refund(payment_id, data, timeout=self.timeout)
+    
+    def verify_payment_signature(self, params):
+        return self.client.utility.verify_payment_signature(params)
+    
+    def verify_webhook_signature(self, body, signature, secret):
+        return self.client.utility.verify_webhook_signature(body, signature, secret)
+
+class StubPaymentGateway(RazorpayGateway):
+    """In-memory gateway for development and benchmarks; never leaves the machine.
+    
+    Orders are keyed by receipt, so creates are idempotent. Signatures are
+    real HMACs with the key secret, and capture() returns what Checkout
+    would post to /verify-payment. Refunds are recorded in `refunds`.
+    PAYMENT_STUB_LATENCY_MS adds a fake round trip to each call.
+    """
+    
+    name = 'stub'
+    
+    def __init__(self, key_id, key_secret, latency_ms=PAYMENT_STUB_LATENCY_MS):
+        super().__init__(key_id, key_secret)
+        self.key_secret = key_secret
+        self.latency = latency_ms / 1000.0
+        self._orders = OrderedDict()
+        self._payments = {}  # order_id -> captured payment entities
+        self.refunds = []
+        self._lock = threading.Lock()
+    
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+    
+    def _create(self, data):
+        self._round_trip()
+        order_id = f"order_{hashlib.sha256(data['receipt'].encode('utf-8')).hexdigest()[:14]}"
+        with self._lock:
+            if order_id not in self._orders:
+                self._orders[order_id] = dict(data, id=order_id, entity='order', status='created', created_at=int(time.time()))
+            return dict(self._orders[order_id])
+    
+    def _list(self, params):
+        self._round_trip()
+        with self._lock:
+            orders = [
+                dict(order) for order in reversed(self._orders.values())
+                if ('receipt' not in params or order['receipt'] == params['receipt'])
+                and params.get('from', 0) <= order['created_at'] <= params.get('to', float('inf'))
+            ]
+        skip = params.get('skip', 0)
+        return {'entity': 'collection', 'items': orders[skip:skip + params.get('count', 10)]}
+    
+    def capture(self, order_id):
+        """Mark an order paid and return the Checkout callback fields for it"""
+        payment_id = f"pay_{secrets.token_hex(7)}"
+        with self._lock:
+            order = self._orders[order_id]
+            order['status'] = 'paid'
+            self._payments.setdefault(order_id, []).append(
+                {'id': payment_id, 'entity': 'payment', 'order_id': order_id, 'amount': order['amount'], 'status': 'captured'}
+            )
+        signature = hmac.new(self.key_secret.encode('utf-8'), f"{order_id}|{payment_id}".encode('utf-8'), hashlib.sha256).hexdigest()
+        return {'razorpay_order_id': order_id, 'razorpay_payment_id': payment_id, 'razorpay_signature': signature}
+    
+    def _order_payments(self, order_id):
+        self._round_trip()
+        with self._lock:
+            return {'entity': 'collection', 'items': [dict(payment) for payment in self._payments.get(order_id, [])]}
+    
+    def _refund(self, payment_id, data):
+        self._round_trip()
+        with self._lock:
+            captured = next((payment for payments in self._payments.values() for payment in payments if payment['id'] == payment_id), None)
+            if captured is None:
+                raise razorpay.errors.BadRequestError(f'Payment {payment_id} has not been captured')
+            refunded = sum(refund['amount'] for refund in self.refunds if refund['payment_id'] == payment_id)
+            if refunded + data['amount'] > captured['amount']:
+                raise razorpay.errors.BadRequestError('The total refund amount is greater than the payment amount')
+            refund = dict(data, id=f"rfnd_{secrets.token_hex(7)}", entity='refund', payment_id=payment_id, status='processed')
+            self.refunds.append(refund)
+            return dict(refund)
+
+def create_payment_gateway():
+    """Build the gateway selected by PAYMENT_GATEWAY"""
+    if PAYMENT_GATEWAY == 'stub':
+        logger.warning("Using stub payment gateway, no orders reach Razorpay")
+        return StubPaymentGateway(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
+    return RazorpayGateway(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
+
+payment_gateway = LazyService(create_payment_gateway)
+order_executor = LazyService(lambda: ThreadPoolExecutor(max_workers=RAZORPAY_POOL_SIZE, thread_name_prefix='razorpay-order'))
+precreated_orders = {}
+
+def open_razorpay_payment(booking):
+    """Pending Razorpay payment for a booking, reusing an open one at the current amount"""
+    payment = Payment.query.filter(
+        Payment.booking_id == booking.id,
+        Payment.payment_method == 'razorpay',
+        Payment.payment_status == 'pending',
+        Payment.razorpay_order_id.isnot(None),
+        Payment.amount == booking.total_price
+    ).order_by(Payment.id.desc()).first()
+    if payment:
+        return payment
+    
+    order = payment_gateway.create_order(booking)
+    payment = Payment(
+        booking_id=booking.id,
+        amount=booking.total_price,
+        payment_method='razorpay',
+        transaction_id=f"TXN{secrets.token_hex(6).upper()}",
+        razorpay_order_id=order['id']
+    )
+    db.session.add(payment)
+    db.session.commit()
+    return payment
+
+def open_group_razorpay_payment(group_reference):
+    """Pending payments for a group's unpaid bookings, all on one combined Razorpay order.
+    
+    Each booking keeps its own Payment row so confirmation, cancellation and
+    reconciliation work per booking; the rows share razorpay_order_id. An
+    open order is reused while it still covers exactly the pending bookings.
+    """
+    bookings = Booking.query.filter_by(group_reference=group_reference, status='pending').order_by(Booking.id).all()
+    if not bookings:
+        return []
+    
+    payments = Payment.query.filter(
+        Payment.booking_id.in_([booking.id for booking in bookings]),
+        Payment.payment_method == 'razorpay',
+        Payment.payment_status == 'pending',
+        Payment.razorpay_order_id.isnot(None)
+    ).order_by(Payment.id.desc()).all()
+    by_booking = {}
+    for payment in payments:
+        by_booking.setdefault(payment.booking_id, payment)
+    order_ids = {payment.razorpay_order_id for payment in by_booking.values()}
+    if len(by_booking) == len(bookings) and len(order_ids) == 1 and all(
+        by_booking[booking.id].amount == booking.total_price for booking in bookings
+    ):
+        return [by_booking[booking.id] for booking in bookings]
+    
+    order = payment_gateway.create_group_order(group_reference, bookings)
+    payments = [
+        Payment(
+            booking_id=booking.id,
+            amount=booking.total_price,
+            payment_method='razorpay',
+            transaction_id=f"TXN{secrets.token_hex(6).upper()}",
+            razorpay_order_id=order['id']
+        )
+        for booking in bookings
+    ]
+    db.session.add_all(payments)
+    db.session.commit()
+    return payments
+
+def precreate_razorpay_order(app, booking_id):
+    """Open the Razorpay payment for a new booking in the background"""
+    with app.app_context():
+        try:
+            booking = db.session.get(Booking, booking_id)
+            if booking and booking.status == 'pending':
+                if booking.group_reference:
+                    open_group_razorpay_payment(booking.group_reference)
+                else:
+                    open_razorpay_payment(booking)
+        except Exception as e:
+            db.session.rollback()
+            logger.warning("Could not pre-create Razorpay order", extra={'booking_id': booking_id, 'error': str(e)})
+
+def schedule_razorpay_order(booking, group_bookings=()):
+    """Pre-create the order after booking so the payment page doesn't wait on Razorpay.
+    
+    A group booking gets one combined order, registered under each of its bookings.
+    """
+    booking_id = booking.id
+    booking_ids = [group_booking.id for group_booking in group_bookings] or [booking_id]
+    future = order_executor.submit(precreate_razorpay_order, current_app._get_current_object(), booking_id)
+    for pending_id in booking_ids:
+        precreated_orders[pending_id] = future
+    
+    def forget(_):
+        for pending_id in booking_ids:
+            precreated_orders.pop(pending_id, None)
+    future.add_done_callback(forget)
+
+# ==================== PAYMENT RECONCILIATION ====================
+
+def webhook_order_details(event_payload):
+    """(order_id, payment_id) referenced by a Razorpay webhook payload"""
+    entities = event_payload.get('payload', {})
+    payment_entity = entities.get('payment', {}).get('entity', {})
+    order_entity = entities.get('order', {}).get('entity', {})
+    return payment_entity.get('order_id') or order_entity.get('id'), payment_entity.get('id')
+
+class PaymentReconciler:
+    """Applies inbox webhooks in batches and polls Razorpay for stale payments.
+    
+    Webhook events are claimed from webhook_events with a conditional UPDATE
+    (like the email outbox), their payments are loaded with one IN query per
+    batch, and each batch commits once. Every RECONCILE_INTERVAL_SECONDS the
+    reconciler also lists recent orders from Razorpay in pages of 100 and
+    completes any stale local payment whose order is paid, covering
+    webhooks that never arrived. A capture for a booking the sweeper has
+    expired in the meantime takes the booking back if its nights are
+    still free; otherwise, as for a cancelled booking, the payment is
+    refunded through the gateway.
+    """
+    
+    COMPLETING_EVENTS = ('payment.captured', 'order.paid')
+    
+    def __init__(self, interval=RECONCILE_INTERVAL_SECONDS, batch_size=WEBHOOK_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reconciled_at = 0.0
+        self.metrics = {
+            'events_processed': 0, 'events_ignored': 0, 'payments_completed': 0, 'payments_failed': 0,
+            'reconcile_runs': 0, 'refunds_issued': 0, 'refunds_failed': 0
+        }
+    
+    def start(self, app=None):
+        """Start the reconciliation thread once per process (safe after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.app = app or current_app._get_current_object()
+            threading.Thread(target=self._run, name='payment-reconciler', daemon=True).start()
+    
+    def wake(self):
+        self.start()
+        self._wake.set()
+    
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while self.process_webhook_batch():
+                        pass
+                    self.process_refunds()
+                    if time.monotonic() - self._reconciled_at >= self.interval:
+                        self._reconciled_at = time.monotonic()
+                        self.reconcile_stale_payments()
+            except Exception as e:
+                db.session.rollback()
+                logger.exception("Payment reconciler error")
+    
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.metrics[name] += amount
+    
+    def claim_events(self):
+        now = datetime.utcnow()
+        due = db.or_(
+            WebhookEvent.status == 'pending',
+            db.and_(WebhookEvent.status == 'processing', WebhookEvent.claimed_at < now - timedelta(minutes=5))
+        )
+        ids = [row.id for row in db.session.query(WebhookEvent.id).filter(due).order_by(WebhookEvent.id).limit(self.batch_size)]
+        if not ids:
+            db.session.rollback()
+            return []
+        token = secrets.token_hex(16)
+        WebhookEvent.query.filter(WebhookEvent.id.in_(ids), due).update(
+            {'status': 'processing', 'claim_token': token, 'claimed_at': now},
+            synchronize_session=False
+        )
+        db.session.commit()
+        return WebhookEvent.query.filter_by(claim_token=token).order_by(WebhookEvent.id).all()
+    
+    def _payments_by_order(self, order_ids):
+        payments = Payment.query.options(
+            joinedload(Payment.booking).joinedload(Booking.user),
+            joinedload(Payment.booking).joinedload(Booking.room)
+        ).filter(Payment.razorpay_order_id.in_(order_ids)).order_by(Payment.id).all()
+        by_order = {}
+        for payment in payments:
+            by_order.setdefault(payment.razorpay_order_id, []).append(payment)
+        return by_order
+    
+    def _finish(self, confirmed, refunds):
+        for booking in confirmed:
+            occupancy_index.add(booking)
+            availability_calendar.invalidate_stay(booking)
+        if confirmed:
+            email_worker.wake()
+        if refunds:
+            self.process_refunds()
+    
+    def process_refunds(self):
+        """Refund payments marked 'refund_pending' through the gateway; returns how many were refunded.
+        
+        Each payment is claimed as 'refunding' first, so it is refunded at
+        most once. A refund the gateway rejects, and any QR (UPI) payment,
+        is left for manual review rather than retried.
+        """
+        ids = [row.id for row in db.session.query(Payment.id).filter(
+            Payment.payment_status == 'refund_pending',
+            Payment.payment_method == 'razorpay'
+        ).order_by(Payment.id).limit(self.batch_size)]
+        refunded = 0
+        for payment_id in ids:
+            claimed = Payment.query.filter_by(id=payment_id, payment_status='refund_pending').update(
+                {'payment_status': 'refunding'}, synchronize_session=False
+            )
+            db.session.commit()
+            if not claimed:
+                continue
+            payment = db.session.get(Payment, payment_id)
+            try:
+                razorpay_payment_id = payment.razorpay_payment_id or payment_gateway.captured_payment_id(payment.razorpay_order_id)
+                if not razorpay_payment_id:
+                    raise ValueError('No captured payment on the order')
+                payment_gateway.refund(razorpay_payment_id, int(round(payment.amount * 100)), payment.transaction_id)
+            except Exception as e:
+                payment.payment_status = 'refund_failed'
+                self._count('refunds_failed')
+                logger.error("Refund failed, needs manual review", extra={'transaction_id': payment.transaction_id, 'error': str(e)})
+            else:
+                payment.razorpay_payment_id = razorpay_payment_id
+                payment.payment_status = 'refunded'
+                refunded += 1
+                self._count('refunds_issued')
+                logger.info("Payment refunded", extra={'transaction_id': payment.transaction_id, 'amount': payment.amount})
+            db.session.commit()
+        return refunded
+    
+    def process_webhook_batch(self):
+        """Apply one batch of inbox events; returns the number claimed"""
+        events = self.claim_events()
+        if not events:
+            return 0
+        
+        parsed = []
+        for event in events:
+            order_id, payment_id = webhook_order_details(json.loads(event.payload))
+            parsed.append((event, order_id, payment_id))
+        payments = self._payments_by_order({order_id for _, order_id, _ in parsed if order_id})
+        
+        confirmed = []
+        refunds = 0
+        for event, order_id, payment_id in parsed:
+            order_payments = payments.get(order_id)
+            event.claim_token = None
+            event.processed_at = datetime.utcnow()
+            if not order_payments:
+                event.status = 'ignored'
+                event.error = 'No payment for order'
+                self._count('events_ignored')
+                continue
+            
+            # Several payments share an order when it covers a group booking
+            for payment in order_payments:
+                if event.event_type in self.COMPLETING_EVENTS:
+                    if payment.payment_status not in SETTLED_PAYMENT_STATUSES:
+                        outcome = complete_payment(payment, payment.booking.user, razorpay_payment_id=payment_id, reclaim=True)
+                        if outcome == 'confirmed':
+                            confirmed.append(payment.booking)
+                            self._count('payments_completed')
+                        refunds += outcome == 'refund'
+                elif event.event_type == 'payment.failed' and payment.payment_status == 'pending':
+                    payment.payment_status = 'failed'
+                    self._count('payments_failed')
+            event.status = 'processed'
+            self._count('events_processed')
+        
+        db.session.commit()
+        self._finish(confirmed, refunds)
+        return len(events)
+    
+    def reconcile_stale_payments(self):
+        """Complete stale Razorpay payments whose orders are paid; returns how many"""
+        now = datetime.utcnow()
+        stale = Payment.query.filter(
+            Payment.payment_method == 'razorpay',
+            Payment.payment_status.in_(['pending', 'expired']),
+            Payment.razorpay_order_id.isnot(None),
+            Payment.created_at < now - timedelta(minutes=RECONCILE_AFTER_MINUTES),
+            Payment.created_at > now - timedelta(hours=RECONCILE_LOOKBACK_HOURS)
+        ).all()
+        self._count('reconcile_runs')
+        if not stale:
+            db.session.rollback()
+            return 0
+        
+        # List orders over the stale window instead of fetching them one by one
+        window_start = min(payment.created_at for payment in stale) - timedelta(minutes=5)
+        window_end = max(payment.created_at for payment in stale) + timedelta(minutes=5)
+        paid_orders = {}
+        skip = 0
+        while True:
+            page = payment_gateway.list_orders({
+                'from': int(window_start.replace(tzinfo=timezone.utc).timestamp()),
+                'to': int(window_end.replace(tzinfo=timezone.utc).timestamp()),
+                'count': 100,
+                'skip': skip
+            })
+            items = page.get('items', [])
+            for order in items:
+                if order.get('status') == 'paid':
+                    paid_orders[order['id']] = order
+            if len(items) < 100:
+                break
+            skip += 100
         
-        if verification_check.status == 'approved':
-            return {'success': True, 'status': 'approved'}
-        else:
-            return {'success': False, 'status': verification_check.status}
-            
-    except Exception as e:
-        print(f"❌ Verification Error: {e}")
-        return {'success': False, 'error': str(e)}
+        confirmed = []
+        refunds = 0
+        for payment in stale:
+            if payment.razorpay_order_id in paid_orders:
+                outcome = complete_payment(payment, payment.booking.user, reclaim=True)
+                if outcome == 'confirmed':
+                    confirmed.append(payment.booking)
+                refunds += outcome == 'refund'
+        db.session.commit()
+        self._count('payments_completed', len(confirmed))
+        self._finish(confirmed, refunds)
+        return len(confirmed)
 
-def generate_booking_reference():
-    return f"HB{secrets.token_hex(4).upper()}"
+payment_reconciler = PaymentReconciler()
 
-def generate_qr_code(payment_data):
-    try:
-        qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=5)
-        qr.add_data(payment_data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-    except Exception as e:
-        print(f"QR Code error: {e}")
-        return None
+# ==================== EMAIL DELIVERY ====================
 
-def check_room_availability(room_id, check_in, check_out):
-    overlapping_bookings = Booking.query.filter(
-        Booking.room_id == room_id,
-        Booking.status.in_(['pending', 'confirmed']),
-        db.or_(
-            db.and_(Booking.check_in <= check_in, Booking.check_out > check_in),
-            db.and_(Booking.check_in < check_out, Booking.check_out >= check_out),
-            db.and_(Booking.check_in >= check_in, Booking.check_out <= check_out)
-        )
-    ).first()
-    return overlapping_bookings is None
+def booking_email_details(booking, user):
+    """Template values for the booking confirmation email"""
+    return {
+        'user_name': user.full_name,
+        'reference': booking.booking_reference,
+        'room_type': booking.room.room_type,
+        'room_number': booking.room.room_number,
+        'check_in': booking.check_in.strftime('%Y-%m-%d'),
+        'check_out': booking.check_out.strftime('%Y-%m-%d'),
+        'guests': booking.guests,
+        'total_price': booking.total_price
+    }
 
-def send_booking_confirmation_email(user_email, booking_details):
+def queue_booking_confirmation_email(user_email, booking_details):
+    """Add a confirmation email to the outbox; delivered after the caller commits"""
     if not user_email:
         return False
-    try:
-        msg = Message('Booking Confirmation - Hotel Luxe', sender=app.config['MAIL_USERNAME'], recipients=[user_email])
-        msg.body = f"""Dear {booking_details['user_name']},
+    db.session.add(EmailOutbox(
+        recipient=user_email,
+        subject='Booking Confirmation - Hotel Luxe',
+        body=f"""Dear {booking_details['user_name']},
 
 Your booking has been confirmed!
 
@@ -327,17 +2893,337 @@ Total Amount: ₹{booking_details['total_price']}
 
 Thank you for choosing Hotel Luxe!
 """
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Email error: {e}")
-        return False
+    ))
+    return True
+
+class EmailDeliveryWorker:
+    """Background threads that drain the email outbox.
+    
+    Each pass claims a batch of due messages with a conditional UPDATE, so
+    several threads or gunicorn workers can share the outbox, then sends the
+    whole batch over one SMTP connection. Failures are retried with
+    exponential backoff until EMAIL_MAX_ATTEMPTS.
+    """
+    
+    def __init__(self, threads=EMAIL_WORKER_THREADS, batch_size=EMAIL_BATCH_SIZE):
+        self.threads = threads
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.metrics = {
+            'sent': 0,
+            'retried': 0,
+            'failed': 0,
+            'batches': 0,
+            'smtp_connections': 0,
+            'last_batch_seconds': 0.0
+        }
+    
+    def start(self, app=None):
+        """Start the delivery threads once per process (safe after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.app = app or current_app._get_current_object()
+            for number in range(self.threads):
+                threading.Thread(target=self._run, name=f'email-worker-{number}', daemon=True).start()
+    
+    def wake(self):
+        """Ask the delivery threads to look for new messages now"""
+        self.start()
+        self._wake.set()
+    
+    def _run(self):
+        while True:
+            self._wake.wait(EMAIL_POLL_SECONDS)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while self.deliver_batch():
+                        pass
+            except Exception as e:
+                logger.exception("Email worker error")
+    
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.metrics[name] += amount
+    
+    def claim_batch(self):
+        """Mark up to batch_size due messages as ours and return them"""
+        now = datetime.utcnow()
+        due = db.or_(
+            db.and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+            # Messages left in 'sending' by a worker that died mid-batch
+            db.and_(
+                EmailOutbox.status == 'sending',
+                EmailOutbox.claimed_at < now - timedelta(seconds=EMAIL_CLAIM_TIMEOUT_SECONDS)
+            )
+        )
+        ids = [row.id for row in db.session.query(EmailOutbox.id).filter(due)
+               .order_by(EmailOutbox.next_attempt_at).limit(self.batch_size)]
+        if not ids:
+            db.session.rollback()
+            return []
+        
+        token = secrets.token_hex(16)
+        EmailOutbox.query.filter(EmailOutbox.id.in_(ids), due).update(
+            {'status': 'sending', 'claim_token': token, 'claimed_at': now},
+            synchronize_session=False
+        )
+        db.session.commit()
+        return EmailOutbox.query.filter_by(claim_token=token).order_by(EmailOutbox.id).all()
+    
+    def _schedule_retry(self, message, error):
+        message.attempts = (message.attempts or 0) + 1
+        message.last_error = str(error)[:1000]
+        message.claim_token = None
+        if message.attempts >= EMAIL_MAX_ATTEMPTS:
+            message.status = 'failed'
+            self._count('failed')
+        else:
+            delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (message.attempts - 1), 3600)
+            message.status = 'pending'
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+            self._count('retried')
+        logger.warning("Email delivery failed", extra={'recipient': message.recipient, 'attempts': message.attempts, 'error': str(error)})
+    
+    def deliver_batch(self):
+        """Send one claimed batch; returns the number of messages claimed"""
+        messages = self.claim_batch()
+        if not messages:
+            return 0
+        
+        started = time.monotonic()
+        try:
+            with timed_call('smtp', 'session'), mail.connect() as connection:
+                self._count('smtp_connections')
+                for message in messages:
+                    try:
+                        with timed_call('smtp', 'send'):
+                            connection.send(Message(
+                                message.subject,
+                                sender=current_app.config['MAIL_USERNAME'],
+                                recipients=[message.recipient],
+                                body=message.body
+                            ))
+                        message.status = 'sent'
+                        message.attempts = (message.attempts or 0) + 1
+                        message.sent_at = datetime.utcnow()
+                        message.claim_token = None
+                        self._count('sent')
+                    except Exception as e:
+                        self._schedule_retry(message, e)
+        except Exception as e:
+            # Could not connect, or the connection dropped: retry what is left
+            for message in messages:
+                if message.status == 'sending':
+                    self._schedule_retry(message, e)
+        
+        db.session.commit()
+        self._count('batches')
+        with self._lock:
+            self.metrics['last_batch_seconds'] = round(time.monotonic() - started, 3)
+        return len(messages)
+
+email_worker = EmailDeliveryWorker()
+
+# ==================== HTTP CACHING ====================
+
+# Cache-Control for responses that don't set their own; everything else is private
+ROUTE_CACHE_CONTROL = {
+    'booking.index': 'public, no-cache',
+    'booking.rooms': 'public, no-cache',
+    'auth.login': 'public, no-cache',
+    'auth.register': 'public, no-cache',
+    'booking.availability_calendar_month': f'public, max-age={AVAILABILITY_CALENDAR_MAX_AGE}',
+}
+DEFAULT_CACHE_CONTROL = 'private, no-cache'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def compress_body(data):
+    """Precompressed variants of a body, keyed by content coding"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return variants
+
+def encoded_response(bodies, mimetype, etag, cache_control):
+    """Response from precompressed bodies: picks the client's best coding and answers 304 on a matching ETag.
+    
+    Each coding is a different representation, so it gets its own strong ETag.
+    """
+    accepted = request.accept_encodings
+    encoding = next((coding for coding in ('br', 'gzip') if coding in bodies and accepted[coding]), 'identity')
+    etag = etag if encoding == 'identity' else f'{etag}-{encoding}'
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(bodies[encoding], mimetype=mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+class StaticAssets:
+    """Content-hashed URLs and precompressed bodies for the static folder.
+    
+    url_for('static', filename='css/style.css') yields css/style.<hash>.css.
+    A hashed URL always serves the same bytes, so it is sent with a one-year
+    immutable Cache-Control and a strong ETag, from gzip/brotli bodies that
+    were compressed once when the manifest was built (in the preloading
+    master under gunicorn). Unhashed paths keep working with STATIC_MAX_AGE.
+    """
+    
+    COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.xml')
+    
+    def __init__(self):
+        self._urls = {}     # filename -> hashed filename
+        self._assets = {}   # hashed filename -> asset
+    
+    def build(self, static_folder):
+        urls = {}
+        assets = {}
+        for root, _, files in os.walk(static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                stem, extension = os.path.splitext(filename)
+                hashed = f'{stem}.{digest}{extension}'
+                
+                bodies = None
+                if len(data) <= STATIC_PRECOMPRESS_MAX_BYTES:
+                    bodies = {'identity': data}
+                    if extension.lower() in self.COMPRESSIBLE:
+                        bodies.update(compress_body(data))
+                urls[filename] = hashed
+                assets[hashed] = {
+                    'filename': filename,
+                    'path': path,
+                    'digest': digest,
+                    'mimetype': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                    'bodies': bodies
+                }
+        self._urls = urls
+        self._assets = assets
+        return len(assets)
+    
+    def url_defaults(self, endpoint, values):
+        """url_defaults hook that swaps static filenames for their hashed names"""
+        if endpoint == 'static' and values.get('filename') in self._urls:
+            values['filename'] = self._urls[values['filename']]
+    
+    def lookup(self, hashed):
+        return self._assets.get(hashed)
+    
+    def write(self, output_dir):
+        """Write each hashed file with its .gz/.br variants, plus manifest.json, for a proxy or CDN"""
+        for hashed, asset in self._assets.items():
+            target = os.path.join(output_dir, *hashed.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            bodies = asset['bodies']
+            if bodies is None:
+                with open(asset['path'], 'rb') as f:
+                    bodies = {'identity': f.read()}
+            for encoding, body in bodies.items():
+                suffix = {'identity': '', 'gzip': '.gz', 'br': '.br'}[encoding]
+                with open(target + suffix, 'wb') as f:
+                    f.write(body)
+        with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+            json.dump(self._urls, f, indent=2, sort_keys=True)
+        return len(self._assets)
+
+static_assets = StaticAssets()
+
+def serve_static_asset(filename):
+    """Replacement for Flask's static view that understands hashed filenames"""
+    asset = static_assets.lookup(filename)
+    if asset is None:
+        response = current_app.send_static_file(filename)
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}'
+        return response
+    if asset['bodies'] is None:
+        response = current_app.send_static_file(asset['filename'])
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+    return encoded_response(asset['bodies'], asset['mimetype'], asset['digest'], IMMUTABLE_CACHE_CONTROL)
+
+class PageCache:
+    """Rendered HTML of the anonymous pages, with precompressed variants and a strong ETag.
+    
+    A page is rendered once per worker and reused until PAGE_CACHE_MAX_AGE
+    passes or the data it was rendered from changes (the page's version,
+    e.g. the room catalog snapshot for /rooms). Signed-in visitors always
+    get a fresh render, since the navigation shows their name.
+    """
+    
+    def __init__(self, max_age=PAGE_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._pages = {}  # name -> (built_at, version, bodies, etag)
+    
+    def get(self, name, render, version=None):
+        with self._lock:
+            cached = self._pages.get(name)
+        if cached and cached[1] is version and time.monotonic() - cached[0] <= self.max_age:
+            return cached[2], cached[3]
+        
+        data = render().encode('utf-8')
+        bodies = {'identity': data, **compress_body(data)}
+        etag = hashlib.sha256(data).hexdigest()[:16]
+        with self._lock:
+            self._pages[name] = (time.monotonic(), version, bodies, etag)
+        return bodies, etag
+    
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+page_cache = PageCache()
+
+def cached_page(name, render, version=None):
+    """Serve an anonymous page from the page cache, or render it privately for any visitor with a session"""
+    if session:
+        # A signed-in guest, an admin or pending flash messages: never shared
+        response = current_app.make_response(render())
+        response.headers['Cache-Control'] = DEFAULT_CACHE_CONTROL
+        return response
+    bodies, etag = page_cache.get(name, render, version)
+    return encoded_response(bodies, 'text/html', etag, ROUTE_CACHE_CONTROL.get(request.endpoint, DEFAULT_CACHE_CONTROL))
+
+
+
+def apply_cache_policy(response):
+    """Default Cache-Control per route, plus a strong ETag and 304s for other GETs"""
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = ROUTE_CACHE_CONTROL.get(request.endpoint, DEFAULT_CACHE_CONTROL)
+    if (request.method == 'GET' and response.status_code == 200 and not response.is_streamed
+            and not response.direct_passthrough and 'ETag' not in response.headers):
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+# ==================== BLUEPRINTS ====================
+
+auth_bp = Blueprint('auth', __name__)
+booking_bp = Blueprint('booking', __name__)
+payment_bp = Blueprint('payment', __name__)
+admin_bp = Blueprint('admin', __name__, cli_group=None)  # also carries the maintenance CLI commands
 
 # ==================== AUTHENTICATION ROUTES ====================
 
-@app.route('/send-otp', methods=['POST'])
+@auth_bp.route('/send-otp', methods=['POST'])
 def send_otp():
-    """Send OTP to mobile number using Twilio Verify"""
+    """Send OTP to mobile number through the configured OTP provider"""
     try:
         data = request.get_json()
         phone = normalize_phone(data.get('phone', ''))
@@ -346,13 +3232,6 @@ def send_otp():
         if not phone or len(phone) < 12:
             return jsonify({'success': False, 'message': 'Invalid phone number'}), 400
         
-        # Check daily OTP limit
-        if not check_otp_limit(phone):
-            return jsonify({
-                'success': False, 
-                'message': f'Maximum {MAX_OTP_RESEND_PER_DAY} OTP attempts per day exceeded. Try again tomorrow.'
-            }), 429
-        
         # Check if user exists
         existing_user = User.query.filter_by(phone=phone).first()
         
@@ -362,48 +3241,55 @@ def send_otp():
         if purpose == 'login' and not existing_user:
             return jsonify({'success': False, 'message': 'Phone number not registered. Please register first.'}), 404
         
-        # Send OTP via Twilio Verify
-        result = send_otp_via_twilio(phone)
+        # Fail fast while the provider is known to be down
+        if otp_breaker.is_open():
+            return jsonify({'success': False, 'message': 'OTP service temporarily unavailable. Please try again shortly.'}), 503
         
-        if not result['success']:
-            return jsonify({'success': False, 'message': 'Failed to send OTP'}), 500
+        # Check daily (per phone) and hourly (per IP) OTP limits
+        allowed, attempts_remaining, limit_message = check_otp_limit(phone, request.remote_addr)
+        if not allowed:
+            return jsonify({'success': False, 'message': limit_message}), 429
         
-        # Save OTP record
+        # OTPRecord is an audit log; the rate limiter above is the source of truth
         otp_record = OTPRecord(
             user_id=existing_user.id if existing_user else None,
             phone=phone,
             purpose=purpose,
-            verification_sid=result.get('sid'),
-            ip_address=request.remote_addr
+            ip_address=request.remote_addr,
+            created_at=datetime.utcnow()
         )
         
-        db.session.add(otp_record)
-        db.session.commit()
-        
-        # Get remaining attempts
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        used_count = OTPRecord.query.filter(
-            OTPRecord.phone == phone,
-            OTPRecord.created_at >= today_start
-        ).count()
+        if OTP_ASYNC_SEND:
+            # Respond without waiting on the provider or the audit insert
+            otp_executor.submit(deliver_otp, current_app._get_current_object(), otp_record)
+        else:
+            # Hand the connection back to the pool while the provider call is in flight
+            db.session.rollback()
+            result = send_otp_code(phone)
+            if not result['success']:
+                status_code = result.get('status_code')
+                if status_code and 400 <= status_code < 500:
+                    return jsonify({'success': False, 'message': 'Could not send OTP to this number'}), 400
+                return jsonify({'success': False, 'message': 'Failed to send OTP'}), 500
+            otp_record.verification_sid = result.get('sid')
+            db.session.add(otp_record)
+            db.session.commit()
         
         return jsonify({
             'success': True,
             'message': f'OTP sent to {phone}',
             'expires_in': 10,
-            'attempts_remaining': MAX_OTP_RESEND_PER_DAY - used_count
+            'attempts_remaining': attempts_remaining
         })
             
     except Exception as e:
         db.session.rollback()
-        print(f"Send OTP error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Send OTP error")
         return jsonify({'success': False, 'message': 'Error sending OTP'}), 500
 
-@app.route('/verify-otp', methods=['POST'])
+@auth_bp.route('/verify-otp', methods=['POST'])
 def verify_otp():
-    """Verify OTP using Twilio Verify and login/register user"""
+    """Verify OTP through the configured OTP provider and login/register user"""
     try:
         data = request.get_json()
         phone = normalize_phone(data.get('phone', ''))
@@ -413,17 +3299,14 @@ def verify_otp():
         if not phone or not otp_code:
             return jsonify({'success': False, 'message': 'Phone and OTP required'}), 400
         
-        # Verify OTP with Twilio
-        verification_result = verify_otp_via_twilio(phone, otp_code)
+        # Verify OTP with the configured provider
+        verification_result = verify_otp_code(phone, otp_code)
         
         if not verification_result['success'] or verification_result.get('status') != 'approved':
             return jsonify({'success': False, 'message': 'Invalid or expired OTP'}), 401
         
         # Update OTP record
-        otp_record = OTPRecord.query.filter_by(
-            phone=phone,
-            purpose=purpose
-        ).order_by(OTPRecord.created_at.desc()).first()
+        otp_record = latest_otp_record(phone, purpose)
         
         if otp_record:
             otp_record.status = 'approved'
@@ -452,9 +3335,7 @@ def verify_otp():
             db.session.add(new_user)
             db.session.commit()
             
-            session['user_id'] = new_user.id
-            session['user_name'] = new_user.full_name
-            session['user_phone'] = new_user.phone
+            login_user(new_user)
             
             return jsonify({
                 'success': True,
@@ -475,9 +3356,7 @@ def verify_otp():
             user.last_login = datetime.utcnow()
             db.session.commit()
             
-            session['user_id'] = user.id
-            session['user_name'] = user.full_name
-            session['user_phone'] = user.phone
+            login_user(user)
             
             return jsonify({
                 'success': True,
@@ -492,69 +3371,83 @@ def verify_otp():
             
     except Exception as e:
         db.session.rollback()
-        print(f"Verify OTP error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Verify OTP error")
         return jsonify({'success': False, 'message': 'Verification failed'}), 500
 
-@app.route('/resend-otp', methods=['POST'])
+@auth_bp.route('/resend-otp', methods=['POST'])
 def resend_otp():
     """Resend OTP with daily limit check"""
     return send_otp()
 
 # ==================== WEB ROUTES ====================
 
-@app.route('/')
+def start_background_workers():
+    """Start this process's background threads on its first request"""
+    email_worker.start()
+    payment_reconciler.start()
+    occupancy_index.start()
+    if SWEEPER_IN_PROCESS:
+        expiry_sweeper.start()
+
+
+@booking_bp.route('/')
 def index():
-    return render_template('index.html')
+    return cached_page('index', lambda: render_template('index.html'))
 
-@app.route('/rooms')
+@booking_bp.route('/rooms')
 def rooms():
-    all_rooms = Room.query.filter_by(is_available=True).all()
-    return render_template('rooms.html', rooms=all_rooms)
+    return cached_page('rooms', lambda: render_template('rooms.html', rooms=room_catalog.rooms()), room_catalog.snapshot())
 
-@app.route('/login')
+@auth_bp.route('/login')
 def login():
-    return render_template('login_otp.html')
+    return cached_page('login', lambda: render_template('login_otp.html'))
 
-@app.route('/register')
+@auth_bp.route('/register')
 def register():
-    return render_template('register_otp.html')
+    return cached_page('register', lambda: render_template('register_otp.html'))
 
-@app.route('/logout')
+@auth_bp.route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out successfully', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('booking.index'))
 
-@app.route('/profile')
+@auth_bp.route('/profile')
 def profile():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    user = User.query.get_or_404(session['user_id'])
+        return redirect(url_for('auth.login'))
+    user = current_user()
+    if user is None:
+        abort(404)
     return render_template('profile.html', user=user)
 
-@app.route('/update-profile', methods=['POST'])
+@auth_bp.route('/update-profile', methods=['POST'])
 def update_profile():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
     try:
         data = request.get_json()
-        user = User.query.get_or_404(session['user_id'])
+        identity = current_identity()
+        changes = {}
         
         if data.get('full_name'):
-            user.full_name = data['full_name']
-            session['user_name'] = user.full_name
+            changes['full_name'] = data['full_name']
         
         if data.get('email'):
             email = data['email'].lower().strip()
-            existing = User.query.filter(User.email == email, User.id != user.id).first()
+            existing = User.query.filter(User.email == email, User.id != identity['id']).first()
             if existing:
                 return jsonify({'success': False, 'message': 'Email already in use'}), 400
-            user.email = email
+            changes['email'] = email
         
+        # Update by id straight from the session claims; no need to load the row
+        if changes and not User.query.filter_by(id=identity['id']).update(changes):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'User not found'}), 404
         db.session.commit()
+        if 'full_name' in changes:
+            session['user_name'] = changes['full_name']
         return jsonify({'success': True, 'message': 'Profile updated'})
         
     except Exception as e:
@@ -563,7 +3456,7 @@ def update_profile():
 
 # ==================== BOOKING ROUTES ====================
 
-@app.route('/check-availability', methods=['POST'])
+@booking_bp.route('/check-availability', methods=['POST'])
 def check_availability():
     try:
         data = request.get_json()
@@ -573,32 +3466,91 @@ def check_availability():
         if check_out <= check_in:
             return jsonify({'success': False, 'message': 'Invalid date range'}), 400
         
-        query = Room.query.filter_by(is_available=True)
-        if data.get('room_type'):
-            query = query.filter_by(room_type=data['room_type'])
-        
-        available_rooms = []
-        for room in query.all():
-            if check_room_availability(room.id, check_in, check_out):
-                available_rooms.append({
-                    'id': room.id,
-                    'room_number': room.room_number,
-                    'room_type': room.room_type,
-                    'price_per_night': room.price_per_night,
-                    'capacity': room.capacity,
-                    'description': room.description,
-                    'amenities': json.loads(room.amenities) if room.amenities else [],
-                    'image_url': room.image_url
-                })
+        room_ids = find_available_room_ids(check_in, check_out, data.get('room_type'))
+        # prices[i] is the total for the stay in rooms[i]
+        prices = pricing_engine.quote(room_ids, [(check_in, check_out)])[0]
+        body = (
+            '{"success": true, "nights": ' + str((check_out - check_in).days)
+            + ', "rooms": ' + room_catalog.json_array(room_ids)
+            + ', "prices": ' + json.dumps(prices.tolist()) + '}'
+        )
+        return current_app.response_class(body, mimetype='application/json')
+    except Exception as e:
+        return jsonify({'success': False, 'message': 'Error checking availability'}), 500
+
+@booking_bp.route('/check-availability/bulk', methods=['POST'])
+def check_availability_bulk():
+    """Resolve availability for many date ranges at once (calendar views)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        ranges = data.get('ranges') or []
+        
+        if not isinstance(ranges, list) or not ranges or len(ranges) > MAX_BULK_AVAILABILITY_RANGES:
+            return jsonify({
+                'success': False,
+                'message': f'Provide between 1 and {MAX_BULK_AVAILABILITY_RANGES} date ranges'
+            }), 400
+        
+        date_ranges = []
+        for item in ranges:
+            check_in = datetime.strptime(item['check_in'], '%Y-%m-%d').date()
+            check_out = datetime.strptime(item['check_out'], '%Y-%m-%d').date()
+            if check_out <= check_in:
+                return jsonify({'success': False, 'message': 'Invalid date range'}), 400
+            date_ranges.append((check_in, check_out))
+        
+        results = find_available_rooms_bulk(date_ranges, data.get('room_type'))
         
-        return jsonify({'success': True, 'rooms': available_rooms})
+        # Quote every candidate room for every range at once, then pick each range's rooms
+        candidate_ids = sorted(set().union(*results))
+        quotes = pricing_engine.quote(candidate_ids, date_ranges)
+        
+        return jsonify({
+            'success': True,
+            'results': [
+                {
+                    'check_in': check_in.strftime('%Y-%m-%d'),
+                    'check_out': check_out.strftime('%Y-%m-%d'),
+                    'room_ids': room_ids,
+                    'prices': quotes[row, np.searchsorted(candidate_ids, room_ids)].tolist(),
+                    'available_count': len(room_ids)
+                }
+                for row, ((check_in, check_out), room_ids) in enumerate(zip(date_ranges, results))
+            ]
+        })
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid request'}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': 'Error checking availability'}), 500
 
-@app.route('/book', methods=['GET', 'POST'])
+@booking_bp.route('/availability/calendar')
+def availability_calendar_month():
+    """Free rooms per night for a month (?month=YYYY-MM, optional room_type)"""
+    try:
+        month = request.args.get('month')
+        month_start = datetime.strptime(month, '%Y-%m').date() if month else date.today().replace(day=1)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'month must be YYYY-MM'}), 400
+    this_month = date.today().replace(day=1)
+    months_away = (month_start.year - this_month.year) * 12 + month_start.month - this_month.month
+    if not -AVAILABILITY_CALENDAR_MONTHS_BACK <= months_away <= AVAILABILITY_CALENDAR_MONTHS_AHEAD:
+        return jsonify({
+            'success': False,
+            'message': f'month must be at most {AVAILABILITY_CALENDAR_MONTHS_BACK} months back '
+                       f'and {AVAILABILITY_CALENDAR_MONTHS_AHEAD} months ahead'
+        }), 400
+    
+    try:
+        body = availability_calendar.month_json(request.args.get('room_type'), month_start)
+
+        return current_app.response_class(body, mimetype='application/json')
+    except Exception as e:
+        return jsonify({'success': False, 'message': 'Error loading calendar'}), 500
+
+@booking_bp.route('/book', methods=['GET', 'POST'])
 def book():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('auth.login'))
     
     if request.method == 'POST':
         try:
@@ -609,27 +3561,33 @@ def book():
             if check_out <= check_in:
                 return jsonify({'success': False, 'message': 'Invalid date range'}), 400
             
-            if not check_room_availability(data['room_id'], check_in, check_out):
-                return jsonify({'success': False, 'message': 'Room not available'}), 400
+            room_id = int(data['room_id'])
             
-            room = Room.query.get(data['room_id'])
-            if not room:
-                return jsonify({'success': False, 'message': 'Room not found'}), 404
+            # The worker-local index rejects known conflicts without touching the
+            # database; the room_nights unique key in reserve_room() still catches
+            # bookings made by other workers since the last rebuild.
+            if not occupancy_index.is_free(room_id, check_in, check_out):
+                return jsonify({'success': False, 'message': 'Room not available'}), 400
             
-            nights = (check_out - check_in).days
-            new_booking = Booking(
-                user_id=session['user_id'],
-                room_id=data['room_id'],
-                check_in=check_in,
-                check_out=check_out,
+            result = reserve_room(
+                room_id,
+                session['user_id'],
+                check_in,
+                check_out,
                 guests=data['guests'],
-                total_price=room.price_per_night * nights,
-                booking_reference=generate_booking_reference(),
                 special_requests=data.get('special_requests', '')
             )
             
-            db.session.add(new_booking)
-            db.session.commit()
+            if not result['success']:
+                if result['error'] == 'not_found':
+                    return jsonify({'success': False, 'message': 'Room not found'}), 404
+                return jsonify({'success': False, 'message': 'Room not available'}), 400
+            
+            new_booking = result['booking']
+            occupancy_index.add(new_booking)
+            availability_calendar.invalidate_stay(new_booking)
+            if RAZORPAY_PRECREATE_ORDERS:
+                schedule_razorpay_order(new_booking)
             
             return jsonify({
                 'success': True,
@@ -639,59 +3597,163 @@ def book():
             })
         except Exception as e:
             db.session.rollback()
+            logger.exception("Booking error")
             return jsonify({'success': False, 'message': 'Booking failed'}), 500
     
     return render_template('booking.html')
 
-@app.route('/payment/<int:booking_id>', methods=['GET', 'POST'])
+@booking_bp.route('/book/group', methods=['POST'])
+def book_group():
+    """Book several rooms for the same dates in one transaction.
+    
+    rooms is a list of {"room_id": id} and {"room_type": type, "quantity": n}
+    lines. Availability is resolved in a single query; if the request can't
+    be met in full the rooms that can be had are returned as options, or
+    booked straight away when allow_partial is set.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        data = request.get_json()
+        check_in = datetime.strptime(data['check_in'], '%Y-%m-%d').date()
+        check_out = datetime.strptime(data['check_out'], '%Y-%m-%d').date()
+        if check_out <= check_in:
+            return jsonify({'success': False, 'message': 'Invalid date range'}), 400
+        
+        lines = []
+        for item in data['rooms']:
+            if 'room_id' in item:
+                lines.append({'room_id': int(item['room_id'])})
+            else:
+                lines.append({'room_type': str(item['room_type']), 'quantity': int(item.get('quantity', 1))})
+        requested = sum(line.get('quantity', 1) for line in lines)
+        if not lines or requested > MAX_GROUP_BOOKING_ROOMS or any(line.get('quantity', 1) < 1 for line in lines):
+            return jsonify({
+                'success': False,
+                'message': f'Request between 1 and {MAX_GROUP_BOOKING_ROOMS} rooms'
+            }), 400
+        guests = int(data.get('guests', 1))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid request'}), 400
+    
+    try:
+        available_ids = find_available_room_ids(check_in, check_out)
+        room_ids, shortfalls = allocate_group_rooms(lines, available_ids)
+        
+        if shortfalls and not (data.get('allow_partial') and room_ids):
+            return jsonify({
+                'success': False,
+                'message': 'Not enough rooms available',
+                'requested': requested,
+                'shortfalls': shortfalls,
+                'options': group_booking_options(room_ids, available_ids, check_in, check_out)
+            }), 409
+        
+        result = reserve_rooms(
+            room_ids,
+            session['user_id'],
+            check_in,
+            check_out,
+            guests=guests,
+            special_requests=data.get('special_requests', '')
+        )
+        if not result['success']:
+            if result['error'] == 'not_found':
+                return jsonify({'success': False, 'message': 'Room not found'}), 404
+            # Lost a race for some of the rooms; offer what is left now
+            available_ids = find_available_room_ids(check_in, check_out)
+            room_ids, shortfalls = allocate_group_rooms(lines, available_ids)
+            return jsonify({
+                'success': False,
+                'message': 'Rooms no longer available',
+                'requested': requested,
+                'shortfalls': shortfalls,
+                'options': group_booking_options(room_ids, available_ids, check_in, check_out)
+            }), 409
+        
+        bookings = result['bookings']
+        for booking in bookings:
+            occupancy_index.add(booking)
+            availability_calendar.invalidate_stay(booking)
+        if RAZORPAY_PRECREATE_ORDERS:
+            schedule_razorpay_order(bookings[0], bookings)
+        
+        return jsonify({
+            'success': True,
+            'group_reference': result['group_reference'],
+            'bookings': [
+                {
+                    'booking_id': booking.id,
+                    'booking_reference': booking.booking_reference,
+                    'room_id': booking.room_id,
+                    'total_price': booking.total_price
+                }
+                for booking in bookings
+            ],
+            'total_price': sum(booking.total_price for booking in bookings),
+            'shortfalls': shortfalls,
+            'payment_url': url_for('payment.payment', booking_id=bookings[0].id)
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Group booking error")
+        return jsonify({'success': False, 'message': 'Booking failed'}), 500
+
+@payment_bp.route('/payment/<int:booking_id>', methods=['GET', 'POST'])
 def payment(booking_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('auth.login'))
     
     booking = Booking.query.get_or_404(booking_id)
     if booking.user_id != session['user_id']:
         flash('Unauthorized access', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('booking.index'))
     
     if request.method == 'POST':
+        if booking.status != 'pending':
+            return jsonify({'success': False, 'message': f'Booking is {booking.status}, not awaiting payment'}), 409
         try:
             data = request.get_json()
             payment_method = data['payment_method']
             
-            payment = Payment(
-                booking_id=booking_id,
-                amount=booking.total_price,
-                payment_method=payment_method,
-                transaction_id=f"TXN{secrets.token_hex(6).upper()}"
-            )
-            
             if payment_method == 'razorpay':
-                amount_in_paise = int(booking.total_price * 100)
-                razorpay_order = razorpay_client.order.create({
-                    'amount': amount_in_paise,
-                    'currency': 'INR',
-                    'receipt': booking.booking_reference,
-                    'notes': {'booking_id': booking.id, 'user_id': session['user_id']}
-                })
+                # Usually the order was pre-created at booking time; if that is
+                # still in flight, wait for it rather than opening a second one
+                pending_order = precreated_orders.get(booking.id)
+                if pending_order:
+                    wait_for_futures([pending_order], timeout=RAZORPAY_READ_TIMEOUT_SECONDS)
+                    db.session.rollback()  # fresh snapshot that sees the background insert
                 
-                payment.razorpay_order_id = razorpay_order['id']
-                db.session.add(payment)
-                db.session.commit()
+                # A group booking is paid in one go through its combined order
+                if booking.group_reference:
+                    group_payments = open_group_razorpay_payment(booking.group_reference)
+                    payment = next(p for p in group_payments if p.booking_id == booking.id)
+                    amount = sum(p.amount for p in group_payments)
+                else:
+                    payment = open_razorpay_payment(booking)
+                    amount = booking.total_price
                 
                 return jsonify({
                     'success': True,
                     'payment_id': payment.id,
                     'transaction_id': payment.transaction_id,
-                    'razorpay_order_id': razorpay_order['id'],
+                    'razorpay_order_id': payment.razorpay_order_id,
                     'razorpay_key_id': RAZORPAY_KEY_ID,
-                    'amount': amount_in_paise,
+                    'amount': int(round(amount * 100)),
                     'currency': 'INR',
-                    'booking_reference': booking.booking_reference
+                    'booking_reference': booking.booking_reference,
+                    'group_reference': booking.group_reference
                 })
             
             elif payment_method == 'qr_code':
-                upi_string = f"upi://pay?pa={UPI_ID}&pn={MERCHANT_NAME}&am={booking.total_price}&tr={payment.transaction_id}&tn=Booking{booking.booking_reference}"
-                payment.qr_code_data = generate_qr_code(upi_string)
+                payment = Payment(
+                    booking_id=booking_id,
+                    amount=booking.total_price,
+                    payment_method=payment_method,
+                    transaction_id=f"TXN{secrets.token_hex(6).upper()}"
+                )
+                payment.qr_code_digest = QRCodeCache.digest(build_upi_payload(payment, booking))
                 db.session.add(payment)
                 db.session.commit()
                 
@@ -699,65 +3761,103 @@ def payment(booking_id):
                     'success': True,
                     'payment_id': payment.id,
                     'transaction_id': payment.transaction_id,
-                    'qr_code': payment.qr_code_data
+                    'qr_code': url_for('payment.qr_code_image', digest=payment.qr_code_digest, image_format=QR_IMAGE_FORMAT)
                 })
             
         except Exception as e:
             db.session.rollback()
-            print(f"Payment error: {e}")
+            logger.exception("Payment error")
             return jsonify({'success': False, 'message': f'Payment failed: {str(e)}'}), 500
     
     return render_template('payment.html', booking=booking, razorpay_key_id=RAZORPAY_KEY_ID)
 
-@app.route('/verify-payment', methods=['POST'])
+@payment_bp.route('/qr/<digest>.<image_format>')
+def qr_code_image(digest, image_format):
+    """Serve a payment QR code; the URL is content-addressed so it never changes"""
+    if image_format not in ('png', 'svg'):
+        abort(404)
+    
+    etag = f'{digest}-{image_format}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        image = qr_code_cache.lookup(digest, image_format)
+        if image is None:
+            payment = Payment.query.filter_by(qr_code_digest=digest).first()
+            if not payment:
+                abort(404)
+            image = qr_code_cache.get(build_upi_payload(payment, payment.booking), image_format)
+        response = Response(image, mimetype='image/svg+xml' if image_format == 'svg' else 'image/png')
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@payment_bp.route('/verify-payment', methods=['POST'])
 def verify_payment():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
     try:
         data = request.get_json()
-        payment = Payment.query.filter_by(razorpay_order_id=data['razorpay_order_id']).first()
+        # A combined group order has one payment row per booking
+        payments = Payment.query.filter_by(razorpay_order_id=data['razorpay_order_id']).order_by(Payment.id).all()
+        payment = payments[0] if payments else None
         
-        if not payment or payment.booking.user_id != session['user_id']:
+        if not payment or any(p.booking.user_id != session['user_id'] for p in payments):
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
-        razorpay_client.utility.verify_payment_signature({
+        payment_gateway.verify_payment_signature({
             'razorpay_order_id': data['razorpay_order_id'],
             'razorpay_payment_id': data['razorpay_payment_id'],
             'razorpay_signature': data['razorpay_signature']
         })
         
-        payment.razorpay_payment_id = data['razorpay_payment_id']
-        payment.razorpay_signature = data['razorpay_signature']
-        payment.payment_status = 'completed'
-        payment.payment_date = datetime.utcnow()
-        payment.booking.status = 'confirmed'
+        outcomes = [
+            complete_payment(
+                p,
+                current_user(),
+                razorpay_payment_id=data['razorpay_payment_id'],
+                razorpay_signature=data['razorpay_signature'],
+                reclaim=True  # as the webhook would, so whichever arrives first decides the same way
+            )
+            for p in payments
+        ]
         db.session.commit()
+        for p in payments:
+            occupancy_index.add(p.booking)
+            availability_calendar.invalidate_stay(p.booking)
+        if 'confirmed' in outcomes:
+            email_worker.wake()
         
-        user = User.query.get(session['user_id'])
-        if user.email:
-            send_booking_confirmation_email(user.email, {
-                'user_name': user.full_name,
-                'reference': payment.booking.booking_reference,
-                'room_type': payment.booking.room.room_type,
-                'room_number': payment.booking.room.room_number,
-                'check_in': payment.booking.check_in.strftime('%Y-%m-%d'),
-                'check_out': payment.booking.check_out.strftime('%Y-%m-%d'),
-                'guests': payment.booking.guests,
-                'total_price': payment.booking.total_price
-            })
+        refunded = [p.booking.booking_reference for p, outcome in zip(payments, outcomes) if outcome == 'refund']
+        if refunded:
+            # Cancelled, or the hold lapsed and someone else took the nights
+            payment_reconciler.wake()
+            return jsonify({
+                'success': False,
+                'message': 'Your booking is no longer held, so the payment will be refunded',
+                'refunded_bookings': refunded
+            }), 409
         
-        return jsonify({'success': True, 'message': 'Payment verified', 'booking_reference': payment.booking.booking_reference})
+        return jsonify({
+            'success': True,
+            'message': 'Payment verified',
+            'booking_reference': payment.booking.booking_reference,
+            'group_reference': payment.booking.group_reference
+        })
         
     except razorpay.errors.SignatureVerificationError:
-        payment.payment_status = 'failed'
+        for p in payments:
+            if p.payment_status not in SETTLED_PAYMENT_STATUSES:
+                p.payment_status = 'failed'
         db.session.commit()
         return jsonify({'success': False, 'message': 'Payment verification failed'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/confirm-payment/<int:payment_id>', methods=['POST'])
+@payment_bp.route('/confirm-payment/<int:payment_id>', methods=['POST'])
 def confirm_payment(payment_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
@@ -767,23 +3867,20 @@ def confirm_payment(payment_id):
         if payment.booking.user_id != session['user_id']:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
         
-        payment.payment_status = 'completed'
-        payment.payment_date = datetime.utcnow()
-        payment.booking.status = 'confirmed'
+        outcome = complete_payment(payment, current_user(), reclaim=True)
+
         db.session.commit()
-        
-        user = User.query.get(session['user_id'])
-        if user.email:
-            send_booking_confirmation_email(user.email, {
-                'user_name': user.full_name,
-                'reference': payment.booking.booking_reference,
-                'room_type': payment.booking.room.room_type,
-                'room_number': payment.booking.room.room_number,
-                'check_in': payment.booking.check_in.strftime('%Y-%m-%d'),
-                'check_out': payment.booking.check_out.strftime('%Y-%m-%d'),
-                'guests': payment.booking.guests,
-                'total_price': payment.booking.total_price
-            })
+        if outcome == 'refund':
+            # QR payments are refunded by hand; the payment stays flagged for review
+            return jsonify({
+                'success': False,
+                'message': 'Your booking is no longer held, so the payment will be refunded',
+                'refunded_bookings': [payment.booking.booking_reference]
+            }), 409
+        occupancy_index.add(payment.booking)
+        availability_calendar.invalidate_stay(payment.booking)
+        if outcome == 'confirmed':
+            email_worker.wake()
         
         return jsonify({'success': True, 'message': 'Payment confirmed'})
     except Exception as e:
@@ -791,23 +3888,59 @@ def confirm_payment(payment_id):
         return jsonify({'success': False, 'message': str(e)}), 500
         
 
-@app.route('/my-bookings')
+@payment_bp.route('/webhooks/razorpay', methods=['POST'])
+def razorpay_webhook():
+    """Verify and store a Razorpay webhook; processing happens in the background"""
+    if not RAZORPAY_WEBHOOK_SECRET:
+        return jsonify({'success': False, 'message': 'Webhooks not configured'}), 503
+    
+    body = request.get_data(as_text=True)
+    try:
+        payment_gateway.verify_webhook_signature(
+            body, request.headers.get('X-Razorpay-Signature', ''), RAZORPAY_WEBHOOK_SECRET
+        )
+        event_payload = json.loads(body)
+    except (razorpay.errors.SignatureVerificationError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid signature'}), 400
+    
+    event_id = request.headers.get('X-Razorpay-Event-Id') or hashlib.sha256(body.encode('utf-8')).hexdigest()
+    db.session.add(WebhookEvent(
+        event_id=event_id,
+        event_type=event_payload.get('event', 'unknown')[:50],
+        payload=body
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Redelivery of an event already in the inbox
+        db.session.rollback()
+        return jsonify({'success': True, 'duplicate': True})
+    
+    payment_reconciler.wake()
+    return jsonify({'success': True})
+
+@booking_bp.route('/my-bookings')
 def my_bookings():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    return render_template('my_bookings.html', bookings=Booking.query.filter_by(user_id=session['user_id']).order_by(Booking.created_at.desc()).all())
+        return redirect(url_for('auth.login'))
+    return render_template('my_bookings.html', bookings=user_booking_rows(session['user_id']))
 
-@app.route('/booking-details/<int:booking_id>')
+@booking_bp.route('/booking-details/<int:booking_id>')
 def booking_details(booking_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    booking = Booking.query.get_or_404(booking_id)
+        return redirect(url_for('auth.login'))
+    booking = Booking.query.options(
+        joinedload(Booking.user),
+        joinedload(Booking.room),
+        selectinload(Booking.payments)
+
+    ).filter_by(id=booking_id).first_or_404()
     if booking.user_id != session['user_id']:
         flash('Unauthorized access', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('booking.index'))
     return render_template('booking_details.html', booking=booking)
 
-@app.route('/cancel-booking/<int:booking_id>', methods=['POST'])
+@booking_bp.route('/cancel-booking/<int:booking_id>', methods=['POST'])
 def cancel_booking(booking_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
@@ -816,18 +3949,20 @@ def cancel_booking(booking_id):
         booking = Booking.query.get_or_404(booking_id)
         if booking.user_id != session['user_id']:
             return jsonify({'success': False, 'message': 'Unauthorized'}), 401
-        if booking.status in ['cancelled', 'completed']:
+        if not mark_booking_cancelled(booking):
+            db.session.rollback()
             return jsonify({'success': False, 'message': 'Cannot cancel'}), 400
-        
-        booking.status = 'cancelled'
         db.session.commit()
+
+        occupancy_index.discard(booking.id)
+        availability_calendar.invalidate_stay(booking)
         return jsonify({'success': True, 'message': 'Booking cancelled'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # Admin routes - completely separate
-@app.route('/admin/login', methods=['GET', 'POST'])
+@admin_bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
         data = request.json
@@ -838,44 +3973,196 @@ def admin_login():
         return jsonify({'success': False, 'message': 'Invalid credentials'})
     return render_template('admin-login.html')
 
-@app.route('/admin/dashboard')
+@admin_bp.route('/admin/dashboard')
 def admin_dashboard():
     if not session.get('admin_authenticated'):
         return redirect('/admin/login')
 
-    # Fetch all bookings and join with User and Room for complete details
-    all_bookings = Booking.query.join(User).join(Room).order_by(Booking.id.desc()).all()
+    # The bookings table is filled page by page from /admin/api/bookings
+    status_counts = dict(db.session.query(Booking.status, func.count(Booking.id)).group_by(Booking.status).all())
     
-    # Calculate revenue for the dashboard cards
-    total_rev = db.session.query(func.sum(Payment.amount)).filter(
-        Payment.payment_status == 'completed'
-    ).scalar() or 0
+    # Revenue and occupancy cards come from the daily_stats aggregates
+    total_rev = db.session.query(func.sum(DailyStat.revenue)).scalar() or 0
+    today = date.today()
+    last_30_days = daily_stats_summary(today - timedelta(days=29), today + timedelta(days=1))
+
+    room_types = [row.room_type for row in db.session.query(Room.room_type).distinct().order_by(Room.room_type)]
 
     return render_template('admin_dashboard.html', 
-                           bookings=all_bookings, 
-                           total_revenue=total_rev)
+                           room_types=room_types,
+                           booking_statuses=BOOKING_STATUSES,
+                           page_size=ADMIN_BOOKINGS_PAGE_SIZE,
+                           total_bookings=sum(status_counts.values()),
+                           pending_bookings=status_counts.get('pending', 0),
+                           confirmed_bookings=status_counts.get('confirmed', 0),
+                           total_revenue=total_rev,
+                           last_30_days=last_30_days)
+
+@admin_bp.route('/admin/api/bookings')
+def admin_bookings_api():
+    """Keyset-paginated bookings; pass next_cursor back as ?before_id= for the next page"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        filters = parse_admin_booking_filters(request.args)
+        before_id = request.args.get('before_id', type=int)
+        limit = request.args.get('limit', ADMIN_BOOKINGS_PAGE_SIZE, type=int)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid filter'}), 400
+    if limit < 1:
+        return jsonify({'success': False, 'message': 'limit must be a positive integer'}), 400
+    limit = min(limit, ADMIN_BOOKINGS_MAX_PAGE_SIZE)
+    
+    rows = admin_booking_rows(filters, before_id=before_id, limit=limit)
+    return jsonify({
+        'success': True,
+        'bookings': [admin_booking_dict(row) for row in rows],
+        'next_cursor': rows[-1].id if len(rows) == limit else None
+    })
+
+@admin_bp.route('/admin/api/bookings.csv')
+def admin_bookings_export():
+    """Stream every booking matching the filters as CSV, one keyset chunk at a time"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        filters = parse_admin_booking_filters(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid filter'}), 400
+    
+    def generate():
+        buffer = StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=ADMIN_BOOKING_CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        before_id = None
+        while True:
+            rows = admin_booking_rows(filters, before_id=before_id, limit=ADMIN_BOOKINGS_EXPORT_CHUNK)
+            for row in rows:
+                writer.writerow(admin_booking_dict(row))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            if len(rows) < ADMIN_BOOKINGS_EXPORT_CHUNK:
+                break
+            before_id = rows[-1].id
+    
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=bookings-{date.today().isoformat()}.csv'
+    return response
+
+@admin_bp.route('/admin/occupancy-index', methods=['GET', 'POST'])
+def admin_occupancy_index():
+    """Report on (GET) or rebuild (POST) this worker's occupancy index"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    if request.method == 'POST':
+        occupancy_index.rebuild()
+    return jsonify({'success': True, **occupancy_index.check_consistency()})
+
+@admin_bp.route('/admin/email-outbox')
+def admin_email_outbox():
+    """Outbox depth by status plus this worker's delivery metrics"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    counts = dict(db.session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all())
+    return jsonify({'success': True, 'outbox': counts, 'worker': dict(email_worker.metrics)})
+
+@admin_bp.route('/admin/sweeper', methods=['GET', 'POST'])
+def admin_sweeper():
+    """Expiry sweeper metrics (GET) or run a sweep now (POST)"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    if request.method == 'POST':
+        expiry_sweeper.run()
+    return jsonify({'success': True, 'last_run': expiry_sweeper.last_run, 'totals': dict(expiry_sweeper.totals)})
+
+@admin_bp.route('/admin/payment-reconciler', methods=['GET', 'POST'])
+def admin_payment_reconciler():
+    """Webhook inbox depth and reconciler metrics (GET) or reconcile stale payments now (POST)"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    reconciled = None
+    if request.method == 'POST':
+        reconciled = payment_reconciler.reconcile_stale_payments()
+    counts = dict(db.session.query(WebhookEvent.status, func.count(WebhookEvent.id)).group_by(WebhookEvent.status).all())
+    return jsonify({'success': True, 'inbox': counts, 'reconciled': reconciled, 'metrics': dict(payment_reconciler.metrics)})
+
+@admin_bp.route('/admin/rates', methods=['GET', 'POST'])
+def admin_rates():
+    """List (GET) or add (POST) rate rules"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    if request.method == 'POST':
+        try:
+            data = request.get_json()
+            weekdays = data.get('weekdays')
+            rule = RoomRate(
+                name=data['name'],
+                room_type=data.get('room_type'),
+                start_date=datetime.strptime(data['start_date'], '%Y-%m-%d').date() if data.get('start_date') else None,
+                end_date=datetime.strptime(data['end_date'], '%Y-%m-%d').date() if data.get('end_date') else None,
+                weekdays=','.join(str(int(day) % 7) for day in weekdays) if weekdays else None,
+                multiplier=float(data['multiplier'])
+            )
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Invalid rate rule'}), 400
+        if rule.multiplier <= 0:
+            return jsonify({'success': False, 'message': 'Multiplier must be positive'}), 400
+        db.session.add(rule)
+        db.session.commit()
+    
+    rules = RoomRate.query.order_by(RoomRate.id).all()
+    return jsonify({'success': True, 'rates': [
+        {
+            'id': rule.id,
+            'name': rule.name,
+            'room_type': rule.room_type,
+            'start_date': rule.start_date.strftime('%Y-%m-%d') if rule.start_date else None,
+            'end_date': rule.end_date.strftime('%Y-%m-%d') if rule.end_date else None,
+            'weekdays': [int(day) for day in rule.weekdays.split(',')] if rule.weekdays else None,
+            'multiplier': rule.multiplier
+        }
+        for rule in rules
+    ]})
+
+@admin_bp.route('/admin/rates/<int:rate_id>', methods=['DELETE'])
+def admin_delete_rate(rate_id):
+    if not session.get('admin_authenticated'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    rule = RoomRate.query.get_or_404(rate_id)
+    db.session.delete(rule)
+    db.session.commit()
+    return jsonify({'success': True})
 
-@app.route('/admin/logout')
+@admin_bp.route('/admin/logout')
 def admin_logout():
     session.pop('admin_authenticated', None)
     return redirect('/admin/login')
-@app.errorhandler(404)
 def not_found(error):
     return render_template('index.html'), 404
 
-@app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('index.html'), 500
 
 # ==================== INITIALIZE DATABASE ====================
 
-def init_db():
+def init_db(app):
     with app.app_context():
         # COMMENT OUT OR DELETE THIS LINE TO PREVENT DATA LOSS IN THE FUTURE:
         # db.drop_all() 
             
-        # This will create the tables if they are missing
+        # Migrations build or upgrade the schema; create_all() only fills in
+        # tables when alembic is not installed
+        migrate_database()
         db.create_all()
         
         # Check if rooms exist so we don't duplicate them
@@ -887,9 +4174,182 @@ def init_db():
             for room_data in rooms_data:
                 db.session.add(Room(**room_data))
             db.session.commit()
-            print("✅ Database initialized and sample rooms added.")
+            logger.info("Database initialized and sample rooms added")
+        
+        claimed, conflicts = backfill_room_nights()
+        if claimed or conflicts:
+            logger.info("Room nights backfilled", extra={'bookings': claimed, 'conflicts': conflicts})
+        if DailyStat.query.first() is None and Booking.query.filter_by(status='confirmed').first():
+            logger.info("Daily stats backfilled", extra={'rows': backfill_daily_stats()})
+        occupancy_index.rebuild()
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alembic.ini')
+
+def migrate_database():
+    """Apply pending Alembic migrations to the current app's database.
+    
+    An empty database is built from the baseline revision up. A database
+    created by db.create_all() before migrations existed is stamped at the
+    baseline revision first, and the guarded migrations after it only add
+    what is missing.
+    """
+    if alembic_command is None:
+        logger.warning("alembic is not installed, skipping schema migrations")
+        return
+    config = AlembicConfig(ALEMBIC_INI)
+    with db.engine.begin() as connection:
+        config.attributes['connection'] = connection
+        inspector = sa_inspect(connection)
+        if not inspector.has_table('alembic_version') and inspector.has_table('users'):
+            alembic_command.stamp(config, '0001')
+        alembic_command.upgrade(config, 'head')
+
+@admin_bp.cli.command('migrate-db')
+def migrate_db_command():
+    """Apply schema migrations, creating the tables on an empty database"""
+    migrate_database()
+    db.create_all()
+    print("Database schema is up to date")
+
+@admin_bp.cli.command('build-static')
+@click.argument('output_dir', default='static-dist')
+def build_static_command(output_dir):
+    """Write content-hashed, precompressed static assets for serving from a proxy or CDN"""
+    print(f"Wrote {static_assets.write(output_dir)} assets to {output_dir}")
+
+@admin_bp.cli.command('backfill-room-nights')
+def backfill_room_nights_command():
+    """Populate room_nights for active bookings created before the table existed"""
+    db.create_all()
+    claimed, conflicts = backfill_room_nights()
+    print(f"Claimed nights for {claimed} bookings, {conflicts} conflicts")
+
+@admin_bp.cli.command('backfill-daily-stats')
+def backfill_daily_stats_command():
+    """Recompute daily_stats from every confirmed booking"""
+    db.create_all()
+    print(f"Wrote {backfill_daily_stats()} daily stat rows")
+
+@admin_bp.cli.command('sweep-expired')
+def sweep_expired_command():
+    """Expire stale pending bookings and prune old OTP records once"""
+    print(expiry_sweeper.run())
+
+@admin_bp.cli.command('reconcile-payments')
+def reconcile_payments_command():
+    """Apply pending webhooks, then reconcile stale Razorpay payments"""
+    while payment_reconciler.process_webhook_batch():
+        pass
+    print(f"Completed {payment_reconciler.reconcile_stale_payments()} stale payments: {payment_reconciler.metrics}")
+
+@admin_bp.cli.command('explain-availability')
+def explain_availability_command():
+    """Log the query plans of the availability checks"""
+    explained_statements.clear()
+    room = Room.query.first()
+    check_in = date.today() + timedelta(days=1)
+    if room:
+        check_room_availability(room.id, check_in, check_in + timedelta(days=2))
+    find_available_room_ids(check_in, check_in + timedelta(days=2))
+
+@admin_bp.cli.command('send-queued-emails')
+def send_queued_emails_command():
+    """Deliver every due message in the email outbox and exit"""
+    sent = 0
+    while True:
+        batch = email_worker.deliver_batch()
+        if not batch:
+            break
+        sent += batch
+    print(f"Processed {sent} queued emails: {email_worker.metrics}")
+
+# ==================== APPLICATION FACTORY ====================
+
+created_apps = weakref.WeakSet()
+
+def create_app(config=None):
+    """Build and configure the Flask application.
+    
+    Only configuration, extensions, blueprints and hooks are set up here;
+    database sessions, gateway clients and background threads are created
+    on first use in each worker, which keeps `gunicorn --preload` cheap.
+    """
+    app = Flask(__name__)
+    app.config.update(
+        SESSION_COOKIE_HTTPONLY=True,
+        SESSION_COOKIE_SAMESITE='Lax',
+        SQLALCHEMY_DATABASE_URI=SQLALCHEMY_DATABASE_URI,
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SQLALCHEMY_POOL_SIZE=10,
+        SQLALCHEMY_POOL_RECYCLE=3600,
+        MAIL_SERVER=MAIL_SERVER,
+        MAIL_PORT=MAIL_PORT,
+        MAIL_USE_TLS=MAIL_USE_TLS,
+        MAIL_USERNAME=MAIL_USERNAME,
+        MAIL_PASSWORD=MAIL_PASSWORD,
+        MAIL_SUPPRESS_SEND=MAIL_SUPPRESS_SEND
+    )
+    if config:
+        app.config.update(config)
+    if not app.config.get('SECRET_KEY'):
+        app.secret_key = load_secret_key(app)
+    
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        # Reservations take the SQLite write lock; wait for it instead of failing fast
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {'connect_args': {'timeout': 30}})
+        logger.info("Using SQLite database", extra={'database': 'sqlite'})
+    else:
+        logger.info("Using MySQL database", extra={'database': 'mysql'})
+    
+    db.init_app(app)
+    mail.init_app(app)
+    
+    app.add_template_filter(fromjson_filter, 'fromjson')
+    app.before_request(start_request_metrics)
+    app.before_request(start_background_workers)
+    app.after_request(record_request_metrics)
+    app.after_request(apply_cache_policy)  # after_request hooks run last-registered first
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    if app.has_static_folder and os.path.isdir(app.static_folder):
+        static_assets.build(app.static_folder)
+        app.url_defaults(static_assets.url_defaults)
+        app.view_functions['static'] = serve_static_asset
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(500, internal_error)
+    
+    for blueprint in (auth_bp, booking_bp, payment_bp, admin_bp):
+        app.register_blueprint(blueprint)
+    
+    created_apps.add(app)
+    return app
+
+def warm_up(app):
+    """Do one-off work in a preloading master so forked workers share it"""
+    configure_mappers()
+    with app.app_context():
+        for name in app.jinja_env.list_templates():
+            if name.endswith('.html'):
+                app.jinja_env.get_template(name)
+
+def reset_after_fork():
+    """Drop database connections inherited from a preloading master"""
+    for app in list(created_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+def __getattr__(name):
+    """`test_razorpay.app` is built on first access, e.g. by `gunicorn test_razorpay:app`"""
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    init_db()
+    app = create_app()
+    init_db(app)
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Shared fixtures: one app on a scratch database, emptied before every test
+
+The app runs with the local OTP provider, the stub payment gateway and
+mail suppressed, so the suite needs no network access. Set
+TEST_DATABASE_URL to run it against MySQL instead of a temporary SQLite
+file.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_DIR = tempfile.mkdtemp(prefix='hotel-tests-')
+OTP_CODE = '123456'
+
+os.environ.update({
+    'DATABASE_URL': os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(SCRATCH_DIR, 'hotel.db')}",
+    'OTP_PROVIDER': 'local',
+    'OTP_LOCAL_CODE': OTP_CODE,
+    'OTP_ASYNC_SEND': 'false',
+    'PAYMENT_GATEWAY': 'stub',
+    'RAZORPAY_PRECREATE_ORDERS': 'false',
+    'RAZORPAY_WEBHOOK_SECRET': 'test-webhook-secret',
+    'MAIL_SUPPRESS_SEND': 'true',
+    'SWEEPER_IN_PROCESS': 'false',
+    'LOG_LEVEL': 'WARNING',
+    'SLOW_QUERY_MS': '60000',
+    'EXPLAIN_QUERY_TAGS': '',
+})
+sys.path.insert(0, ROOT)
+
+import test_razorpay as hotel  # noqa: E402  (reads the environment above at import)
+
+@pytest.fixture(scope='session')
+def app():
+    app = hotel.create_app({'TESTING': True, 'SECRET_KEY': 'test-secret-key'})
+    app.template_folder = ROOT
+    # Tests drive the workers by hand; mark them as started in this process
+    for worker in (hotel.email_worker, hotel.payment_reconciler, hotel.occupancy_index):
+        worker._pid = os.getpid()
+    return app
+
+@pytest.fixture(autouse=True)
+def database(app):
+    """Empty schema and cold caches for every test"""
+    with app.app_context():
+        hotel.db.drop_all()
+        hotel.db.create_all()
+        hotel.room_catalog.invalidate()
+        hotel.availability_calendar.invalidate()
+        hotel.pricing_engine.invalidate()
+        hotel.page_cache.clear()
+        hotel.occupancy_index.rebuild()
+    hotel.rate_limit_backend._pid = None
+    yield hotel.db
+    with app.app_context():
+        hotel.db.session.remove()
+
+@pytest.fixture
+def make_room(app):
+    def make_room(room_number='101', room_type='Deluxe', price_per_night=3500, capacity=2):
+        with app.app_context():
+            room = hotel.Room(
+                room_number=room_number,
+                room_type=room_type,
+                price_per_night=price_per_night,
+                capacity=capacity,
+                description=f'{room_type} room',
+                amenities='["WiFi", "AC"]',
+                image_url=f'/static/images/{room_type.lower()}-room.svg'
+            )
+            hotel.db.session.add(room)
+            hotel.db.session.commit()
+            hotel.room_catalog.invalidate()
+            return room.id
+    return make_room
+
+@pytest.fixture
+def make_user(app):
+    def make_user(index=0):
+        with app.app_context():
+            user = hotel.User(
+                phone=f'+9198{index:08d}',
+                full_name=f'Test User {index}',
+                email=f'user{index}@example.com',
+                is_verified=True
+            )
+            hotel.db.session.add(user)
+            hotel.db.session.commit()
+            return user.id
+    return make_user
+
+@pytest.fixture
+def login(app):
+    """Return a test client whose session belongs to user_id"""
+    def login(user_id):
+        client = app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['user_id'] = user_id
+        return client
+    return login
+
+@pytest.fixture
+def admin(app):
+    """A test client signed in to the admin pages"""
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['admin_authenticated'] = True
+    return client
@@ -0,0 +1,57 @@
+"""
+Test helpers for inspecting the SQL the app runs
+"""
+from contextlib import contextmanager
+
+from conftest import hotel
+
+def plan_uses_index(plan):
+    """False if an EXPLAIN plan (SQLite or MySQL) reads a whole table"""
+    if not isinstance(plan, list):
+        return False
+    for row in plan:
+        if 'detail' in row:
+            detail = row['detail']
+            if detail.startswith('SCAN ') and 'INDEX' not in detail and 'CONSTANT ROW' not in detail:
+                return False
+        elif row.get('type') == 'ALL':
+            return False
+    return True
+
+class QueryCounter:
+    """Count SQL statements issued while active:
+
+        with QueryCounter() as queries:
+            client.get('/my-bookings')
+        assert queries.count <= 2
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+        self.executions = []
+        self._engine = None
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+        self.executions.append((statement, parameters))
+
+    def __enter__(self):
+        self._engine = hotel.db.engine
+        hotel.db.event.listen(self._engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        hotel.db.event.remove(self._engine, 'before_cursor_execute', self._record)
+        return False
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fail if the block issues more than `limit` SQL statements"""
+    with QueryCounter() as queries:
+        yield queries
+    if queries.count > limit:
+        raise AssertionError(
+            f"Expected at most {limit} queries, got {queries.count}:\n" + '\n'.join(queries.statements)
+        )
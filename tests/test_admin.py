@@ -0,0 +1,60 @@
+"""
+Admin dashboard and bookings API
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+
+@pytest.fixture
+def bookings(app, make_room, make_user):
+    """One booking in each status, oldest first"""
+    room_id, user_id = make_room(), make_user()
+    with app.app_context():
+        for index, status in enumerate(hotel.BOOKING_STATUSES):
+            check_in = date.today() + timedelta(days=10 + 3 * index)
+            hotel.db.session.add(hotel.Booking(
+                user_id=user_id,
+                room_id=room_id,
+                check_in=check_in,
+                check_out=check_in + timedelta(days=2),
+                guests=1,
+                total_price=7000,
+                status=status,
+                booking_reference=f'HB{index:06d}'
+            ))
+        hotel.db.session.commit()
+
+def test_dashboard_filters_on_real_booking_statuses(admin, bookings):
+    page = admin.get('/admin/dashboard').get_data(as_text=True)
+
+    for status in hotel.BOOKING_STATUSES:
+        assert f'<option value="{status}">' in page
+    assert 'value="completed"' not in page
+
+def test_api_filters_by_expired_status(admin, bookings):
+    response = admin.get('/admin/api/bookings?status=expired')
+
+    assert response.status_code == 200
+    assert [booking['status'] for booking in response.get_json()['bookings']] == ['expired']
+
+def test_api_rejects_unknown_status(admin, bookings):
+    assert admin.get('/admin/api/bookings?status=completed').status_code == 400
+
+@pytest.mark.parametrize('limit', [0, -5])
+def test_api_rejects_non_positive_limit(admin, bookings, limit):
+    response = admin.get(f'/admin/api/bookings?limit={limit}')
+
+    assert response.status_code == 400
+    assert not response.get_json()['success']
+
+def test_api_pages_with_a_clamped_limit(admin, bookings, monkeypatch):
+    monkeypatch.setattr(hotel, 'ADMIN_BOOKINGS_MAX_PAGE_SIZE', 3)
+
+    first = admin.get('/admin/api/bookings?limit=1000').get_json()
+    second = admin.get(f"/admin/api/bookings?limit=1000&before_id={first['next_cursor']}").get_json()
+
+    assert len(first['bookings']) == 3
+    assert [booking['booking_reference'] for booking in second['bookings']] == ['HB000000']
+    assert second['next_cursor'] is None
@@ -0,0 +1,91 @@
+"""
+Month availability calendar: per-night free counts, validation and invalidation
+"""
+import calendar
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+
+NEXT_MONTH = hotel.month_bounds(date.today().replace(day=1))[1]
+CHECK_IN = NEXT_MONTH + timedelta(days=9)
+CHECK_OUT = CHECK_IN + timedelta(days=2)
+MONTH = NEXT_MONTH.isoformat()[:7]
+
+@pytest.fixture
+def rooms(make_room):
+    """Two Deluxe rooms and one Suite"""
+    return [make_room('101'), make_room('102'), make_room('201', room_type='Suite', price_per_night=6000)]
+
+def free_by_night(client, **params):
+    response = client.get('/availability/calendar', query_string=dict(month=MONTH, **params))
+    assert response.status_code == 200
+    return {day['date']: day['free'] for day in response.get_json()['days']}
+
+def stay_nights_free(client, **params):
+    free = free_by_night(client, **params)
+    return [free[night.isoformat()] for night in hotel.stay_nights(CHECK_IN, CHECK_OUT)]
+
+def test_grid_counts_free_rooms_per_night(app, rooms, make_user):
+    with app.app_context():
+        assert hotel.reserve_room(rooms[0], make_user(), CHECK_IN, CHECK_OUT, guests=1)['success']
+    client = app.test_client()
+
+    body = client.get('/availability/calendar', query_string={'month': MONTH}).get_json()
+
+    assert body['month'] == MONTH
+    assert body['total_rooms'] == 3
+    assert len(body['days']) == calendar.monthrange(NEXT_MONTH.year, NEXT_MONTH.month)[1]
+    assert body['days'][0]['date'] == NEXT_MONTH.isoformat()
+    free = {day['date']: day['free'] for day in body['days']}
+    assert [free[night.isoformat()] for night in hotel.stay_nights(CHECK_IN, CHECK_OUT)] == [2, 2]
+    assert free[CHECK_OUT.isoformat()] == 3
+    assert stay_nights_free(client, room_type='Deluxe') == [1, 1]
+    assert stay_nights_free(client, room_type='Suite') == [1, 1]
+
+@pytest.mark.parametrize('month', ['9999-12', '0001-01', '2026-13', 'next', ''])
+def test_months_outside_the_range_or_malformed_are_rejected(app, month):
+    response = app.test_client().get('/availability/calendar', query_string={'month': month} if month else {})
+
+    assert response.status_code == (200 if month == '' else 400)
+
+def test_range_edges_are_accepted(app):
+    client = app.test_client()
+    this_month = date.today().replace(day=1)
+    ahead = this_month
+    for _ in range(hotel.AVAILABILITY_CALENDAR_MONTHS_AHEAD):
+        ahead = hotel.month_bounds(ahead)[1]
+
+    assert client.get('/availability/calendar', query_string={'month': ahead.isoformat()[:7]}).status_code == 200
+    beyond = hotel.month_bounds(ahead)[1]
+    assert client.get('/availability/calendar', query_string={'month': beyond.isoformat()[:7]}).status_code == 400
+
+def test_booking_and_cancelling_refresh_the_cached_grid(app, rooms, make_user, login):
+    client = login(make_user())
+    assert stay_nights_free(client) == [3, 3]
+    assert stay_nights_free(client, room_type='Deluxe') == [2, 2]
+
+    response = client.post('/book', json={
+        'room_id': rooms[0], 'check_in': CHECK_IN.isoformat(), 'check_out': CHECK_OUT.isoformat(), 'guests': 1
+    })
+    assert response.status_code == 200
+    assert stay_nights_free(client) == [2, 2]
+    assert stay_nights_free(client, room_type='Deluxe') == [1, 1]
+
+    assert client.post(f"/cancel-booking/{response.get_json()['booking_id']}").status_code == 200
+    assert stay_nights_free(client) == [3, 3]
+    assert stay_nights_free(client, room_type='Deluxe') == [2, 2]
+
+def test_expiry_refreshes_the_cached_grid(app, rooms, make_user):
+    with app.app_context():
+        booking = hotel.reserve_room(rooms[2], make_user(), CHECK_IN, CHECK_OUT, guests=1)['booking']
+        booking.created_at -= timedelta(minutes=hotel.BOOKING_HOLD_MINUTES + 1)
+        hotel.db.session.commit()
+    client = app.test_client()
+    assert stay_nights_free(client, room_type='Suite') == [0, 0]
+
+    with app.app_context():
+        assert hotel.expiry_sweeper.run()['bookings_expired'] == 1
+
+    assert stay_nights_free(client, room_type='Suite') == [1, 1]
@@ -0,0 +1,86 @@
+"""
+Concurrent /book requests for the same room and dates: exactly one wins
+
+The worker-local occupancy index is bypassed so every request reaches
+reserve_room() and the room_nights unique key has to settle the race.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+
+CONCURRENT_REQUESTS = 200
+
+@pytest.fixture(autouse=True)
+def bypass_occupancy_index(monkeypatch):
+    monkeypatch.setattr(hotel.occupancy_index, 'is_free', lambda room_id, check_in, check_out: True)
+
+def post_concurrently(clients, payloads):
+    """POST /book from every client at once; returns the status codes"""
+    barrier = threading.Barrier(len(clients))
+
+    def post(index):
+        barrier.wait()
+        return clients[index].post('/book', json=payloads[index]).status_code
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        return list(executor.map(post, range(len(clients))))
+
+def stay_payload(room_id, check_in, nights):
+    return {
+        'room_id': room_id,
+        'check_in': check_in.isoformat(),
+        'check_out': (check_in + timedelta(days=nights)).isoformat(),
+        'guests': 1,
+    }
+
+def test_only_one_concurrent_booking_wins(app, make_room, make_user, login):
+    room_id = make_room()
+    clients = [login(make_user(index)) for index in range(CONCURRENT_REQUESTS)]
+    check_in = date.today() + timedelta(days=10)
+
+    statuses = post_concurrently(clients, [stay_payload(room_id, check_in, 3)] * CONCURRENT_REQUESTS)
+
+    assert statuses.count(200) == 1
+    assert statuses.count(400) == CONCURRENT_REQUESTS - 1
+    with app.app_context():
+        bookings = hotel.Booking.query.filter_by(room_id=room_id).all()
+        assert len(bookings) == 1
+        nights = sorted(night for (night,) in hotel.db.session.query(hotel.RoomNight.night)
+                        .filter_by(room_id=room_id).all())
+        assert nights == [check_in + timedelta(days=offset) for offset in range(3)]
+        assert all(room_night.booking_id == bookings[0].id
+                   for room_night in hotel.RoomNight.query.filter_by(room_id=room_id))
+
+def test_overlapping_stays_conflict_on_a_shared_night(app, make_room, make_user, login):
+    room_id = make_room()
+    clients = [login(make_user(index)) for index in range(CONCURRENT_REQUESTS)]
+    first_night = date.today() + timedelta(days=20)
+    # Every stay covers first_night + 3, whatever its length and start
+    payloads = [
+        stay_payload(room_id, first_night + timedelta(days=index % 4), 4 - index % 4 + index % 3)
+        for index in range(CONCURRENT_REQUESTS)
+    ]
+
+    statuses = post_concurrently(clients, payloads)
+
+    assert statuses.count(200) == 1
+    with app.app_context():
+        assert hotel.Booking.query.filter_by(room_id=room_id).count() == 1
+
+def test_different_rooms_book_independently(app, make_room, make_user, login):
+    room_ids = [make_room(str(101 + index)) for index in range(4)]
+    clients = [login(make_user(index)) for index in range(CONCURRENT_REQUESTS)]
+    check_in = date.today() + timedelta(days=30)
+
+    statuses = post_concurrently(clients, [
+        stay_payload(room_ids[index % len(room_ids)], check_in, 2) for index in range(CONCURRENT_REQUESTS)
+    ])
+
+    assert statuses.count(200) == len(room_ids)
+    with app.app_context():
+        booked = sorted(room_id for (room_id,) in hotel.db.session.query(hotel.Booking.room_id).all())
+        assert booked == room_ids
@@ -0,0 +1,104 @@
+"""
+Bulk availability: many date ranges resolved from one room nights query
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+from helpers import QueryCounter
+
+START = date.today() + timedelta(days=10)
+
+def day(offset):
+    return (START + timedelta(days=offset)).isoformat()
+
+def span(start, end):
+    return {'check_in': day(start), 'check_out': day(end)}
+
+@pytest.fixture
+def rooms(app, make_room, make_user):
+    """101 held for nights 1-2, 201 for nights 2-4, 102 free"""
+    room_ids = {'101': make_room('101'), '102': make_room('102'), '201': make_room('201', room_type='Suite', price_per_night=6000)}
+    user_id = make_user()
+    with app.app_context():
+        for number, (start, end) in {'101': (1, 3), '201': (2, 5)}.items():
+            check_in, check_out = START + timedelta(days=start), START + timedelta(days=end)
+            assert hotel.reserve_room(room_ids[number], user_id, check_in, check_out, guests=1)['success']
+    return room_ids
+
+def bulk(client, ranges, **fields):
+    return client.post('/check-availability/bulk', json=dict(ranges=ranges, **fields))
+
+OVERLAPPING = [span(0, 1), span(0, 2), span(1, 2), span(2, 3), span(2, 5), span(3, 6), span(5, 7), span(0, 7)]
+
+def test_each_range_matches_the_single_range_anti_join(app, rooms):
+    client = app.test_client()
+
+    results = bulk(client, OVERLAPPING).get_json()['results']
+
+    assert [(result['check_in'], result['check_out']) for result in results] == [(r['check_in'], r['check_out']) for r in OVERLAPPING]
+    with app.app_context():
+        for result in results:
+            check_in, check_out = date.fromisoformat(result['check_in']), date.fromisoformat(result['check_out'])
+            assert result['room_ids'] == hotel.find_available_room_ids(check_in, check_out)
+            assert result['available_count'] == len(result['room_ids'])
+    by_range = {(r['check_in'], r['check_out']): r['room_ids'] for r in results}
+    assert by_range[(day(0), day(1))] == [rooms['101'], rooms['102'], rooms['201']]
+    assert by_range[(day(2), day(3))] == [rooms['102']]
+    assert by_range[(day(3), day(6))] == [rooms['101'], rooms['102']]
+    assert by_range[(day(5), day(7))] == [rooms['101'], rooms['102'], rooms['201']]
+
+def test_prices_match_the_single_range_quote(app, rooms):
+    client = app.test_client()
+
+    results = bulk(client, OVERLAPPING).get_json()['results']
+
+    for result in results:
+        single = client.post('/check-availability', json={'check_in': result['check_in'], 'check_out': result['check_out']}).get_json()
+        assert [room['id'] for room in single['rooms']] == result['room_ids']
+        assert single['prices'] == result['prices']
+
+def test_room_type_filter(app, rooms):
+    results = bulk(app.test_client(), [span(0, 1), span(2, 3)], room_type='Suite').get_json()['results']
+
+    assert [result['room_ids'] for result in results] == [[rooms['201']], []]
+
+def test_query_count_does_not_grow_with_the_number_of_ranges(app, rooms):
+    client = app.test_client()
+    ranges = [span(start, start + nights) for start in range(20) for nights in (1, 3)]
+    assert bulk(client, ranges[:1]).status_code == 200  # warm the catalog and rate tables
+
+    with app.app_context(), QueryCounter() as one:
+        bulk(client, ranges[:1])
+    with app.app_context(), QueryCounter() as many:
+        response = bulk(client, ranges)
+
+    assert response.status_code == 200
+    assert len(response.get_json()['results']) == len(ranges)
+    assert many.count == one.count == 1
+
+@pytest.mark.parametrize('ranges', [
+    [],
+    'soon',
+    [span(2, 2)],
+    [span(3, 1)],
+    [span(0, 1), {'check_in': day(0)}],
+    [{'check_in': 'tomorrow', 'check_out': day(1)}],
+    [span(0, 1), None],
+])
+def test_bad_ranges_are_rejected(app, rooms, ranges):
+    response = bulk(app.test_client(), ranges)
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+def test_range_count_is_capped(app, rooms):
+    client = app.test_client()
+    limit = hotel.MAX_BULK_AVAILABILITY_RANGES
+
+    assert bulk(client, [span(0, 1)] * limit).status_code == 200
+    response = bulk(client, [span(0, 1)] * (limit + 1))
+
+    assert response.status_code == 400
+    assert str(limit) in response.get_json()['message']
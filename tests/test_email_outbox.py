@@ -0,0 +1,102 @@
+"""
+Email outbox delivery against a real SMTP server (aiosmtpd sink)
+"""
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from conftest import ROOT, hotel
+
+SENDER = 'bookings@hotel.example'
+
+class SinkHandler:
+    """Keep every message and the SMTP session it arrived on"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((id(session), envelope.rcpt_tos, envelope.content.decode('utf8', 'replace')))
+        return '250 OK'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def smtp_sink():
+    handler = SinkHandler()
+    handler.port = free_port()
+    controller = Controller(handler, hostname='127.0.0.1', port=handler.port)
+    controller.start()
+    yield handler
+    controller.stop()
+
+def mail_app(port):
+    """An app on the test database whose mail settings point at 127.0.0.1:port"""
+    app = hotel.create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test-secret-key',
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': port,
+        'MAIL_USE_TLS': False,
+        'MAIL_USE_SSL': False,
+        'MAIL_USERNAME': SENDER,
+        'MAIL_PASSWORD': None,
+        'MAIL_SUPPRESS_SEND': False,
+    })
+    app.template_folder = ROOT
+    return app
+
+def queue(count, **columns):
+    for index in range(count):
+        hotel.db.session.add(hotel.EmailOutbox(
+            recipient=f'guest{index}@example.com',
+            subject='Booking Confirmation - Hotel Luxe',
+            body=f'Booking HB{index:06d} is confirmed',
+            **columns
+        ))
+    hotel.db.session.commit()
+
+def test_batch_is_delivered_over_one_smtp_session(smtp_sink):
+    with mail_app(smtp_sink.port).app_context():
+        queue(5)
+
+        assert hotel.email_worker.deliver_batch() == 5
+
+        assert len(smtp_sink.messages) == 5
+        assert len({session for session, _, _ in smtp_sink.messages}) == 1
+        assert sorted(rcpt for _, (rcpt,), _ in smtp_sink.messages) == [f'guest{index}@example.com' for index in range(5)]
+        assert 'Booking HB000003 is confirmed' in ''.join(content for _, _, content in smtp_sink.messages)
+        rows = hotel.EmailOutbox.query.all()
+        assert {row.status for row in rows} == {'sent'}
+        assert all(row.attempts == 1 and row.sent_at and row.claim_token is None for row in rows)
+        assert hotel.email_worker.deliver_batch() == 0
+
+def test_unreachable_server_schedules_a_retry():
+    with mail_app(free_port()).app_context():
+        queue(2)
+
+        assert hotel.email_worker.deliver_batch() == 2
+
+        rows = hotel.EmailOutbox.query.all()
+        assert {row.status for row in rows} == {'pending'}
+        assert all(row.attempts == 1 and row.last_error and row.claim_token is None for row in rows)
+        assert all(row.next_attempt_at > datetime.utcnow() for row in rows)
+        # Backed off, so nothing is due yet
+        assert hotel.email_worker.deliver_batch() == 0
+
+def test_stale_claims_are_taken_over(smtp_sink):
+    claimed_at = datetime.utcnow() - timedelta(seconds=hotel.EMAIL_CLAIM_TIMEOUT_SECONDS + 60)
+    with mail_app(smtp_sink.port).app_context():
+        queue(2, status='sending', claim_token='dead-worker', claimed_at=claimed_at)
+        queue(1, status='sending', claim_token='live-worker', claimed_at=datetime.utcnow())
+
+        assert hotel.email_worker.deliver_batch() == 2
+
+        assert len(smtp_sink.messages) == 2
+        statuses = {row.claim_token or row.status for row in hotel.EmailOutbox.query}
+        assert statuses == {'sent', 'live-worker'}
@@ -0,0 +1,124 @@
+"""
+Group bookings: several rooms for the same dates, held together and paid through one order
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+
+CHECK_IN = date.today() + timedelta(days=14)
+CHECK_OUT = CHECK_IN + timedelta(days=2)
+
+@pytest.fixture
+def rooms(make_room):
+    """Two Deluxe rooms at 3500 a night and one Suite at 6000"""
+    return {
+        'deluxe': [make_room('101'), make_room('102')],
+        'suite': make_room('201', room_type='Suite', price_per_night=6000),
+    }
+
+@pytest.fixture
+def guest(make_user, login):
+    return login(make_user())
+
+def book_group(client, rooms, **fields):
+    return client.post('/book/group', json=dict(
+        check_in=CHECK_IN.isoformat(),
+        check_out=CHECK_OUT.isoformat(),
+        rooms=rooms,
+        **fields
+    ))
+
+def held(app):
+    with app.app_context():
+        return hotel.Booking.query.count(), hotel.RoomNight.query.count()
+
+def take_room(app, room_id, user_id):
+    """Another guest books the room for the group's dates"""
+    with app.app_context():
+        assert hotel.reserve_room(room_id, user_id, CHECK_IN, CHECK_OUT, guests=1)['success']
+
+def test_short_request_offers_what_is_free_and_books_nothing(app, rooms, guest):
+    response = book_group(guest, [{'room_type': 'Deluxe', 'quantity': 3}])
+
+    assert response.status_code == 409
+    body = response.get_json()
+    assert body['requested'] == 3
+    assert body['shortfalls'] == [{'room_type': 'Deluxe', 'requested': 3, 'available': 2}]
+    assert sorted(body['options']['partial']['room_ids']) == rooms['deluxe']
+    assert body['options']['partial']['total_price'] == 2 * 2 * 3500
+    assert body['options']['other_available_by_type'] == {'Suite': 1}
+    assert held(app) == (0, 0)
+
+def test_allow_partial_books_the_rooms_that_are_free(app, rooms, guest):
+    response = book_group(guest, [{'room_type': 'Deluxe', 'quantity': 3}], allow_partial=True)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert sorted(booking['room_id'] for booking in body['bookings']) == rooms['deluxe']
+    assert body['total_price'] == 2 * 2 * 3500
+    assert body['shortfalls'] == [{'room_type': 'Deluxe', 'requested': 3, 'available': 2}]
+    with app.app_context():
+        assert {booking.group_reference for booking in hotel.Booking.query} == {body['group_reference']}
+    assert held(app) == (2, 4)
+
+def test_one_short_line_rejects_the_whole_group(app, rooms, guest, make_user):
+    take_room(app, rooms['suite'], make_user(1))
+
+    response = book_group(guest, [{'room_type': 'Deluxe', 'quantity': 2}, {'room_id': rooms['suite']}])
+
+    assert response.status_code == 409
+    assert response.get_json()['shortfalls'] == [{'room_id': rooms['suite'], 'requested': 1, 'available': 0}]
+    assert held(app) == (1, 2)  # only the other guest's Suite
+
+def test_lost_race_rolls_back_every_room_of_the_group(app, rooms, guest, make_user, monkeypatch):
+    # The route reads availability just before another guest takes the Suite
+    with app.app_context():
+        before = hotel.find_available_room_ids(CHECK_IN, CHECK_OUT)
+    take_room(app, rooms['suite'], make_user(1))
+    find_available_room_ids = hotel.find_available_room_ids
+    reads = []
+
+    def racing_find_available_room_ids(check_in, check_out, room_type=None):
+        reads.append(check_in)
+        return before if len(reads) == 1 else find_available_room_ids(check_in, check_out, room_type)
+    monkeypatch.setattr(hotel, 'find_available_room_ids', racing_find_available_room_ids)
+
+    response = book_group(guest, [{'room_type': 'Deluxe', 'quantity': 2}, {'room_type': 'Suite'}])
+
+    assert response.status_code == 409
+    body = response.get_json()
+    assert body['message'] == 'Rooms no longer available'
+    assert body['shortfalls'] == [{'room_type': 'Suite', 'requested': 1, 'available': 0}]
+    assert held(app) == (1, 2)  # neither Deluxe room was kept
+
+def test_group_pays_through_one_combined_order(app, rooms, guest):
+    bookings = book_group(guest, [{'room_type': 'Deluxe', 'quantity': 2}, {'room_type': 'Suite'}]).get_json()['bookings']
+
+    first = guest.post(f"/payment/{bookings[0]['booking_id']}", json={'payment_method': 'razorpay'}).get_json()
+    second = guest.post(f"/payment/{bookings[1]['booking_id']}", json={'payment_method': 'razorpay'}).get_json()
+
+    total = 2 * 2 * 3500 + 2 * 6000
+    assert first['amount'] == second['amount'] == total * 100
+    assert first['razorpay_order_id'] == second['razorpay_order_id']
+    assert hotel.payment_gateway._orders[first['razorpay_order_id']]['amount'] == total * 100
+    with app.app_context():
+        payments = hotel.Payment.query.all()
+        assert len(payments) == 3
+        assert {payment.razorpay_order_id for payment in payments} == {first['razorpay_order_id']}
+        assert sorted(payment.amount for payment in payments) == [7000, 7000, 12000]
+
+def test_verify_payment_confirms_every_booking_of_the_group(app, rooms, guest):
+    group = book_group(guest, [{'room_type': 'Deluxe', 'quantity': 2}, {'room_type': 'Suite'}]).get_json()
+    order_id = guest.post(f"/payment/{group['bookings'][0]['booking_id']}", json={'payment_method': 'razorpay'}).get_json()['razorpay_order_id']
+
+    response = guest.post('/verify-payment', json=hotel.payment_gateway.capture(order_id))
+
+    assert response.status_code == 200
+    assert response.get_json()['group_reference'] == group['group_reference']
+    with app.app_context():
+        assert {booking.status for booking in hotel.Booking.query} == {'confirmed'}
+        assert {payment.payment_status for payment in hotel.Payment.query} == {'completed'}
+        assert hotel.db.session.query(hotel.func.sum(hotel.DailyStat.revenue)).scalar() == group['total_price']
+        assert hotel.EmailOutbox.query.count() == 3
@@ -0,0 +1,94 @@
+"""
+HTTP caching: hashed static assets, the anonymous page cache and conditional GETs
+"""
+import gzip
+import os
+import re
+
+from conftest import ROOT, hotel
+
+def asset_url(html, filename):
+    stem, extension = os.path.splitext(filename)
+    match = re.search(rf'/static/{re.escape(stem)}\.([0-9a-f]{{12}}){re.escape(extension)}', html)
+    assert match, f'no hashed URL for {filename}'
+    return match.group(0), match.group(1)
+
+def test_pages_link_content_hashed_assets(app):
+    client = app.test_client()
+    html = client.get('/').get_data(as_text=True)
+
+    for filename in ('css/style.css', 'js/main.js'):
+        url, digest = asset_url(html, filename)
+        with open(os.path.join(ROOT, 'static', filename), 'rb') as f:
+            data = f.read()
+
+        response = client.get(url)
+
+        assert response.status_code == 200
+        assert response.get_data() == data
+        assert response.headers['Cache-Control'] == hotel.IMMUTABLE_CACHE_CONTROL
+        assert response.headers['ETag'] == f'"{digest}"'
+
+def test_hashed_assets_are_served_precompressed_with_their_own_etag(app):
+    client = app.test_client()
+    url, digest = asset_url(client.get('/').get_data(as_text=True), 'css/style.css')
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == f'"{digest}-gzip"'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    with open(os.path.join(ROOT, 'static', 'css', 'style.css'), 'rb') as f:
+        assert gzip.decompress(response.get_data()) == f.read()
+    revalidated = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{digest}-gzip"'})
+    assert revalidated.status_code == 304
+    # The identity ETag does not match the gzip representation
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{digest}"'}).status_code == 200
+
+def test_unhashed_static_paths_still_work(app):
+    response = app.test_client().get('/static/images/deluxe-room.svg')
+
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == f'public, max-age={hotel.STATIC_MAX_AGE}'
+
+def test_cached_page_answers_304_on_a_matching_etag(app, make_room):
+    make_room()
+    client = app.test_client()
+    first = client.get('/rooms')
+    etag = first.headers['ETag']
+
+    second = client.get('/rooms', headers={'If-None-Match': etag})
+
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'public, no-cache'
+    assert second.status_code == 304
+    assert second.get_data() == b''
+
+def test_page_cache_is_bypassed_for_any_session(app, make_user, login):
+    anonymous = app.test_client()
+    anonymous_etag = anonymous.get('/').headers['ETag']
+    guest = login(make_user())
+    with guest.session_transaction() as flask_session:
+        flask_session['user_name'] = 'Asha Guest'
+    admin = app.test_client()
+    with admin.session_transaction() as flask_session:
+        flask_session['admin_authenticated'] = True
+
+    for client in (guest, admin):
+        response = client.get('/', headers={'If-None-Match': anonymous_etag})
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        assert response.headers['ETag'] != anonymous_etag
+    assert 'Asha Guest' in guest.get('/').get_data(as_text=True)
+    # Nothing a signed-in guest saw was stored for anonymous visitors
+    assert anonymous.get('/').headers['ETag'] == anonymous_etag
+    assert 'Asha Guest' not in anonymous.get('/').get_data(as_text=True)
+
+def test_other_gets_are_conditional_and_private(app, make_user, login):
+    client = login(make_user())
+    first = client.get('/my-bookings')
+
+    second = client.get('/my-bookings', headers={'If-None-Match': first.headers['ETag']})
+
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    assert second.status_code == 304
@@ -0,0 +1,60 @@
+"""
+Alembic migrations: every path to head ends at the schema the models describe
+"""
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+
+from conftest import ROOT, hotel
+
+@pytest.fixture
+def scratch_app(tmp_path):
+    """An app on its own empty SQLite file, separate from the shared test database"""
+    app = hotel.create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test-secret-key',
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'migrations.db'}",
+    })
+    app.template_folder = ROOT
+    with app.app_context():
+        yield app
+        hotel.db.session.remove()
+        hotel.db.engine.dispose()
+
+def schema_diff():
+    with hotel.db.engine.connect() as connection:
+        return compare_metadata(MigrationContext.configure(connection), hotel.db.metadata)
+
+def current_revision():
+    with hotel.db.engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+def alembic_config():
+    return hotel.AlembicConfig(hotel.ALEMBIC_INI)
+
+def test_empty_database_is_built_by_the_migrations(scratch_app):
+    hotel.migrate_database()
+
+    assert current_revision() == '0007'
+    assert schema_diff() == []
+
+def test_pre_migration_database_is_stamped_and_upgraded(scratch_app):
+    # The original create_all() schema, without an alembic_version table
+    config = alembic_config()
+    with hotel.db.engine.begin() as connection:
+        config.attributes['connection'] = connection
+        hotel.alembic_command.upgrade(config, '0001')
+        connection.exec_driver_sql('DROP TABLE alembic_version')
+
+    hotel.migrate_database()
+
+    assert current_revision() == '0007'
+    assert schema_diff() == []
+
+def test_create_all_database_is_stamped_without_changes(scratch_app):
+    hotel.db.create_all()
+
+    hotel.migrate_database()
+
+    assert current_revision() == '0007'
+    assert schema_diff() == []
@@ -0,0 +1,143 @@
+"""
+Occupancy index: sorted stays with a running max_end, kept in step with the bookings table
+"""
+import random
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from conftest import hotel
+
+TODAY = date.today()
+
+def day(offset):
+    return TODAY + timedelta(days=offset)
+
+def stay(booking_id, room_id, start, nights, status='pending'):
+    return SimpleNamespace(id=booking_id, room_id=room_id, check_in=day(start), check_out=day(start + nights), status=status)
+
+def windows(days=20, longest=6):
+    return [(day(start), day(start + nights)) for start in range(days) for nights in range(1, longest + 1)]
+
+def overlaps(stays, room_id, check_in, check_out):
+    return any(s.room_id == room_id and s.check_in < check_out and check_in < s.check_out for s in stays)
+
+def test_a_long_stay_blocks_windows_after_shorter_later_ones():
+    index = hotel.OccupancyIndex()
+    index.add(stay(1, 101, 0, 10))
+    index.add(stay(2, 101, 2, 1))
+    index.add(stay(3, 101, 4, 1))
+
+    entry = index._rooms[101]
+    assert entry['starts'] == [day(0), day(2), day(4)]
+    assert entry['max_end'] == [day(10), day(10), day(10)]
+    # The stay that starts last ends on day 5; only max_end knows day 6 is taken
+    assert not index.is_free(101, day(6), day(7))
+    assert index.is_free(101, day(10), day(12))
+    assert index.is_free(102, day(0), day(1))
+
+def test_discard_recomputes_max_end():
+    index = hotel.OccupancyIndex()
+    for booking in (stay(1, 101, 0, 10), stay(2, 101, 2, 1), stay(3, 101, 4, 3)):
+        index.add(booking)
+
+    index.discard(1)
+
+    assert index._rooms[101]['max_end'] == [day(3), day(7)]
+    assert index.is_free(101, day(0), day(2))
+    assert index.is_free(101, day(7), day(9))
+    assert not index.is_free(101, day(6), day(9))
+    index.discard(1)  # forgetting an unknown booking is a no-op
+    assert sorted(index._bookings) == [2, 3]
+
+def test_readding_is_a_no_op_and_inactive_bookings_are_discarded():
+    index = hotel.OccupancyIndex()
+    booking = stay(1, 101, 3, 2)
+    index.add(booking)
+    index.add(booking)
+    assert index._rooms[101]['stays'] == [(day(3), day(5), 1)]
+
+    booking.status = 'cancelled'
+    index.add(booking)
+
+    assert index._rooms[101]['stays'] == []
+    assert index.is_free(101, day(3), day(5))
+
+def test_random_adds_and_discards_match_a_linear_scan():
+    rng = random.Random(7)
+    index = hotel.OccupancyIndex()
+    held = {}
+    for booking_id in range(1, 200):
+        if held and rng.random() < 0.3:
+            index.discard(held.pop(rng.choice(sorted(held))).id)
+        else:
+            held[booking_id] = stay(booking_id, rng.choice([101, 102]), rng.randrange(20), rng.randrange(1, 8))
+            index.add(held[booking_id])
+
+        for room_id in (101, 102):
+            entry = index._rooms.get(room_id, {'stays': [], 'max_end': []})
+            ends = [check_out for _, check_out, _ in entry['stays']]
+            assert entry['max_end'] == [max(ends[:i + 1]) for i in range(len(ends))]
+    for room_id in (101, 102):
+        for check_in, check_out in windows():
+            assert index.is_free(room_id, check_in, check_out) == (not overlaps(held.values(), room_id, check_in, check_out))
+
+def assert_index_agrees(app, room_ids):
+    """The index and the room nights table give the same answer for every window"""
+    with app.app_context():
+        assert hotel.occupancy_index.check_consistency()['consistent']
+        for check_in, check_out in windows(days=12, longest=4):
+            from_index = [room_id for room_id in room_ids if hotel.occupancy_index.is_free(room_id, check_in, check_out)]
+            assert from_index == hotel.find_available_room_ids(check_in, check_out)
+
+def test_index_agrees_with_the_database_through_book_cancel_expiry_and_reclaim(app, make_room, make_user, login):
+    room_ids = [make_room('101'), make_room('102')]
+    client = login(make_user())
+
+    def book(room_id, start, nights):
+        response = client.post('/book', json={
+            'room_id': room_id, 'check_in': day(start).isoformat(), 'check_out': day(start + nights).isoformat(), 'guests': 1
+        })
+        assert response.status_code == 200
+        return response.get_json()['booking_id']
+
+    long_stay = book(room_ids[0], 1, 8)
+    book(room_ids[0], 10, 1)
+    expiring = book(room_ids[1], 3, 2)
+    assert_index_agrees(app, room_ids)
+
+    assert client.post(f'/cancel-booking/{long_stay}').status_code == 200
+    assert_index_agrees(app, room_ids)
+
+    order_id = client.post(f'/payment/{expiring}', json={'payment_method': 'razorpay'}).get_json()['razorpay_order_id']
+    with app.app_context():
+        booking = hotel.db.session.get(hotel.Booking, expiring)
+        booking.created_at -= timedelta(minutes=hotel.BOOKING_HOLD_MINUTES + 1)
+        hotel.db.session.commit()
+        assert hotel.expiry_sweeper.run()['bookings_expired'] == 1
+    assert hotel.occupancy_index.is_free(room_ids[1], day(3), day(5))
+    assert_index_agrees(app, room_ids)
+
+    # A late capture reclaims the expired booking's free nights
+    assert client.post('/verify-payment', json=hotel.payment_gateway.capture(order_id)).status_code == 200
+    assert not hotel.occupancy_index.is_free(room_ids[1], day(3), day(5))
+    assert_index_agrees(app, room_ids)
+
+def test_check_consistency_reports_drift_and_rebuild_clears_it(app, make_room, make_user, admin):
+    room_id, user_id = make_room(), make_user()
+    with app.app_context():
+        # Booked without the route, as another worker would
+        missing = hotel.reserve_room(room_id, user_id, day(2), day(4), guests=1)['booking'].id
+        moved = hotel.reserve_room(room_id, user_id, day(6), day(8), guests=1)['booking']
+        hotel.occupancy_index.add(moved)
+        moved.check_out = day(9)
+        hotel.db.session.commit()
+        moved = moved.id
+    hotel.occupancy_index.add(stay(999, room_id, 12, 2))
+
+    report = admin.get('/admin/occupancy-index').get_json()
+
+    assert not report['consistent']
+    assert (report['missing'], report['stale'], report['mismatched']) == ([missing], [999], [moved])
+    rebuilt = admin.post('/admin/occupancy-index').get_json()
+    assert rebuilt['consistent']
+    assert rebuilt['indexed_bookings'] == rebuilt['database_bookings'] == 2
@@ -0,0 +1,95 @@
+"""
+OTP provider calls behind the circuit breaker
+"""
+import pytest
+import requests
+from twilio.base.exceptions import TwilioRestException
+
+from conftest import hotel
+
+PHONE = '+919812345678'
+
+class FailingProvider:
+    """Provider whose every call raises the given error"""
+
+    name = 'failing'
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def send(self, phone):
+        self.calls += 1
+        raise self.error
+
+    verify = send
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = hotel.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    monkeypatch.setattr(hotel, 'otp_breaker', breaker)
+    return breaker
+
+def use_provider(monkeypatch, error):
+    provider = FailingProvider(error)
+    monkeypatch.setattr(hotel, 'otp_provider', provider)
+    return provider
+
+def twilio_error(status):
+    return TwilioRestException(status, 'https://verify.twilio.com/v2/Services/VA/Verifications', 'rejected', code=60200)
+
+@pytest.mark.parametrize('status', [400, 404, 429])
+def test_client_errors_do_not_open_the_circuit(monkeypatch, breaker, status):
+    provider = use_provider(monkeypatch, twilio_error(status))
+
+    results = [hotel.send_otp_code(PHONE) for _ in range(breaker.failure_threshold + 2)]
+
+    assert provider.calls == breaker.failure_threshold + 2
+    assert breaker.state == 'closed'
+    assert all(result == {'success': False, 'error': results[0]['error'], 'status_code': status} for result in results)
+
+@pytest.mark.parametrize('error', [
+    twilio_error(503),
+    requests.exceptions.ReadTimeout('read timed out'),
+    requests.exceptions.ConnectionError('connection refused'),
+    TimeoutError('timed out'),
+])
+def test_outages_open_the_circuit(monkeypatch, breaker, error):
+    provider = use_provider(monkeypatch, error)
+
+    for _ in range(breaker.failure_threshold):
+        assert not hotel.send_otp_code(PHONE)['success']
+
+    assert breaker.state == 'open'
+    assert hotel.send_otp_code(PHONE) == {'success': False, 'error': 'OTP provider unavailable'}
+    assert provider.calls == breaker.failure_threshold
+
+def test_client_error_on_the_trial_call_closes_the_circuit(monkeypatch, breaker):
+    use_provider(monkeypatch, twilio_error(503))
+    for _ in range(breaker.failure_threshold):
+        hotel.send_otp_code(PHONE)
+    breaker._opened_at -= breaker.reset_timeout  # let the trial through
+
+    use_provider(monkeypatch, twilio_error(400))
+    assert hotel.send_otp_code(PHONE)['status_code'] == 400
+    assert breaker.state == 'closed'
+
+def test_unexpected_error_frees_the_trial_slot(monkeypatch, breaker):
+    use_provider(monkeypatch, twilio_error(503))
+    for _ in range(breaker.failure_threshold):
+        hotel.send_otp_code(PHONE)
+    breaker._opened_at -= breaker.reset_timeout
+
+    use_provider(monkeypatch, ValueError('bad response body'))
+    assert not hotel.send_otp_code(PHONE)['success']
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+
+def test_send_otp_reports_a_rejected_number_as_a_client_error(app, monkeypatch, breaker):
+    use_provider(monkeypatch, twilio_error(400))
+
+    response = app.test_client().post('/send-otp', json={'phone': PHONE, 'purpose': 'register'})
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Could not send OTP to this number'
+    assert breaker.state == 'closed'
@@ -0,0 +1,307 @@
+"""
+Payment routes: QR code and Razorpay payments
+"""
+import threading
+import time
+from datetime import date, timedelta
+
+from conftest import hotel
+
+def book(app, room_id, user_id, days_ahead=7, nights=2):
+    check_in = date.today() + timedelta(days=days_ahead)
+    with app.app_context():
+        return hotel.reserve_room(room_id, user_id, check_in, check_in + timedelta(days=nights), guests=1)['booking'].id
+
+def test_qr_code_is_served_by_its_indexed_digest(app, make_room, make_user, login, monkeypatch):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+
+    response = client.post(f'/payment/{booking_id}', json={'payment_method': 'qr_code'})
+
+    assert response.status_code == 200
+    with app.app_context():
+        payment = hotel.Payment.query.filter_by(booking_id=booking_id).one()
+        assert len(payment.qr_code_digest) == 64
+        assert response.get_json()['qr_code'].startswith(f'/qr/{payment.qr_code_digest}.')
+    # A cold QR cache falls back to the payments lookup
+    monkeypatch.setattr(hotel, 'qr_code_cache', hotel.QRCodeCache())
+    image = client.get(response.get_json()['qr_code'])
+    assert image.status_code == 200
+    assert image.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert client.get('/qr/' + '0' * 64 + '.png').status_code == 404
+
+def open_order(client, booking_id):
+    response = client.post(f'/payment/{booking_id}', json={'payment_method': 'razorpay'})
+    assert response.status_code == 200
+    return response.get_json()['razorpay_order_id']
+
+def expire(app, booking_id):
+    """Let the booking's hold lapse and run the sweeper over it"""
+    with app.app_context():
+        booking = hotel.db.session.get(hotel.Booking, booking_id)
+        booking.created_at -= timedelta(minutes=hotel.BOOKING_HOLD_MINUTES + 1)
+        hotel.db.session.commit()
+        assert hotel.expiry_sweeper.run()['bookings_expired'] == 1
+
+def test_verify_payment_confirms_once(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+    checkout = hotel.payment_gateway.capture(open_order(client, booking_id))
+
+    first = client.post('/verify-payment', json=checkout)
+    second = client.post('/verify-payment', json=checkout)
+
+    assert first.status_code == second.status_code == 200
+    with app.app_context():
+        assert hotel.db.session.get(hotel.Booking, booking_id).status == 'confirmed'
+        assert hotel.Payment.query.one().payment_status == 'completed'
+        assert hotel.EmailOutbox.query.count() == 1
+        assert hotel.RoomNight.query.filter_by(booking_id=booking_id).count() == 2
+
+def test_late_capture_for_an_expired_booking_reclaims_its_free_nights(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+    order_id = open_order(client, booking_id)
+    expire(app, booking_id)
+
+    response = client.post('/verify-payment', json=hotel.payment_gateway.capture(order_id))
+
+    assert response.status_code == 200
+    with app.app_context():
+        assert hotel.db.session.get(hotel.Booking, booking_id).status == 'confirmed'
+        assert hotel.Payment.query.one().payment_status == 'completed'
+        assert hotel.RoomNight.query.filter_by(booking_id=booking_id).count() == 2
+        assert hotel.EmailOutbox.query.count() == 1
+        assert hotel.payment_reconciler.process_refunds() == 0
+
+def test_late_capture_for_an_expired_booking_whose_nights_were_rebooked_is_refunded(app, make_room, make_user, login):
+    user_id = make_user()
+    room_id = make_room()
+    booking_id = book(app, room_id, user_id)
+    client = login(user_id)
+    order_id = open_order(client, booking_id)
+    expire(app, booking_id)
+    rebooked_id = book(app, room_id, make_user(1))
+    checkout = hotel.payment_gateway.capture(order_id)
+
+    response = client.post('/verify-payment', json=checkout)
+
+    assert response.status_code == 409
+    assert response.get_json()['refunded_bookings']
+    with app.app_context():
+        payment = hotel.Payment.query.one()
+        assert payment.payment_status == 'refund_pending'
+        assert payment.razorpay_payment_id == checkout['razorpay_payment_id']
+
+        assert hotel.payment_reconciler.process_refunds() == 1
+
+        hotel.db.session.refresh(payment)
+        assert payment.payment_status == 'refunded'
+        assert hotel.db.session.get(hotel.Booking, booking_id).status == 'expired'
+        assert {night.booking_id for night in hotel.RoomNight.query} == {rebooked_id}
+        assert hotel.EmailOutbox.query.count() == 0
+        assert hotel.DailyStat.query.count() == 0
+    refunds = [refund for refund in hotel.payment_gateway.refunds if refund['payment_id'] == checkout['razorpay_payment_id']]
+    assert [refund['amount'] for refund in refunds] == [int(round(payment.amount * 100))]
+
+def test_capture_for_a_cancelled_booking_is_refunded(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+    order_id = open_order(client, booking_id)
+    with app.app_context():
+        hotel.mark_booking_cancelled(hotel.db.session.get(hotel.Booking, booking_id))
+        hotel.db.session.commit()
+
+    response = client.post('/verify-payment', json=hotel.payment_gateway.capture(order_id))
+
+    assert response.status_code == 409
+    with app.app_context():
+        assert hotel.db.session.get(hotel.Booking, booking_id).status == 'cancelled'
+        assert hotel.Payment.query.one().payment_status == 'refund_pending'
+        assert hotel.RoomNight.query.count() == 0
+
+def test_payment_cannot_be_opened_for_a_booking_that_is_not_pending(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    expire(app, booking_id)
+
+    response = login(user_id).post(f'/payment/{booking_id}', json={'payment_method': 'razorpay'})
+
+    assert response.status_code == 409
+    with app.app_context():
+        assert hotel.Payment.query.count() == 0
+
+def test_qr_confirmation_after_expiry_reclaims_free_nights(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+    payment_id = client.post(f'/payment/{booking_id}', json={'payment_method': 'qr_code'}).get_json()['payment_id']
+    expire(app, booking_id)
+
+    assert client.post(f'/confirm-payment/{payment_id}').status_code == 200
+    with app.app_context():
+        assert hotel.db.session.get(hotel.Booking, booking_id).status == 'confirmed'
+        assert hotel.db.session.get(hotel.Payment, payment_id).payment_status == 'completed'
+
+def test_qr_confirmation_after_the_nights_were_rebooked_is_held_for_manual_refund(app, make_room, make_user, login):
+    user_id = make_user()
+    room_id = make_room()
+    booking_id = book(app, room_id, user_id)
+    client = login(user_id)
+    payment_id = client.post(f'/payment/{booking_id}', json={'payment_method': 'qr_code'}).get_json()['payment_id']
+    expire(app, booking_id)
+    book(app, room_id, make_user(1))
+
+
+    response = client.post(f'/confirm-payment/{payment_id}')
+
+    assert response.status_code == 409
+    with app.app_context():
+        assert hotel.db.session.get(hotel.Booking, booking_id).status == 'expired'
+        assert hotel.db.session.get(hotel.Payment, payment_id).payment_status == 'refund_pending'
+        # Only gateway payments are refunded automatically
+        assert hotel.payment_reconciler.process_refunds() == 0
+        assert hotel.db.session.get(hotel.Payment, payment_id).payment_status == 'refund_pending'
+
+def test_confirmation_fails_when_the_nights_cannot_be_claimed(app, make_room, make_user):
+    room_id, user_id = make_room(), make_user()
+    check_in = date.today() + timedelta(days=7)
+    with app.app_context():
+        booking = hotel.Booking(
+            user_id=user_id, room_id=room_id, check_in=check_in, check_out=check_in + timedelta(days=2),
+            guests=1, total_price=7000, status='pending', booking_reference='HBLEGACY'
+        )
+        hotel.db.session.add(booking)
+        hotel.db.session.commit()
+        # Another booking holds one of the nights, e.g. a legacy overlap
+        assert hotel.reserve_room(room_id, user_id, check_in + timedelta(days=1), check_in + timedelta(days=3), guests=1)['success']
+
+        assert hotel.mark_booking_confirmed(booking) is False
+
+        hotel.db.session.commit()
+        assert booking.status == 'pending'
+        assert hotel.RoomNight.query.filter_by(booking_id=booking.id).count() == 0
+        assert hotel.DailyStat.query.count() == 0
+
+def stats_totals(app):
+    with app.app_context():
+        return hotel.db.session.query(
+            hotel.func.coalesce(hotel.func.sum(hotel.DailyStat.revenue), 0),
+            hotel.func.coalesce(hotel.func.sum(hotel.DailyStat.room_nights_sold), 0)
+        ).one()
+
+def test_cancel_then_capture_refunds_and_leaves_no_stats(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+    order_id = open_order(client, booking_id)
+
+    assert client.post(f'/cancel-booking/{booking_id}').status_code == 200
+    response = client.post('/verify-payment', json=hotel.payment_gateway.capture(order_id))
+
+    assert response.status_code == 409
+    assert tuple(stats_totals(app)) == (0, 0)
+    with app.app_context():
+        assert hotel.db.session.get(hotel.Booking, booking_id).status == 'cancelled'
+        assert hotel.Payment.query.one().payment_status == 'refund_pending'
+
+def test_capture_then_cancel_removes_the_stay_from_stats_once(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+    assert client.post('/verify-payment', json=hotel.payment_gateway.capture(open_order(client, booking_id))).status_code == 200
+    assert tuple(stats_totals(app)) == (7000, 2)
+
+    assert client.post(f'/cancel-booking/{booking_id}').status_code == 200
+    assert client.post(f'/cancel-booking/{booking_id}').status_code == 400
+
+    assert tuple(stats_totals(app)) == (0, 0)
+
+def test_cancel_acts_on_the_status_the_row_has_not_the_one_it_loaded(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    checkout = hotel.payment_gateway.capture(open_order(login(user_id), booking_id))
+    with app.app_context():
+        stale = hotel.db.session.get(hotel.Booking, booking_id)
+        assert stale.status == 'pending'
+        # The capture confirms the booking from another session in the meantime
+        with app.app_context():
+            payment = hotel.Payment.query.one()
+            assert hotel.complete_payment(payment, payment.booking.user, checkout['razorpay_payment_id']) == 'confirmed'
+            hotel.db.session.commit()
+
+        assert hotel.mark_booking_cancelled(stale) is True
+        hotel.db.session.commit()
+        # A second cancel from a stale copy changes nothing
+        assert hotel.mark_booking_cancelled(stale) is False
+
+    assert tuple(stats_totals(app)) == (0, 0)
+
+def test_open_razorpay_order_is_reused_until_the_amount_changes(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+
+    first = open_order(client, booking_id)
+    assert open_order(client, booking_id) == first
+    with app.app_context():
+        assert hotel.Payment.query.count() == 1
+        hotel.db.session.get(hotel.Booking, booking_id).total_price = 8000
+        hotel.db.session.commit()
+    second = open_order(client, booking_id)
+
+    assert second != first
+    assert hotel.payment_gateway._orders[second]['amount'] == 8000 * 100
+    with app.app_context():
+        assert hotel.db.session.get(hotel.Booking, booking_id).payment.razorpay_order_id == second
+
+def test_payment_waits_for_the_order_precreated_at_booking(app, make_room, make_user, login, monkeypatch):
+    room_id = make_room()
+    client = login(make_user())
+    released = threading.Event()
+    precreate_razorpay_order = hotel.precreate_razorpay_order
+
+    def slow_precreate_razorpay_order(app, booking_id):
+        released.wait(timeout=5)
+        precreate_razorpay_order(app, booking_id)
+    monkeypatch.setattr(hotel, 'RAZORPAY_PRECREATE_ORDERS', True)
+    monkeypatch.setattr(hotel, 'precreate_razorpay_order', slow_precreate_razorpay_order)
+    check_in = date.today() + timedelta(days=7)
+    booking_id = client.post('/book', json={
+        'room_id': room_id, 'check_in': check_in.isoformat(), 'check_out': (check_in + timedelta(days=2)).isoformat(), 'guests': 1
+    }).get_json()['booking_id']
+    pending_order = hotel.precreated_orders[booking_id]
+    threading.Timer(0.3, released.set).start()
+
+    started = time.monotonic()
+    order_id = open_order(client, booking_id)
+
+    # The route blocked on the background create instead of racing it with its own
+    assert time.monotonic() - started >= 0.25
+    assert pending_order.done()
+    assert booking_id not in hotel.precreated_orders
+    with app.app_context():
+        assert hotel.Payment.query.one().razorpay_order_id == order_id
+
+def test_booking_payment_is_the_settled_attempt_else_the_latest(app, make_room, make_user, login):
+    user_id = make_user()
+    booking_id = book(app, make_room(), user_id)
+    client = login(user_id)
+    order_id = open_order(client, booking_id)  # as pre-created at booking time
+
+    qr = client.post(f'/payment/{booking_id}', json={'payment_method': 'qr_code'}).get_json()
+    with app.app_context():
+        assert hotel.db.session.get(hotel.Booking, booking_id).payment.id == qr['payment_id']
+
+    # The guest pays the Razorpay order after all
+    assert client.post('/verify-payment', json=hotel.payment_gateway.capture(order_id)).status_code == 200
+
+    with app.app_context():
+        payment = hotel.db.session.get(hotel.Booking, booking_id).payment
+        assert (payment.razorpay_order_id, payment.payment_status) == (order_id, 'completed')
+    page = client.get(f'/booking-details/{booking_id}').get_data(as_text=True)
+    assert 'Razorpay' in page and 'Completed' in page
@@ -0,0 +1,104 @@
+"""
+Pricing: weekend and rate-rule multipliers on quotes, bookings and rate changes
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+
+# A Monday at least a week out, so the horizon covers the whole stay
+MONDAY = date.today() + timedelta(days=7 + (7 - date.today().weekday()) % 7)
+WEEK = (MONDAY, MONDAY + timedelta(days=7))  # Monday to Monday: Friday and Saturday are weekend nights
+
+@pytest.fixture
+def rooms(make_room):
+    return {'deluxe': make_room('101'), 'suite': make_room('201', room_type='Suite', price_per_night=6000)}
+
+def quoted_prices(client, check_in, check_out, room_type=None):
+    """Price per room id from /check-availability"""
+    body = client.post('/check-availability', json={
+        'check_in': check_in.isoformat(), 'check_out': check_out.isoformat(), 'room_type': room_type
+    }).get_json()
+    return {room['id']: price for room, price in zip(body['rooms'], body['prices'])}
+
+def add_rate(admin, **rule):
+    response = admin.post('/admin/rates', json=rule)
+    assert response.status_code == 200
+    return response.get_json()['rates'][-1]['id']
+
+def test_flat_rates_price_a_stay_at_the_base_price(app, rooms):
+    prices = quoted_prices(app.test_client(), *WEEK)
+
+    assert prices == {rooms['deluxe']: 7 * 3500, rooms['suite']: 7 * 6000}
+
+def test_weekend_multiplier_applies_to_friday_and_saturday_nights(app, rooms, monkeypatch):
+    monkeypatch.setattr(hotel, 'PRICING_WEEKEND_MULTIPLIER', 2.0)
+    hotel.pricing_engine.invalidate()
+
+    prices = quoted_prices(app.test_client(), *WEEK)
+
+    assert prices[rooms['deluxe']] == 5 * 3500 + 2 * 7000
+    # A Monday-to-Wednesday stay has no weekend nights
+    assert quoted_prices(app.test_client(), MONDAY, MONDAY + timedelta(days=2))[rooms['deluxe']] == 2 * 3500
+
+def test_overlapping_rules_multiply_and_respect_room_type(app, rooms, admin):
+    add_rate(admin, name='Deluxe festival', room_type='Deluxe', multiplier=1.5,
+             start_date=MONDAY.isoformat(), end_date=(MONDAY + timedelta(days=2)).isoformat())
+    add_rate(admin, name='Midweek', multiplier=2, weekdays=[1, 2])  # Tuesday and Wednesday nights
+
+    prices = quoted_prices(app.test_client(), *WEEK)
+
+    # Monday 1.5, Tuesday 1.5 x 2, Wednesday 1.5 x 2, Thursday to Sunday 1
+    assert prices[rooms['deluxe']] == 3500 * (1.5 + 3 + 3 + 4)
+    # Only the midweek rule covers the Suite
+    assert prices[rooms['suite']] == 6000 * (1 + 2 + 2 + 4)
+
+def test_deleting_a_rule_restores_the_price(app, rooms, admin):
+    rate_id = add_rate(admin, name='Everything doubles', multiplier=2)
+    assert quoted_prices(app.test_client(), *WEEK)[rooms['deluxe']] == 7 * 7000
+
+    assert admin.delete(f'/admin/rates/{rate_id}').status_code == 200
+
+    assert quoted_prices(app.test_client(), *WEEK)[rooms['deluxe']] == 7 * 3500
+
+def test_invalid_rules_are_rejected(app, admin):
+    assert admin.post('/admin/rates', json={'name': 'Free', 'multiplier': 0}).status_code == 400
+    assert admin.post('/admin/rates', json={'name': 'Bad date', 'multiplier': 1.2, 'start_date': 'soon'}).status_code == 400
+    with app.app_context():
+        assert hotel.RoomRate.query.count() == 0
+
+def test_booking_charges_the_quoted_price(app, rooms, make_user, login):
+    client = login(make_user())
+    quoted = quoted_prices(client, *WEEK)[rooms['suite']]
+
+    response = client.post('/book', json={
+        'room_id': rooms['suite'], 'check_in': WEEK[0].isoformat(), 'check_out': WEEK[1].isoformat(), 'guests': 1
+    })
+
+    assert response.get_json()['total_price'] == quoted
+    with app.app_context():
+        assert hotel.Booking.query.one().total_price == quoted
+
+def test_rate_change_between_quote_and_booking_charges_the_new_rate(app, rooms, make_user, login, admin):
+    client = login(make_user())
+    assert quoted_prices(client, *WEEK)[rooms['deluxe']] == 7 * 3500
+    add_rate(admin, name='Surge', room_type='Deluxe', multiplier=1.2)
+
+    response = client.post('/book', json={
+        'room_id': rooms['deluxe'], 'check_in': WEEK[0].isoformat(), 'check_out': WEEK[1].isoformat(), 'guests': 1
+    })
+
+    assert response.get_json()['total_price'] == pytest.approx(7 * 3500 * 1.2)
+    assert quoted_prices(client, *WEEK)[rooms['suite']] == 7 * 6000
+
+def test_nights_past_the_horizon_are_charged_the_base_price(app, rooms, admin):
+    add_rate(admin, name='Everything doubles', multiplier=2)
+    engine = hotel.PricingEngine(horizon_days=3)
+    check_in = date.today() + timedelta(days=1)
+
+    with app.app_context():
+        price = engine.stay_price(rooms['deluxe'], check_in, check_in + timedelta(days=4))
+
+    # Nights 1 and 2 are inside the three-day table, nights 3 and 4 past it
+    assert price == 2 * 7000 + 2 * 3500
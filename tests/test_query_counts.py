@@ -0,0 +1,88 @@
+"""
+Query counts: booking lists and the admin pages issue the same SQL for one booking or many
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+from helpers import QueryCounter, assert_max_queries
+
+@pytest.fixture
+def add_bookings(app, make_room):
+    """add_bookings(user_id, count) books `count` stays with a payment each, spread over three rooms"""
+    room_ids = [make_room(room_number=str(101 + index), room_type=room_type)
+                for index, room_type in enumerate(['Deluxe', 'Suite', 'Standard'])]
+    added = []
+
+    def add_bookings(user_id, count):
+        with app.app_context():
+            for _ in range(count):
+                index = len(added)
+                check_in = date.today() + timedelta(days=3 * index + 1)
+                booking = hotel.Booking(
+                    user_id=user_id,
+                    room_id=room_ids[index % len(room_ids)],
+                    check_in=check_in,
+                    check_out=check_in + timedelta(days=2),
+                    guests=1,
+                    total_price=7000,
+                    status=hotel.BOOKING_STATUSES[index % len(hotel.BOOKING_STATUSES)],
+                    booking_reference=f'BK{index:08d}'
+                )
+                booking.payments.append(hotel.Payment(
+                    amount=7000,
+                    payment_method='razorpay',
+                    payment_status='completed',
+                    transaction_id=f'TXN{index:08d}'
+                ))
+                hotel.db.session.add(booking)
+                hotel.db.session.commit()
+                added.append(booking.id)
+        return added[-count:]
+    return add_bookings
+
+def queries_for(app, client, url):
+    """SQL statements for one GET, after a first request has warmed the in-process caches"""
+    assert client.get(url).status_code == 200
+    with app.app_context(), QueryCounter() as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    return queries.count
+
+def test_my_bookings_is_one_query_for_any_number_of_bookings(app, make_user, login, add_bookings):
+    user_id = make_user()
+    client = login(user_id)
+    add_bookings(user_id, 1)
+    assert queries_for(app, client, '/my-bookings') == 1
+
+    add_bookings(user_id, 20)
+
+    assert queries_for(app, client, '/my-bookings') == 1
+
+def test_booking_details_loads_guest_room_and_payment_up_front(app, make_user, login, add_bookings):
+    user_id = make_user()
+    booking_id, = add_bookings(user_id, 1)
+    client = login(user_id)
+
+    # The booking joined with guest and room, then its payment
+    with app.app_context(), assert_max_queries(2):
+        response = client.get(f'/booking-details/{booking_id}')
+
+    assert response.status_code == 200
+
+def test_admin_dashboard_query_count_does_not_grow_with_bookings(app, make_user, admin, add_bookings):
+    add_bookings(make_user(), 1)
+    one = queries_for(app, admin, '/admin/dashboard')
+
+    add_bookings(make_user(1), 20)
+
+    assert queries_for(app, admin, '/admin/dashboard') == one
+
+def test_admin_bookings_api_is_one_query_per_page(app, make_user, admin, add_bookings):
+    add_bookings(make_user(), 1)
+    assert queries_for(app, admin, '/admin/api/bookings') == 1
+
+    add_bookings(make_user(1), 30)
+
+    assert queries_for(app, admin, '/admin/api/bookings?limit=25') == 1
@@ -0,0 +1,59 @@
+"""
+Query plans: the hot availability, OTP and booking-history queries use indexes
+"""
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+from helpers import QueryCounter, plan_uses_index
+
+@pytest.fixture
+def seeded(app, make_room, make_user):
+    """Enough rooms, guests and bookings for the planner to have a choice"""
+    room_ids = [make_room(room_number=str(100 + index)) for index in range(10)]
+    user_ids = [make_user(index) for index in range(10)]
+    with app.app_context():
+        for index in range(100):
+            check_in = date.today() + timedelta(days=index % 30)
+            booking = hotel.Booking(
+                user_id=user_ids[index % 10],
+                room_id=room_ids[index % 10],
+                check_in=check_in,
+                check_out=check_in + timedelta(days=2),
+                guests=1,
+                total_price=7000,
+                status=hotel.BOOKING_STATUSES[index % 4],
+                booking_reference=f'BK{index:08d}'
+            )
+            hotel.db.session.add(booking)
+        hotel.db.session.commit()
+    return room_ids, user_ids
+
+def hot_queries(room_id, user_id):
+    check_in = date.today() + timedelta(days=1)
+    check_out = check_in + timedelta(days=2)
+    return {
+        'check_room_availability': lambda: hotel.check_room_availability(room_id, check_in, check_out),
+        'find_available_room_ids': lambda: hotel.find_available_room_ids(check_in, check_out),
+        'check_otp_limit': lambda: hotel.db.session.query(hotel.func.count(hotel.RateLimitHit.id)).filter(
+            hotel.RateLimitHit.limit_key == 'otp:phone:+910000000000',
+            hotel.RateLimitHit.hit_at > time.time() - hotel.OTP_PHONE_WINDOW_SECONDS
+        ).scalar(),
+        'verify_otp': lambda: hotel.latest_otp_record('+910000000000', 'login'),
+        'my_bookings': lambda: hotel.user_booking_rows(user_id),
+    }
+
+@pytest.mark.parametrize('name', ['check_room_availability', 'find_available_room_ids', 'check_otp_limit',
+                                  'verify_otp', 'my_bookings'])
+def test_hot_query_reads_through_an_index(app, seeded, name):
+    room_ids, user_ids = seeded
+    with app.app_context():
+        with QueryCounter() as queries:
+            hot_queries(room_ids[0], user_ids[0])[name]()
+
+        assert queries.executions
+        for statement, parameters in queries.executions:
+            plan = hotel.explain_statement(hotel.db.session.connection(), statement, parameters)
+            assert plan_uses_index(plan), f'{statement}\n{plan}'
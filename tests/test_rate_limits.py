@@ -0,0 +1,95 @@
+"""
+OTP rate limits: the shared database backend and the per-process memory backend
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import hotel
+from helpers import assert_max_queries
+
+
+@pytest.fixture(params=['database', 'memory'])
+def backend(request, app):
+    backend = hotel.DatabaseRateLimitBackend() if request.param == 'database' else hotel.MemoryRateLimitBackend()
+    with app.app_context():
+        yield backend
+
+def test_hits_are_refused_once_the_window_is_full(backend):
+    now = time.time()
+    limits = [('otp:phone:+919800000001', 3, 60)]
+
+    assert [backend.hit(limits, now + offset)[0] for offset in range(4)] == [2, 1, 0, -1]
+    # The first hit leaves the window 60 seconds after it was made
+    assert backend.hit(limits, now + 60.5) == [0]
+
+def test_a_refused_hit_is_not_charged_to_the_other_limits(backend):
+    now = time.time()
+    phone_limit = ('otp:phone:+919800000001', 1, 3600)
+    ip_limit = ('otp:ip:203.0.113.7', 5, 3600)
+    assert backend.hit([phone_limit, ip_limit], now) == [0, 4]
+
+    for offset in range(1, 4):
+        assert backend.hit([phone_limit, ip_limit], now + offset) == [-1, 3]
+
+    other_phone = ('otp:phone:+919800000002', 1, 3600)
+    assert backend.hit([other_phone, ip_limit], now + 5) == [0, 3]
+
+def test_concurrent_workers_share_one_database_window(app):
+    limit = 10
+    barrier = threading.Barrier(40)
+
+    def hit(_):
+        barrier.wait()
+        with app.app_context():
+            return hotel.DatabaseRateLimitBackend().hit([('otp:ip:203.0.113.9', limit, 3600)], time.time())[0]
+
+    with ThreadPoolExecutor(max_workers=40) as executor:
+        results = list(executor.map(hit, range(40)))
+
+    assert sorted(result for result in results if result >= 0) == list(range(limit))
+    assert results.count(-1) == 40 - limit
+    with app.app_context():
+        assert hotel.RateLimitHit.query.count() == limit
+
+def test_sweeper_prunes_expired_hits_and_idle_keys(app):
+    backend = hotel.DatabaseRateLimitBackend()
+    long_ago = time.time() - hotel.OTP_PHONE_WINDOW_SECONDS - 60
+    with app.app_context():
+        backend.hit([('otp:phone:+919800000001', 10, hotel.OTP_PHONE_WINDOW_SECONDS)], long_ago)
+        backend.hit([('otp:phone:+919800000002', 10, hotel.OTP_PHONE_WINDOW_SECONDS)], time.time())
+
+        assert hotel.expiry_sweeper.run()['rate_limit_rows_pruned'] == 2
+
+        assert [hit.limit_key for hit in hotel.RateLimitHit.query] == ['otp:phone:+919800000002']
+        assert [key.limit_key for key in hotel.RateLimitKey.query] == ['otp:phone:+919800000002']
+
+def test_send_otp_is_limited_per_phone(app, make_user):
+    make_user(1)
+    client = app.test_client()
+    payload = {'phone': '+919800000001', 'purpose': 'login'}
+
+    statuses = [client.post('/send-otp', json=payload).status_code for _ in range(hotel.MAX_OTP_RESEND_PER_DAY + 1)]
+
+    assert statuses == [200] * hotel.MAX_OTP_RESEND_PER_DAY + [429]
+
+def test_memory_backend_refuses_to_run_under_several_workers(monkeypatch):
+    monkeypatch.setattr(hotel, 'RATE_LIMIT_BACKEND', 'memory')
+    hotel.check_rate_limit_backend(1)
+    with pytest.raises(RuntimeError, match='2 workers'):
+        hotel.check_rate_limit_backend(2)
+
+    monkeypatch.setattr(hotel, 'RATE_LIMIT_BACKEND', 'database')
+    hotel.check_rate_limit_backend(8)
+
+def test_database_backend_checks_every_limit_in_four_statements(app):
+    backend = hotel.DatabaseRateLimitBackend()
+    limits = [('otp:phone:+919800000001', 10, 86400), ('otp:ip:203.0.113.7', 20, 3600)]
+    with app.app_context():
+        backend.hit(limits, time.time())  # creates the key rows
+
+        # Lock the keys, trim both windows, count both, record both hits
+        with assert_max_queries(4):
+            assert backend.hit(limits, time.time()) == [8, 18]
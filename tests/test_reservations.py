@@ -0,0 +1,63 @@
+"""
+reserve_room() / reserve_rooms(): which unique key failed decides the outcome
+"""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from conftest import hotel
+
+CHECK_IN = date.today() + timedelta(days=5)
+CHECK_OUT = CHECK_IN + timedelta(days=2)
+
+def references(monkeypatch, *values):
+    """Make generate_booking_reference() return values in order"""
+    remaining = iter(values)
+    monkeypatch.setattr(hotel, 'generate_booking_reference', lambda: next(remaining))
+
+def test_taken_room_nights_are_unavailable(app, make_room, make_user):
+    room_id, user_id = make_room(), make_user()
+    with app.app_context():
+        assert hotel.reserve_room(room_id, user_id, CHECK_IN, CHECK_OUT, guests=1)['success']
+        result = hotel.reserve_room(room_id, user_id, CHECK_IN + timedelta(days=1), CHECK_OUT + timedelta(days=1), guests=1)
+        assert result == {'success': False, 'error': 'unavailable'}
+
+def test_booking_reference_collision_is_retried(app, make_room, make_user, monkeypatch):
+    room_id, user_id = make_room(), make_user()
+    other_room_id = make_room('102')
+    with app.app_context():
+        references(monkeypatch, 'HBTAKEN', 'HBTAKEN', 'HBFRESH')
+        assert hotel.reserve_room(other_room_id, user_id, CHECK_IN, CHECK_OUT, guests=1)['success']
+
+        result = hotel.reserve_room(room_id, user_id, CHECK_IN, CHECK_OUT, guests=1)
+
+        assert result['success']
+        assert result['booking'].booking_reference == 'HBFRESH'
+        assert hotel.RoomNight.query.filter_by(booking_id=result['booking'].id).count() == 2
+
+def test_booking_reference_collisions_give_up_after_the_last_attempt(app, make_room, make_user, monkeypatch):
+    room_id, user_id = make_room(), make_user()
+    other_room_id = make_room('102')
+    with app.app_context():
+        references(monkeypatch, *['HBTAKEN'] * (hotel.BOOKING_REFERENCE_ATTEMPTS + 1))
+        assert hotel.reserve_room(other_room_id, user_id, CHECK_IN, CHECK_OUT, guests=1)['success']
+
+        with pytest.raises(IntegrityError):
+            hotel.reserve_room(room_id, user_id, CHECK_IN, CHECK_OUT, guests=1)
+        assert hotel.Booking.query.count() == 1
+
+def test_group_booking_retries_a_reference_collision(app, make_room, make_user, monkeypatch):
+    room_ids = [make_room('101'), make_room('102')]
+    other_room_id = make_room('103')
+    user_id = make_user()
+    with app.app_context():
+        # Single booking takes HBTAKEN; the group's first try reuses it for its first room
+        references(monkeypatch, 'HBTAKEN', 'HBGROUP1', 'HBTAKEN', 'HBROOM2', 'HBGROUP2', 'HBROOM3', 'HBROOM4')
+        assert hotel.reserve_room(other_room_id, user_id, CHECK_IN, CHECK_OUT, guests=1)['success']
+
+        result = hotel.reserve_rooms(room_ids, user_id, CHECK_IN, CHECK_OUT, guests=1)
+
+        assert result['success']
+        assert result['group_reference'] == 'HBGROUP2'
+        assert [booking.booking_reference for booking in result['bookings']] == ['HBROOM3', 'HBROOM4']
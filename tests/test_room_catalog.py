@@ -0,0 +1,99 @@
+"""
+Room catalog: room writes reach /rooms and search in this worker and, via cache_versions, in others
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import hotel
+
+CHECK_IN = date.today() + timedelta(days=10)
+CHECK_OUT = CHECK_IN + timedelta(days=2)
+
+@pytest.fixture
+def workers(app, make_room, monkeypatch):
+    """(writer, other): this worker's catalog and a second worker's, which only sees cache_versions"""
+    make_room('101')
+    writer = hotel.room_catalog
+    monkeypatch.setattr(writer, 'shared', True)
+    other = hotel.RoomCatalog(shared=True, check_interval=0)
+    return writer, other
+
+def as_worker(monkeypatch, catalog):
+    monkeypatch.setattr(hotel, 'room_catalog', catalog)
+
+def listed(app):
+    """(room numbers on /rooms, room numbers from a search)"""
+    client = app.test_client()
+    page = client.get('/rooms').get_data(as_text=True)
+    body = client.post('/check-availability', json={
+        'check_in': CHECK_IN.isoformat(), 'check_out': CHECK_OUT.isoformat()
+    }).get_json()
+    assert len(body['rooms']) == len(body['prices'])
+    return (
+        sorted(number for number in ('101', '102') if f'Room {number}' in page),
+        sorted(room['room_number'] for room in body['rooms'])
+    )
+
+def write(app, monkeypatch, writer, change):
+    """Commit a room change from the writer worker"""
+    as_worker(monkeypatch, writer)
+    with app.app_context():
+        change()
+        hotel.db.session.commit()
+
+def test_insert_update_and_delete_reach_another_worker(app, workers, monkeypatch):
+    writer, other = workers
+    as_worker(monkeypatch, other)
+    assert listed(app) == (['101'], ['101'])
+
+    write(app, monkeypatch, writer, lambda: hotel.db.session.add(hotel.Room(
+        room_number='102', room_type='Suite', price_per_night=6000, capacity=2, description='Suite room'
+    )))
+    as_worker(monkeypatch, other)
+    assert listed(app) == (['101', '102'], ['101', '102'])
+
+    write(app, monkeypatch, writer, lambda: setattr(hotel.Room.query.filter_by(room_number='102').one(), 'description', 'Sea view suite'))
+    as_worker(monkeypatch, other)
+    assert 'Sea view suite' in app.test_client().get('/rooms').get_data(as_text=True)
+    with app.app_context():
+        assert [room['description'] for room in other.rooms('Suite')] == ['Sea view suite']
+
+    write(app, monkeypatch, writer, lambda: hotel.db.session.delete(hotel.Room.query.filter_by(room_number='101').one()))
+    as_worker(monkeypatch, other)
+    assert listed(app) == (['102'], ['102'])
+
+def test_other_worker_serves_its_copy_until_the_version_check(app, workers, monkeypatch):
+    writer, other = workers
+    other.check_interval = 3600
+    as_worker(monkeypatch, other)
+    assert listed(app)[0] == ['101']
+    with app.app_context():
+        version = other._read_shared_version()
+
+    write(app, monkeypatch, writer, lambda: setattr(hotel.Room.query.one(), 'description', 'Renovated'))
+    with app.app_context():
+        assert other._read_shared_version() == version + 1
+    as_worker(monkeypatch, other)
+    assert 'Renovated' not in app.test_client().get('/rooms').get_data(as_text=True)
+
+    other.check_interval = 0
+    assert 'Renovated' in app.test_client().get('/rooms').get_data(as_text=True)
+
+def test_writer_sees_its_own_commit_at_once_and_rollbacks_change_nothing(app, workers, monkeypatch):
+    writer, _ = workers
+    writer.check_interval = 3600
+    assert listed(app) == (['101'], ['101'])
+    with app.app_context():
+        version = writer._read_shared_version()
+        hotel.Room.query.one().description = 'Never saved'
+        hotel.db.session.flush()
+        hotel.db.session.rollback()
+        assert writer._read_shared_version() == version
+
+    write(app, monkeypatch, writer, lambda: hotel.db.session.add(hotel.Room(
+        room_number='102', room_type='Deluxe', price_per_night=3500, capacity=2, description='Deluxe room'
+    )))
+
+    assert listed(app) == (['101', '102'], ['101', '102'])
+    assert 'Never saved' not in app.test_client().get('/rooms').get_data(as_text=True)
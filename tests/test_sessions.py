@@ -0,0 +1,72 @@
+"""
+Sessions: identity claims in a cookie signed with a stable key, one user lookup per request
+"""
+import os
+import stat
+from types import SimpleNamespace
+
+from conftest import ROOT, hotel
+from helpers import QueryCounter, assert_max_queries
+
+def make_app(monkeypatch, secret_key):
+    """Another worker's app, built the way gunicorn builds it"""
+    monkeypatch.setenv('SECRET_KEY', secret_key)
+    app = hotel.create_app({'TESTING': True})
+    app.template_folder = ROOT
+    return app
+
+def signed_in_cookie(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['user_id'] = user_id
+    return client.get_cookie('session').value
+
+def my_bookings_status(app, cookie):
+    client = app.test_client()
+    client.set_cookie('session', cookie)
+    return client.get('/my-bookings').status_code
+
+def test_session_from_one_worker_is_valid_in_another(app, make_user, monkeypatch):
+    user_id = make_user()
+    first = make_app(monkeypatch, 'shared-secret-key')
+    second = make_app(monkeypatch, 'shared-secret-key')
+    cookie = signed_in_cookie(first, user_id)
+
+    assert my_bookings_status(second, cookie) == 200
+    # A worker with another key sends the guest back to the login page
+    assert my_bookings_status(make_app(monkeypatch, 'other-secret-key'), cookie) == 302
+
+def test_key_file_is_created_once_and_reused(tmp_path, monkeypatch):
+    monkeypatch.delenv('SECRET_KEY', raising=False)
+    instance = SimpleNamespace(instance_path=str(tmp_path / 'instance'))
+
+    first = hotel.load_secret_key(instance)
+    second = hotel.load_secret_key(instance)
+
+    assert first == second
+    assert len(first) == 64
+    key_path = os.path.join(instance.instance_path, 'secret_key')
+    assert stat.S_IMODE(os.stat(key_path).st_mode) == 0o600
+    assert os.listdir(instance.instance_path) == ['secret_key']
+
+def test_current_user_is_fetched_at_most_once_per_request(app, make_user):
+    user_id = make_user()
+    for _ in range(2):
+        # Each request starts with an empty g, so each looks the user up once
+        with app.test_request_context(), QueryCounter() as queries:
+            hotel.session['user_id'] = user_id
+            users = [hotel.current_user() for _ in range(3)]
+
+        assert queries.count == 1
+        assert users[0].id == user_id
+        assert users[0] is users[1] is users[2]
+
+def test_login_user_sets_claims_and_needs_no_lookup(app, make_user):
+    user_id = make_user()
+    with app.test_request_context():
+        user = hotel.db.session.get(hotel.User, user_id)
+        hotel.login_user(user)
+
+        with assert_max_queries(0):
+            assert hotel.current_user() is user
+            assert hotel.current_identity() == {'id': user_id, 'name': 'Test User 0', 'phone': '+919800000000'}
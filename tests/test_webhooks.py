@@ -0,0 +1,188 @@
+"""
+Razorpay webhooks and stale-payment reconciliation
+"""
+import hashlib
+import hmac
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import func
+
+from conftest import hotel
+
+@pytest.fixture
+def guest(app, make_room, make_user, login):
+    """A user with a pending booking and an open Razorpay order for it"""
+    user_id = make_user()
+    room_id = make_room()
+    check_in = date.today() + timedelta(days=7)
+    with app.app_context():
+        booking_id = hotel.reserve_room(room_id, user_id, check_in, check_in + timedelta(days=2), guests=1)['booking'].id
+    client = login(user_id)
+    order_id = client.post(f'/payment/{booking_id}', json={'payment_method': 'razorpay'}).get_json()['razorpay_order_id']
+    return {'client': client, 'user_id': user_id, 'room_id': room_id, 'booking_id': booking_id,
+            'order_id': order_id, 'check_in': check_in}
+
+def deliver(app, event_type, order_id, payment_id, event_id=None):
+    """POST a signed webhook the way Razorpay does"""
+    body = json.dumps({
+        'event': event_type,
+        'payload': {'payment': {'entity': {'id': payment_id, 'order_id': order_id}}}
+    })
+    signature = hmac.new(hotel.RAZORPAY_WEBHOOK_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).hexdigest()
+    headers = {'X-Razorpay-Signature': signature, 'Content-Type': 'application/json'}
+    if event_id:
+        headers['X-Razorpay-Event-Id'] = event_id
+    response = app.test_client().post('/webhooks/razorpay', data=body, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+def process(app):
+    with app.app_context():
+        while hotel.payment_reconciler.process_webhook_batch():
+            pass
+
+def expire(app, booking_id):
+    with app.app_context():
+        booking = hotel.db.session.get(hotel.Booking, booking_id)
+        booking.created_at -= timedelta(minutes=hotel.BOOKING_HOLD_MINUTES + 1)
+        hotel.db.session.commit()
+        assert hotel.expiry_sweeper.run()['bookings_expired'] == 1
+
+def state(app, booking_id):
+    """(booking status, payment statuses, room nights held, emails queued)"""
+    with app.app_context():
+        return (
+            hotel.db.session.get(hotel.Booking, booking_id).status,
+            [payment.payment_status for payment in hotel.Payment.query.filter_by(booking_id=booking_id)],
+            hotel.RoomNight.query.filter_by(booking_id=booking_id).count(),
+            hotel.EmailOutbox.query.count()
+        )
+
+def test_capture_after_expiry_reclaims_free_nights(app, guest):
+    expire(app, guest['booking_id'])
+    capture = hotel.payment_gateway.capture(guest['order_id'])
+
+    deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'])
+    process(app)
+
+    assert state(app, guest['booking_id']) == ('confirmed', ['completed'], 2, 1)
+
+def test_capture_after_expiry_is_refunded_when_the_nights_are_gone(app, guest, make_user):
+    expire(app, guest['booking_id'])
+    with app.app_context():
+        other = hotel.reserve_room(guest['room_id'], make_user(1), guest['check_in'] + timedelta(days=1),
+                                   guest['check_in'] + timedelta(days=3), guests=1)['booking']
+        other_id = other.id
+    capture = hotel.payment_gateway.capture(guest['order_id'])
+
+    deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'])
+    process(app)
+
+    assert state(app, guest['booking_id']) == ('expired', ['refunded'], 0, 0)
+    with app.app_context():
+        assert hotel.RoomNight.query.filter_by(booking_id=other_id).count() == 2
+    assert [refund['payment_id'] for refund in hotel.payment_gateway.refunds][-1] == capture['razorpay_payment_id']
+
+def test_capture_for_a_cancelled_booking_is_never_reclaimed(app, guest):
+    with app.app_context():
+        hotel.mark_booking_cancelled(hotel.db.session.get(hotel.Booking, guest['booking_id']))
+        hotel.db.session.commit()
+    capture = hotel.payment_gateway.capture(guest['order_id'])
+
+    deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'])
+    process(app)
+
+    assert state(app, guest['booking_id']) == ('cancelled', ['refunded'], 0, 0)
+
+def test_stale_payment_reconciliation_reclaims_an_expired_booking(app, guest):
+    expire(app, guest['booking_id'])
+    hotel.payment_gateway.capture(guest['order_id'])
+    age = timedelta(minutes=hotel.RECONCILE_AFTER_MINUTES + 1)
+    hotel.payment_gateway._orders[guest['order_id']]['created_at'] -= int(age.total_seconds())
+    with app.app_context():
+        payment = hotel.Payment.query.one()
+        payment.created_at -= age
+        hotel.db.session.commit()
+
+        assert hotel.payment_reconciler.reconcile_stale_payments() == 1
+
+    assert state(app, guest['booking_id']) == ('confirmed', ['completed'], 2, 1)
+
+def assert_confirmed_once(app, booking_id):
+    """One confirmation: one completed payment, one email, one set of nights, counted once in daily_stats"""
+    assert state(app, booking_id) == ('confirmed', ['completed'], 2, 1)
+    with app.app_context():
+        assert hotel.db.session.query(func.sum(hotel.DailyStat.room_nights_sold)).scalar() == 2
+
+def test_redelivered_event_is_applied_once(app, guest):
+    capture = hotel.payment_gateway.capture(guest['order_id'])
+
+    first = deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_1')
+    second = deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_1')
+    process(app)
+    # A redelivery after processing is dropped by the inbox as well
+    third = deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_1')
+    process(app)
+
+    assert not first.get('duplicate') and second['duplicate'] and third['duplicate']
+    assert_confirmed_once(app, guest['booking_id'])
+
+def test_every_event_for_one_capture_confirms_once(app, guest):
+    capture = hotel.payment_gateway.capture(guest['order_id'])
+
+    deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_captured')
+    process(app)
+    deliver(app, 'order.paid', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_paid')
+    deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_captured_retry')
+    process(app)
+
+    assert_confirmed_once(app, guest['booking_id'])
+    with app.app_context():
+        assert {event.status for event in hotel.WebhookEvent.query} == {'processed'}
+
+def test_failure_delivered_after_the_capture_does_not_undo_it(app, guest):
+    capture = hotel.payment_gateway.capture(guest['order_id'])
+
+    deliver(app, 'order.paid', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_paid')
+    deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_captured')
+    deliver(app, 'payment.failed', guest['order_id'], 'pay_first_attempt', event_id='evt_failed')
+    process(app)
+
+    assert_confirmed_once(app, guest['booking_id'])
+
+def test_capture_delivered_after_a_failed_attempt_completes(app, guest):
+    deliver(app, 'payment.failed', guest['order_id'], 'pay_first_attempt', event_id='evt_failed')
+    process(app)
+    assert state(app, guest['booking_id'])[1] == ['failed']
+
+    capture = hotel.payment_gateway.capture(guest['order_id'])
+    deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'], event_id='evt_captured')
+    process(app)
+
+    assert_confirmed_once(app, guest['booking_id'])
+
+@pytest.mark.parametrize('attempt', range(5))
+def test_webhook_racing_verify_payment_confirms_once(app, guest, attempt):
+    capture = hotel.payment_gateway.capture(guest['order_id'])
+    deliver(app, 'payment.captured', guest['order_id'], capture['razorpay_payment_id'])
+    barrier = threading.Barrier(2)
+
+    def verify():
+        barrier.wait()
+        return guest['client'].post('/verify-payment', json=capture).status_code
+
+    def webhook():
+        barrier.wait()
+        process(app)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        verified = executor.submit(verify)
+        processed = executor.submit(webhook)
+        processed.result()
+        assert verified.result() == 200
+
+    assert_confirmed_once(app, guest['booking_id'])